@@ -0,0 +1,117 @@
+"""Check that the HTTP and embedded Todo backends behave the same, and time their calls.
+
+api.py is started under uvicorn and the embedded backend opens its own database,
+both fresh in a temporary directory. The same scripted session (the assistant's
+tools, bulk operations, a 304 revalidation and the error cases) runs against
+each; the results must match exactly. Then `--calls` sequential tool calls are
+timed per backend.
+
+    python benchmarks/bench_backends.py --calls 2000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from todo_backends import EmbeddedBackend, HTTPBackend, TodoAPIError
+from bench_todo_api import percentile, todo_api_server
+
+
+async def attempt(call):
+    try:
+        return await call
+    except TodoAPIError as e:
+        return {"error": e.status}
+
+
+async def scenario(backend, chat_id="1"):
+    """Exercise every backend method. Returns the observed results in order."""
+    results = []
+    record = results.append
+    first = await backend.create_task(chat_id, {"title": "Buy milk", "description": None, "completed": False})
+    record(first)
+    record(await backend.create_task(chat_id, {"title": "Call mum", "description": "Sunday", "completed": False}))
+    tasks, etag = await backend.list_tasks(chat_id, {"completed": False})
+    record(tasks)
+    record((await backend.list_tasks(chat_id, {"completed": False}, etag=etag))[0])
+    record(await backend.get_task(chat_id, first["id"]))
+    record(await backend.search_tasks(chat_id, {"q": "mum"}))
+    record(await backend.search_tasks(chat_id, {"q": "milk sunday", "limit": 5}))
+    record(await backend.update_task(chat_id, first["id"], {"title": None, "description": "2 litres", "completed": True}))
+    record(await backend.search_tasks(chat_id, {"q": "litre", "completed": True}))
+    record((await backend.list_tasks(chat_id, {"completed": True}))[0])
+    record((await backend.list_tasks(chat_id, {"limit": 1, "after_id": first["id"]}))[0])
+    record(await backend.bulk_create_tasks(chat_id, [{"title": "a"}, {"title": "b", "completed": True}]))
+    record(await backend.bulk_update_tasks(chat_id, [{"task_id": first["id"], "completed": False}, {"task_id": 999}]))
+    record(await backend.bulk_delete_tasks(chat_id, [first["id"], 999]))
+    record(await backend.delete_task(chat_id, first["id"] + 1))
+    record((await backend.list_tasks("another chat"))[0])
+    record(await attempt(backend.get_task(chat_id, first["id"])))
+    record(await attempt(backend.update_task(chat_id, 999, {"title": "x"})))
+    record(await attempt(backend.delete_task(chat_id, 999)))
+    record(await attempt(backend.create_task(chat_id, {"description": "no title"})))
+    record(await attempt(backend.bulk_delete_tasks(chat_id, [])))
+    record(await attempt(backend.search_tasks(chat_id, {"q": ""})))
+    record(await backend.search_tasks("another chat", {"q": "milk"}))
+    return results
+
+
+async def time_calls(backend, calls):
+    latencies = []
+    chat_id = "bench"
+    task = await backend.create_task(chat_id, {"title": "bench"})
+    operations = [
+        lambda: backend.list_tasks(chat_id, {"completed": False}),
+        lambda: backend.get_task(chat_id, task["id"]),
+        lambda: backend.update_task(chat_id, task["id"], {"completed": False}),
+    ]
+    for i in range(calls):
+        start = time.perf_counter()
+        await operations[i % len(operations)]()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name, latencies):
+    micros = [latency * 1e6 for latency in latencies]
+    print(f"{name:9s} {len(micros):6d} calls  mean {statistics.mean(micros):8.0f}us  "
+          f"p50 {percentile(micros, 50):8.0f}us  p95 {percentile(micros, 95):8.0f}us  p99 {percentile(micros, 99):8.0f}us")
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        http_dir = os.path.join(workdir, "http")
+        os.mkdir(http_dir)
+        async with todo_api_server(http_dir, args.port) as base_url:
+            http = HTTPBackend(base_url)
+            embedded = EmbeddedBackend(database_url=f"sqlite:///{os.path.join(workdir, 'embedded.db')}")
+            try:
+                await http.start()
+                await embedded.start()
+
+                http_results = await scenario(http)
+                embedded_results = await scenario(embedded)
+                for step, (expected, actual) in enumerate(zip(http_results, embedded_results)):
+                    if expected != actual:
+                        raise SystemExit(f"Backends disagree at step {step}:\n  http:     {expected}\n  embedded: {actual}")
+                print(f"Backends agree on all {len(http_results)} scenario steps")
+
+                report("http", await time_calls(http, args.calls))
+                report("embedded", await time_calls(embedded, args.calls))
+            finally:
+                await http.close()
+                await embedded.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=8461)
+    asyncio.run(main(parser.parse_args()))
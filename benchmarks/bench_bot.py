@@ -0,0 +1,222 @@
+"""End-to-end load test of the bot against local stand-ins for every outside service.
+
+The real bot module handles synthetic Telegram updates: message coalescing,
+scheduling, thread lookup, voice transcription, image upload, the assistant
+run and its tool calls, and the streamed reply. Telegram, the OpenAI
+Assistants API and fal are local fakes. The Todo API is the real
+todo-api/api.py under uvicorn with a fresh database. Every chat sends its next
+message once the previous one has been answered, after `--think-time` seconds.
+
+Message kinds (mix them with --mix):
+  text        a text message, answered after one get_tasks call
+  voice       a voice note: download, transcription, then one create_task call
+  image       a photo with a caption: download, upload, then one create_task call
+  multi_tool  a text message needing two rounds of two tool calls each
+  command     "list", answered by the fast path without an assistant run
+
+Latency runs from the update reaching the bot to its final reply being sent.
+
+    python benchmarks/bench_bot.py --chats 1 8 32 --messages 10 --mix text=60,voice=15,image=10,multi_tool=15
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_todo_api import percentile, todo_api_server
+from fake_fal import point_fal_client_at, start_fake_fal
+from fake_openai import LATENCY_PROFILES, start_fake_openai
+from fake_telegram import TOKEN, UpdateFactory, start_fake_telegram
+
+KINDS = ("text", "voice", "image", "multi_tool", "command")
+REPLY = "Sure, all done!"
+
+
+def tool_script(text):
+    """Tool-call rounds the fake assistant runs for a message, chosen by the marker in its text."""
+    if "#multi_tool" in text:
+        return [
+            [("get_tasks", {}), ("create_task", {"title": "Plan the week"})],
+            [("bulk_create_tasks", {"tasks": [{"title": "Gym"}, {"title": "Groceries"}]}), ("get_tasks", {})],
+        ]
+    if "#voice" in text or "#image" in text:
+        return [[("create_task", {"title": "Task from media"})]]
+    if "#text" in text:
+        return [[("get_tasks", {})]]
+    return []
+
+
+def parse_mix(value):
+    weights = {}
+    for item in value.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown message kind {kind!r}, expected one of {', '.join(KINDS)}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+class Harness:
+    def __init__(self, bot, telegram_bot, fakes, args):
+        self.bot = bot
+        self.telegram_bot = telegram_bot
+        self.fakes = fakes
+        self.args = args
+        self.factory = UpdateFactory()
+        self.random = random.Random(args.seed)
+        self.pending = {}
+        # The scheduler looks process_messages up at call time, so wrapping it here
+        # lets every update in a batch be marked answered when the batch is done
+        original = bot.process_messages
+
+        async def process_messages(updates):
+            try:
+                await original(updates)
+            finally:
+                for update in updates:
+                    done = self.pending.pop(update.update_id, None)
+                    if done is not None:
+                        done.set_result(time.perf_counter())
+
+        bot.process_messages = process_messages
+
+    def make_update(self, kind, chat_id):
+        if kind == "voice":
+            data = self.factory.voice(chat_id)
+        elif kind == "image":
+            data = self.factory.image(chat_id, caption="Add this receipt #image")
+        elif kind == "command":
+            data = self.factory.text(chat_id, "list")
+        elif kind == "multi_tool":
+            data = self.factory.text(chat_id, "Plan my week and add the usual errands #multi_tool")
+        else:
+            data = self.factory.text(chat_id, "What's on my list? #text")
+        return self.bot.Update.de_json(data, self.telegram_bot)
+
+    async def run_chat(self, chat_id, results):
+        kinds, weights = zip(*self.args.mix.items())
+        for _ in range(self.args.messages):
+            kind = self.random.choices(kinds, weights)[0]
+            update = self.make_update(kind, chat_id)
+            done = asyncio.get_running_loop().create_future()
+            self.pending[update.update_id] = done
+            start = time.perf_counter()
+            await self.bot.respond(update, None)
+            try:
+                finished = await asyncio.wait_for(done, self.args.timeout)
+            except asyncio.TimeoutError:
+                self.pending.pop(update.update_id, None)
+                results.append((kind, None))
+                continue
+            reply = self.fakes["telegram"].last_text.get(chat_id)
+            # Fast-path replies list the chat's tasks instead of the assistant's canned reply
+            ok = reply is not None and reply != REPLY if kind == "command" else reply == REPLY
+            results.append((kind, finished - start if ok else None))
+            await asyncio.sleep(self.args.think_time)
+
+    async def run(self, chats):
+        counters = {name: fake.request_count for name, fake in self.fakes.items()}
+        tool_calls = self.fakes["openai"].tool_call_count
+        results = []
+        start = time.perf_counter()
+        await asyncio.gather(*(self.run_chat(self.args.first_chat + c, results) for c in range(chats)))
+        elapsed = time.perf_counter() - start
+        requests = {name: fake.request_count - counters[name] for name, fake in self.fakes.items()}
+        return results, elapsed, requests, self.fakes["openai"].tool_call_count - tool_calls
+
+
+def report(chats, results, elapsed, requests, tool_calls):
+    answered = [latency for _, latency in results if latency is not None]
+    failed = len(results) - len(answered)
+    print(f"\n{chats} chats: {len(results)} messages in {elapsed:.2f}s = {len(answered) / elapsed:.1f} msg/s, {failed} failed")
+    print(f"  {'kind':10s} {'count':>6s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'mean':>8s}")
+    for kind in KINDS + ("all",):
+        latencies = [latency for k, latency in results if latency is not None and kind in (k, "all")]
+        if latencies:
+            print(f"  {kind:10s} {len(latencies):6d} {percentile(latencies, 50):8.3f} {percentile(latencies, 95):8.3f} "
+                  f"{percentile(latencies, 99):8.3f} {statistics.mean(latencies):8.3f}")
+    per_message = ", ".join(f"{name} {count / max(1, len(results)):.1f}" for name, count in requests.items())
+    print(f"  requests per message: {per_message}, tool calls {tool_calls / max(1, len(results)):.1f}")
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="bench_bot_")
+    database_url = f"sqlite:///{os.path.join(workdir, 'tasks.db')}"
+    async with todo_api_server(workdir, args.port) as base_url:
+        delays = dict(LATENCY_PROFILES[args.profile])
+        openai, openai_runner, openai_url = await start_fake_openai(
+            reply=REPLY, tool_script=tool_script, jitter=args.jitter, **delays
+        )
+        fal, fal_runner, fal_url = await start_fake_fal(latency=delays["latency"], transcribe_delay=args.transcribe_delay,
+                                                        transcript="Please add call the plumber #voice")
+        telegram, telegram_runner, telegram_url = await start_fake_telegram(latency=args.telegram_latency)
+        chat_ids = range(args.first_chat, args.first_chat + max(args.chats))
+        os.environ.update({
+            "OPENAI_BASE_URL": openai_url,
+            "OPENAI_API_KEY": "sk-bench",
+            "OPENAI_ASSISTANT_ID": "asst_bench",
+            "FAL_KEY": "bench",
+            "TELEGRAM_TOKEN": TOKEN,
+            "BASE_URL": base_url,
+            "TODO_DATABASE_URL": database_url,
+            "ALLOWED_CHATS": ",".join(str(chat_id) for chat_id in chat_ids),
+            "CHATS_DB": os.path.join(workdir, "chats.db"),
+        })
+        if args.burst_window is not None:
+            os.environ["BURST_WINDOW"] = str(args.burst_window)
+        point_fal_client_at(fal_url)
+
+        import bot
+        from burst_coalescer import BURST_WINDOW
+        from telegram import Bot
+        from telegram.request import HTTPXRequest
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+        telegram_bot = Bot(TOKEN, base_url=f"{telegram_url}/bot", base_file_url=f"{telegram_url}/file/bot",
+                           request=HTTPXRequest(connection_pool_size=256))
+        fakes = {"openai": openai, "fal": fal, "telegram": telegram}
+        try:
+            await telegram_bot.initialize()
+            await bot.post_init(None)
+            harness = Harness(bot, telegram_bot, fakes, args)
+            print(f"profile {args.profile}, mix {args.mix}, {args.messages} messages per chat, burst window {BURST_WINDOW}s")
+            for chats in args.chats:
+                # The bot prints every message and tool call; keep the report readable
+                with contextlib.redirect_stdout(io.StringIO()):
+                    outcome = await harness.run(chats)
+                report(chats, *outcome)
+        finally:
+            await bot.post_shutdown(None)
+            await telegram_bot.shutdown()
+            for runner in (openai_runner, fal_runner, telegram_runner):
+                await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--messages", type=int, default=10, help="messages sent by each chat")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("text=60,voice=15,image=10,multi_tool=15"))
+    parser.add_argument("--profile", choices=sorted(LATENCY_PROFILES), default="typical", help="fake OpenAI delays")
+    parser.add_argument("--jitter", type=float, default=0.2, help="spread every fake OpenAI delay by this fraction")
+    parser.add_argument("--transcribe-delay", type=float, default=0.5, help="fake fal transcription time (s)")
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="fake Telegram per-request latency (s)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pause before a chat's next message (s)")
+    parser.add_argument("--burst-window", type=float, default=None,
+                        help="BURST_WINDOW for the bot (s); the bot's own default when omitted")
+    parser.add_argument("--timeout", type=float, default=60.0, help="give up on a message after this long (s)")
+    parser.add_argument("--first-chat", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8462)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,63 @@
+"""Measure assistant-turn throughput as the number of concurrent chats grows.
+
+Runs the real TodoAPIHelper.stream_assistant_response against the local fake
+Assistants API. With a non-blocking client the turns of different chats overlap,
+so messages/second should rise roughly linearly with the chat count.
+
+    python benchmarks/bench_concurrency.py --chats 1 2 4 8 16 32 --messages 5
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_openai import start_fake_openai
+
+
+async def run_chat(helpers, client, chat_id, messages):
+    thread = await client.beta.threads.create()
+    calls = 0
+    for i in range(messages):
+        helper = helpers.TodoAPIHelper(chat_id, thread.id)
+        await helper.add_user_message(f"message {i}")
+        await helper.stream_assistant_response()
+        calls += helper.api_calls
+    return calls
+
+
+async def main(args):
+    fake, runner, base_url = await start_fake_openai(
+        latency=args.latency, run_delay=args.run_delay, token_delay=args.token_delay
+    )
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    os.environ.setdefault("OPENAI_ASSISTANT_ID", "asst_bench")
+    import helper_functions
+    logging.getLogger().setLevel(logging.WARNING)
+
+    client = helper_functions.client
+    print(f"{'chats':>6} {'messages':>9} {'seconds':>9} {'msg/s':>8} {'calls/msg':>10}")
+    try:
+        for chats in args.chats:
+            start = time.perf_counter()
+            calls = await asyncio.gather(*(run_chat(helper_functions, client, c, args.messages) for c in range(chats)))
+            elapsed = time.perf_counter() - start
+            total = chats * args.messages
+            print(f"{chats:>6} {total:>9} {elapsed:>9.2f} {total / elapsed:>8.1f} {sum(calls) / total:>10.1f}")
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--messages", type=int, default=5, help="messages sent by each chat")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake per-request latency (s)")
+    parser.add_argument("--run-delay", type=float, default=0.2, help="fake time before a run starts replying (s)")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="fake delay between text deltas (s)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,145 @@
+"""Per-turn latency of a long-lived chat with and without context management.
+
+Chats send many text messages one after another, like a heavy user over weeks.
+The fake assistant reads every message its truncation_strategy keeps and takes
+`--prompt-token-delay` seconds longer per prompt token, so an unbounded thread
+gets steadily slower the way a real one does. Three modes are compared:
+
+  off       no truncation and no rotation: the thread grows forever
+  truncate  runs read only the last RUN_TRUNCATE_LAST_MESSAGES messages
+  rotate    truncation plus thread rotation with a summary and task snapshot
+
+Latency and prompt tokens are reported for each fifth of the run.
+
+    python benchmarks/bench_context.py --turns 150 --chats 4
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_bot import REPLY, tool_script
+from bench_todo_api import todo_api_server
+from fake_openai import LATENCY_PROFILES, start_fake_openai
+from fake_telegram import TOKEN, UpdateFactory, start_fake_telegram
+
+MODES = ("off", "truncate", "rotate")
+
+
+def configure(mode, args):
+    import helper_functions
+    from thread_rotation import thread_rotator
+    if mode == "off":
+        helper_functions.TRUNCATION_STRATEGY = {"type": "auto"}
+    else:
+        helper_functions.TRUNCATION_STRATEGY = {"type": "last_messages", "last_messages": args.last_messages}
+    rotating = mode == "rotate"
+    thread_rotator.max_turns = args.max_turns if rotating else 0
+    thread_rotator.max_prompt_tokens = args.max_prompt_tokens if rotating else 0
+    thread_rotator.max_age = 0
+
+
+async def run_chat(bot, telegram_bot, factory, pending, chat_id, args, latencies):
+    for turn in range(args.turns):
+        text = f"Note {turn}: {'lorem ipsum ' * (args.padding // 12)}#text"
+        update = bot.Update.de_json(factory.text(chat_id, text), telegram_bot)
+        done = asyncio.get_running_loop().create_future()
+        pending[update.update_id] = done
+        start = time.perf_counter()
+        await bot.respond(update, None)
+        latencies[turn].append(await asyncio.wait_for(done, args.timeout) - start)
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="bench_context_")
+    async with todo_api_server(workdir, args.port) as base_url:
+        openai, openai_runner, openai_url = await start_fake_openai(
+            reply=REPLY, tool_script=tool_script, prompt_token_delay=args.prompt_token_delay, **LATENCY_PROFILES[args.profile]
+        )
+        telegram, telegram_runner, telegram_url = await start_fake_telegram(latency=0.01)
+        first_chats = {mode: args.first_chat + i * args.chats for i, mode in enumerate(MODES)}
+        os.environ.update({
+            "OPENAI_BASE_URL": openai_url,
+            "OPENAI_API_KEY": "sk-bench",
+            "OPENAI_ASSISTANT_ID": "asst_bench",
+            "TELEGRAM_TOKEN": TOKEN,
+            "BASE_URL": base_url,
+            "ALLOWED_CHATS": ",".join(str(args.first_chat + c) for c in range(len(MODES) * args.chats)),
+            "CHATS_DB": os.path.join(workdir, "chats.db"),
+            "BURST_WINDOW": "0",
+            "STREAM_REPLIES": "false",
+        })
+
+        import bot
+        from telegram import Bot
+        from thread_rotation import thread_rotator
+        logging.getLogger().setLevel(logging.WARNING)
+
+        telegram_bot = Bot(TOKEN, base_url=f"{telegram_url}/bot", base_file_url=f"{telegram_url}/file/bot")
+        pending = {}
+        original = bot.process_messages
+
+        async def process_messages(updates):
+            try:
+                await original(updates)
+            finally:
+                for update in updates:
+                    done = pending.pop(update.update_id, None)
+                    if done is not None:
+                        done.set_result(time.perf_counter())
+
+        bot.process_messages = process_messages
+        factory = UpdateFactory()
+        try:
+            await telegram_bot.initialize()
+            await bot.post_init(None)
+            print(f"{args.chats} chats x {args.turns} turns, {args.prompt_token_delay * 1000:.2f}ms per prompt token")
+            for mode in MODES:
+                configure(mode, args)
+                latencies = [[] for _ in range(args.turns)]
+                runs_before = len(openai.prompt_token_counts)
+                rotations_before = thread_rotator.rotations
+                with contextlib.redirect_stdout(io.StringIO()):
+                    await asyncio.gather(*(
+                        run_chat(bot, telegram_bot, factory, pending, first_chats[mode] + c, args, latencies)
+                        for c in range(args.chats)
+                    ))
+                tokens = openai.prompt_token_counts[runs_before:]
+                print(f"\n{mode}: {thread_rotator.rotations - rotations_before} rotations")
+                print(f"  {'turns':>9s} {'mean latency':>13s} {'prompt tokens':>14s}")
+                size = max(1, args.turns // 5)
+                for start in range(0, args.turns, size):
+                    block = [latency for turn in latencies[start:start + size] for latency in turn]
+                    block_tokens = tokens[start * args.chats:(start + size) * args.chats]
+                    print(f"  {start + 1:4d}-{min(args.turns, start + size):<4d} {statistics.mean(block):13.3f} "
+                          f"{statistics.mean(block_tokens):14.0f}")
+        finally:
+            await bot.post_shutdown(None)
+            await telegram_bot.shutdown()
+            for runner in (openai_runner, telegram_runner):
+                await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=150, help="messages sent by each chat")
+    parser.add_argument("--chats", type=int, default=4)
+    parser.add_argument("--padding", type=int, default=400, help="characters of filler in every message")
+    parser.add_argument("--prompt-token-delay", type=float, default=0.0001, help="fake run time per prompt token (s)")
+    parser.add_argument("--profile", choices=sorted(LATENCY_PROFILES), default="fast", help="fake OpenAI delays")
+    parser.add_argument("--last-messages", type=int, default=30, help="truncation window in the truncate and rotate modes")
+    parser.add_argument("--max-turns", type=int, default=60, help="THREAD_MAX_TURNS in the rotate mode")
+    parser.add_argument("--max-prompt-tokens", type=int, default=12000, help="THREAD_MAX_PROMPT_TOKENS in the rotate mode")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--first-chat", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8480)
+    asyncio.run(main(parser.parse_args()))
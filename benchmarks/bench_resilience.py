@@ -0,0 +1,192 @@
+"""Turn latency and replies while a dependency fails, with deadlines, retries and breakers.
+
+Chats alternate between "list" (answered by the fast path straight from the
+Todo API) and a text message the fake assistant answers after one get_tasks
+call. The Todo API is a small fake that can be switched to answer 503s or to
+hang; the fake OpenAI can be switched to hang every request. Phases run in order:
+
+  healthy         everything answers
+  todo_api 503    every Todo API request fails
+  recovered       the Todo API is back, after its breaker's reset timeout
+  todo_api hang   every Todo API request hangs
+  recovered
+  openai hang     every OpenAI request hangs
+  recovered
+
+While the Todo API is down the fake assistant still answers, as the failure
+reaches it as the get_tasks output; "list" gets the failure as its reply.
+
+For each phase the latency of every turn, what the users were told and the
+dependency stats (retries, fast failures, breaker state) are reported.
+
+    python benchmarks/bench_resilience.py --chats 8 --messages 4
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_bot import REPLY, tool_script
+from fake_openai import LATENCY_PROFILES, start_fake_openai
+from fake_telegram import TOKEN, UpdateFactory, start_fake_telegram
+
+PHASES = [
+    ("healthy", "ok", False),
+    ("todo_api 503", "error", False),
+    ("recovered", "ok", False),
+    ("todo_api hang", "hang", False),
+    ("recovered", "ok", False),
+    ("openai hang", "ok", True),
+    ("recovered", "ok", False),
+]
+
+
+class FakeTodoAPI:
+    """Answers task listings with an empty list, a 503 or never, depending on `mode`."""
+
+    def __init__(self):
+        self.mode = "ok"
+        self.requests = 0
+        self.app = web.Application()
+        self.app.add_routes([web.get("/api/tasks", self.list_tasks)])
+
+    async def list_tasks(self, request):
+        self.requests += 1
+        if self.mode == "hang":
+            await asyncio.sleep(3600)
+        if self.mode == "error":
+            return web.json_response({"detail": "Service unavailable"}, status=503)
+        return web.json_response([])
+
+
+def classify(text):
+    if text == REPLY or (text or "").startswith(("You have no open tasks", "Your open tasks")):
+        return "answered"
+    if "unavailable right now" in (text or "") or "having problems right now" in (text or ""):
+        return "unavailable"
+    if "took too long" in (text or ""):
+        return "too slow"
+    return "other error"
+
+
+async def run_chat(bot, telegram_bot, telegram, factory, pending, chat_id, args, latencies, replies):
+    for turn in range(args.messages):
+        text = "list" if turn % 2 == 0 else f"What's on my list? #text"
+        update = bot.Update.de_json(factory.text(chat_id, text), telegram_bot)
+        done = asyncio.get_running_loop().create_future()
+        pending[update.update_id] = done
+        start = time.perf_counter()
+        await bot.respond(update, None)
+        latencies.append(await asyncio.wait_for(done, args.timeout) - start)
+        replies[classify(telegram.last_text.get(chat_id))] += 1
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="bench_resilience_")
+    todo = FakeTodoAPI()
+    todo_runner = web.AppRunner(todo.app)
+    await todo_runner.setup()
+    site = web.TCPSite(todo_runner, "127.0.0.1", 0)
+    await site.start()
+    todo_port = site._server.sockets[0].getsockname()[1]
+    openai, openai_runner, openai_url = await start_fake_openai(
+        reply=REPLY, tool_script=tool_script, **LATENCY_PROFILES["fast"]
+    )
+    telegram, telegram_runner, telegram_url = await start_fake_telegram(latency=0.01)
+    os.environ.update({
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_ASSISTANT_ID": "asst_bench",
+        "TELEGRAM_TOKEN": TOKEN,
+        "BASE_URL": f"http://127.0.0.1:{todo_port}/api",
+        "ALLOWED_CHATS": ",".join(str(args.first_chat + c) for c in range(args.chats)),
+        "CHATS_DB": os.path.join(workdir, "chats.db"),
+        "BURST_WINDOW": "0",
+        "STREAM_REPLIES": "false",
+        "TASK_CACHE_TTL": "0",
+        "THREAD_MAX_TURNS": "0",
+        "THREAD_MAX_PROMPT_TOKENS": "0",
+        "TODO_API_TIMEOUT": str(args.deadline),
+        "OPENAI_TIMEOUT": str(args.deadline),
+        "OPENAI_STREAM_TIMEOUT": str(args.deadline * 2),
+        "TODO_API_BREAKER_RESET": str(args.breaker_reset),
+        "OPENAI_BREAKER_RESET": str(args.breaker_reset),
+    })
+
+    import bot
+    from resilience import DEPENDENCIES
+    from telegram import Bot
+    logging.getLogger().setLevel(logging.ERROR)
+
+    telegram_bot = Bot(TOKEN, base_url=f"{telegram_url}/bot", base_file_url=f"{telegram_url}/file/bot")
+    pending = {}
+    original = bot.process_messages
+
+    async def process_messages(updates):
+        try:
+            await original(updates)
+        finally:
+            for update in updates:
+                done = pending.pop(update.update_id, None)
+                if done is not None:
+                    done.set_result(time.perf_counter())
+
+    bot.process_messages = process_messages
+    factory = UpdateFactory()
+    latency = openai.latency
+    try:
+        await telegram_bot.initialize()
+        await bot.post_init(None)
+        print(f"{args.chats} chats x {args.messages} messages per phase, deadline {args.deadline}s, "
+              f"breaker reset {args.breaker_reset}s")
+        for phase, todo_mode, openai_hangs in PHASES:
+            if phase == "recovered":
+                # Let the breakers half-open again
+                await asyncio.sleep(args.breaker_reset)
+            todo.mode = todo_mode
+            openai.latency = 3600 if openai_hangs else latency
+            latencies, replies = [], Counter()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                await asyncio.gather(*(
+                    run_chat(bot, telegram_bot, telegram, factory, pending, args.first_chat + c, args, latencies, replies)
+                    for c in range(args.chats)
+                ))
+            elapsed = time.perf_counter() - start
+            print(f"\n{phase}: {len(latencies)} turns in {elapsed:.2f}s, latency p50 {statistics.median(latencies):.3f}s "
+                  f"max {max(latencies):.3f}s")
+            print(f"  replies: {dict(replies)}")
+            for dependency in DEPENDENCIES[:2]:
+                stats = dependency.stats()
+                state = "open" if stats["breaker_open"] else "half-open" if stats["breaker_half_open"] else "closed"
+                print(f"  {dependency.name:8s} breaker {state:9s} calls {stats['calls']:4d} failures {stats['failures']:3d} "
+                      f"retries {stats['retries']:3d} timeouts {stats['timeouts']:3d} rejected {stats['rejected']:3d}")
+    finally:
+        openai.latency = latency
+        await bot.post_shutdown(None)
+        await telegram_bot.shutdown()
+        for runner in (openai_runner, telegram_runner, todo_runner):
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=4, help="messages sent by each chat in every phase")
+    parser.add_argument("--deadline", type=float, default=1.0, help="TODO_API_TIMEOUT and OPENAI_TIMEOUT; runs get twice this (s)")
+    parser.add_argument("--breaker-reset", type=float, default=3.0, help="breaker reset timeout (s)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="give up on a message after this long (s)")
+    parser.add_argument("--first-chat", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
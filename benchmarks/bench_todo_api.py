@@ -0,0 +1,108 @@
+"""Compare request throughput of the sync (api.py) and async (async_api.py) Todo APIs.
+
+Each service is started under uvicorn with a fresh database in a temporary
+directory. `--chats` simulated chats then hammer it concurrently, each running
+the tool-call mix the assistant produces: create, list, get, update, delete.
+
+    python benchmarks/bench_todo_api.py --chats 300 --rounds 5
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+TODO_API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "todo-api")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def timed(latencies, call):
+    start = time.perf_counter()
+    async with call as response:
+        if response.status >= 400:
+            raise Exception(f"HTTP error {response.status}: {await response.text()}")
+        body = await response.json()
+    latencies.append(time.perf_counter() - start)
+    return body
+
+
+async def run_chat(session, base_url, chat_id, rounds, latencies):
+    headers = {"chat-id": str(chat_id)}
+    for i in range(rounds):
+        task = await timed(latencies, session.post(f"{base_url}/tasks", json={"title": f"task {i}"}, headers=headers))
+        await timed(latencies, session.get(f"{base_url}/tasks", params={"completed": "false"}, headers=headers))
+        await timed(latencies, session.get(f"{base_url}/tasks/{task['id']}", headers=headers))
+        await timed(latencies, session.put(f"{base_url}/tasks/{task['id']}", json={"completed": True}, headers=headers))
+        await timed(latencies, session.delete(f"{base_url}/tasks/{task['id']}", headers=headers))
+
+
+async def wait_until_up(base_url, timeout=15):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{base_url}/tasks", headers={"chat-id": "0"}) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not start")
+
+
+@contextlib.asynccontextmanager
+async def todo_api_server(workdir, port, module="api"):
+    """Run `module`:app under uvicorn on `port`, with its database in `workdir`; yields its base URL once it answers."""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--app-dir", TODO_API_DIR,
+         "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'tasks.db')}"),
+    )
+    base_url = f"http://127.0.0.1:{port}/api"
+    try:
+        await wait_until_up(base_url)
+        yield base_url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def bench(module, port, args):
+    with tempfile.TemporaryDirectory() as workdir:
+        async with todo_api_server(workdir, port, module) as base_url:
+            latencies = []
+            connector = aiohttp.TCPConnector(limit=args.chats)
+            async with aiohttp.ClientSession(connector=connector) as session:
+                start = time.perf_counter()
+                await asyncio.gather(*(run_chat(session, base_url, c, args.rounds, latencies) for c in range(args.chats)))
+                elapsed = time.perf_counter() - start
+
+    print(f"{module:>10} {len(latencies):>9} {elapsed:>8.2f} {len(latencies) / elapsed:>8.0f} "
+          f"{statistics.median(latencies) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+          f"{percentile(latencies, 99) * 1000:>8.1f}")
+
+
+async def main(args):
+    print(f"{args.chats} concurrent chats, {args.rounds} rounds of 5 requests each")
+    print(f"{'service':>10} {'requests':>9} {'seconds':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for i, module in enumerate(args.services):
+        await bench(module, args.port + i, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8460)
+    parser.add_argument("--services", nargs="+", default=["api", "async_api"])
+    asyncio.run(main(parser.parse_args()))
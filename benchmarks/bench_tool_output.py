@@ -0,0 +1,57 @@
+"""Size and encoding cost of tool outputs in each TOOL_OUTPUT_FORMAT.
+
+Encodes synthetic get_tasks results (a third of the tasks with a long
+description) the way TodoAPIHelper sends them to the assistant, and reports
+estimated tokens per output next to the old str() encoding.
+
+    python benchmarks/bench_tool_output.py --tasks 10 100 500
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tool_output import encode_tool_output, estimate_tokens
+
+WORDS = "call email buy book fix plan pay review send clean renew order pick water schedule".split()
+
+
+def make_tasks(count, rng):
+    tasks = []
+    for task_id in range(1, count + 1):
+        description = None
+        if task_id % 3 == 0:
+            description = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 80)))
+        tasks.append({
+            "id": task_id,
+            "title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).capitalize(),
+            "description": description,
+            "completed": False,
+        })
+    return tasks
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    print(f"{'tasks':>6s} {'format':>6s} {'tokens':>8s} {'saved':>7s} {'encode':>9s}")
+    for count in args.tasks:
+        tasks = make_tasks(count, rng)
+        baseline = estimate_tokens(str(tasks))
+        for output_format in ("repr", "json", "table"):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                output = encode_tool_output(tasks, omit=("completed",), output_format=output_format)
+            elapsed = (time.perf_counter() - start) / args.repeat
+            tokens = estimate_tokens(output)
+            print(f"{count:6d} {output_format:>6s} {tokens:8d} {1 - tokens / baseline:7.0%} {elapsed * 1e6:7.0f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,160 @@
+"""Throughput of webhook mode as the number of bot worker processes grows.
+
+Runs `bot.py webhook` (the update router plus BOT_WORKERS local workers)
+against the fake Telegram and OpenAI APIs and the real todo-api/api.py. Each
+chat posts an update to the router the way Telegram delivers a webhook, then
+waits for its reply before sending the next. Workers keep chat -> thread
+mappings in the Todo API (THREAD_STORE=todo-api), so the run also checks that
+every chat got exactly one OpenAI thread however its updates were routed.
+
+Message kinds are those of bench_bot.py that need no media: text and multi_tool.
+With a fast fake assistant the bot's own CPU time dominates, which is what
+extra workers spread over more cores.
+
+    python benchmarks/bench_webhook.py --workers 1 2 4 --chats 64 --messages 10 --profile fast
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_bot import REPLY, tool_script
+from bench_todo_api import percentile, todo_api_server
+from fake_openai import LATENCY_PROFILES, start_fake_openai
+from fake_telegram import TOKEN, UpdateFactory, start_fake_telegram
+
+SECRET = "bench-secret"
+
+
+async def wait_for_router(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{url}/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Router at {url} did not start")
+
+
+async def run_chat(session, router_url, factory, replies, chat_id, args, rng, results):
+    for _ in range(args.messages):
+        kind = "multi_tool" if rng.random() < args.multi_tool else "text"
+        text = "Plan my week and add the usual errands #multi_tool" if kind == "multi_tool" else "What's on my list? #text"
+        reply = asyncio.get_running_loop().create_future()
+        replies[chat_id] = reply
+        start = time.perf_counter()
+        async with session.post(f"{router_url}/telegram", json=factory.text(chat_id, text),
+                                headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as response:
+            if response.status != 200:
+                results.append((kind, None))
+                continue
+        try:
+            text = await asyncio.wait_for(reply, args.timeout)
+        except asyncio.TimeoutError:
+            results.append((kind, None))
+            continue
+        results.append((kind, time.perf_counter() - start if text == REPLY else None))
+
+
+async def bench(workers, args, fakes, env):
+    telegram, openai = fakes["telegram"], fakes["openai"]
+    router = subprocess.Popen([sys.executable, os.path.join(ROOT, "bot.py"), "webhook"],
+                              env=dict(env, BOT_WORKERS=str(workers)), stderr=subprocess.DEVNULL)
+    router_url = f"http://127.0.0.1:{env['WEBHOOK_PORT']}"
+    replies = {}
+
+    def on_text(chat_id, text):
+        reply = replies.get(chat_id)
+        if reply is not None and not reply.done():
+            reply.set_result(text)
+
+    telegram.on_text = on_text
+    threads_before = len(openai.threads)
+    try:
+        await wait_for_router(router_url)
+        results = []
+        rng = random.Random(args.seed)
+        start = time.perf_counter()
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(
+                run_chat(session, router_url, fakes["factory"], replies, args.first_chat + c, args, rng, results)
+                for c in range(args.chats)
+            ))
+        elapsed = time.perf_counter() - start
+    finally:
+        router.terminate()
+        router.wait()
+        telegram.on_text = None
+
+    answered = [latency for _, latency in results if latency is not None]
+    threads = len(openai.threads) - threads_before
+    print(f"{workers:3d} workers: {len(answered) / elapsed:7.1f} msg/s, p50 {percentile(answered, 50):.3f}s, "
+          f"p95 {percentile(answered, 95):.3f}s, {len(results) - len(answered)} failed, {threads} new threads")
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="bench_webhook_")
+    async with todo_api_server(workdir, args.port) as base_url:
+        openai, openai_runner, openai_url = await start_fake_openai(
+            reply=REPLY, tool_script=tool_script, jitter=args.jitter, **LATENCY_PROFILES[args.profile]
+        )
+        telegram, telegram_runner, telegram_url = await start_fake_telegram(latency=args.telegram_latency)
+        chat_ids = range(args.first_chat, args.first_chat + args.chats)
+        env = dict(
+            os.environ,
+            OPENAI_BASE_URL=openai_url,
+            OPENAI_API_KEY="sk-bench",
+            OPENAI_ASSISTANT_ID="asst_bench",
+            TELEGRAM_TOKEN=TOKEN,
+            TELEGRAM_API_URL=telegram_url,
+            BASE_URL=base_url,
+            ALLOWED_CHATS=",".join(str(chat_id) for chat_id in chat_ids),
+            CHATS_DB=os.path.join(workdir, "chats.db"),
+            THREAD_STORE="todo-api",
+            BURST_WINDOW="0",
+            STREAM_REPLIES="false",
+            WEBHOOK_SECRET=SECRET,
+            WEBHOOK_LISTEN="127.0.0.1",
+            WEBHOOK_PORT=str(args.port + 1),
+            WORKER_BASE_PORT=str(args.port + 10),
+            METRICS_PORT="0",
+        )
+        env.pop("WEBHOOK_URL", None)
+        env.pop("WORKER_URLS", None)
+        fakes = {"openai": openai, "telegram": telegram, "factory": UpdateFactory()}
+        try:
+            print(f"profile {args.profile}, {args.chats} chats x {args.messages} messages, {os.cpu_count()} CPUs")
+            for workers in args.workers:
+                await bench(workers, args, fakes, env)
+        finally:
+            for runner in (openai_runner, telegram_runner):
+                await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chats", type=int, default=64)
+    parser.add_argument("--messages", type=int, default=10, help="messages sent by each chat")
+    parser.add_argument("--multi-tool", type=float, default=0.2, help="fraction of multi_tool messages")
+    parser.add_argument("--profile", choices=sorted(LATENCY_PROFILES), default="fast", help="fake OpenAI delays")
+    parser.add_argument("--jitter", type=float, default=0.2, help="spread every fake OpenAI delay by this fraction")
+    parser.add_argument("--telegram-latency", type=float, default=0.01, help="fake Telegram per-request latency (s)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="give up on a message after this long (s)")
+    parser.add_argument("--first-chat", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=8470)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
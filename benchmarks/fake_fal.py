@@ -0,0 +1,89 @@
+"""Stand-in for fal.ai's CDN upload and queue API, enough for generate_transcript.
+
+Uploads are accepted and discarded. A submitted request reports IN_PROGRESS
+until `transcribe_delay` seconds have passed and then returns `transcript`.
+fal_client has its hosts baked in, so `point_fal_client_at(base_url)` redirects
+the installed client to this server.
+"""
+import asyncio
+import itertools
+import time
+
+from aiohttp import web
+
+_ids = itertools.count(1)
+
+
+class FakeFal:
+    def __init__(self, latency=0.05, transcribe_delay=0.5, transcript="Please add call the plumber to my list"):
+        self.latency = latency
+        self.transcribe_delay = transcribe_delay
+        self.transcript = transcript
+        self.requests = {}
+        self.request_count = 0
+        self.uploads = 0
+        self.bytes_uploaded = 0
+        self.transcriptions = 0
+        self.base_url = None
+
+        self.app = web.Application(middlewares=[self._latency_middleware])
+        self.app.add_routes([
+            web.post("/files/upload", self.upload),
+            web.post("/queue/{owner}/{app}", self.submit),
+            web.get("/queue/requests/{request_id}/status", self.status),
+            web.get("/queue/requests/{request_id}", self.result),
+        ])
+
+    @web.middleware
+    async def _latency_middleware(self, request, handler):
+        self.request_count += 1
+        await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    async def upload(self, request):
+        body = await request.read()
+        self.uploads += 1
+        self.bytes_uploaded += len(body)
+        return web.json_response({"access_url": f"{self.base_url}/files/upload-{next(_ids)}"})
+
+    async def submit(self, request):
+        await request.json()
+        request_id = f"req-{next(_ids)}"
+        self.requests[request_id] = time.monotonic() + self.transcribe_delay
+        self.transcriptions += 1
+        url = f"{self.base_url}/queue/requests/{request_id}"
+        return web.json_response({
+            "request_id": request_id,
+            "response_url": url,
+            "status_url": f"{url}/status",
+            "cancel_url": f"{url}/cancel",
+        })
+
+    async def status(self, request):
+        ready_at = self.requests[request.match_info["request_id"]]
+        if time.monotonic() < ready_at:
+            return web.json_response({"status": "IN_PROGRESS", "logs": []})
+        return web.json_response({"status": "COMPLETED", "logs": [], "metrics": {}})
+
+    async def result(self, request):
+        self.requests.pop(request.match_info["request_id"], None)
+        return web.json_response({"text": self.transcript, "chunks": []})
+
+
+def point_fal_client_at(base_url):
+    import fal_client.client
+    fal_client.client.CDN_URL = base_url
+    fal_client.client.QUEUE_URL_FORMAT = f"{base_url}/queue/"
+    fal_client.client.RUN_URL_FORMAT = f"{base_url}/run/"
+
+
+async def start_fake_fal(host="127.0.0.1", port=0, **kwargs):
+    """Start the fake fal API in the running loop and return (fake, runner, base_url)."""
+    fake = FakeFal(**kwargs)
+    runner = web.AppRunner(fake.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    fake.base_url = f"http://{host}:{port}"
+    return fake, runner, fake.base_url
@@ -0,0 +1,349 @@
+"""Scripted stand-in for the OpenAI Assistants API.
+
+Only the endpoints the bot uses are implemented. Every request waits `latency`
+seconds before answering and runs stream their reply in `chunks` deltas spaced
+`token_delay` seconds apart, so concurrency effects show up without any
+network access or API spend. When `tool_calls` is given as a list of
+(name, arguments) pairs, every run first stops in requires_action with those
+calls and replies once the outputs are submitted.
+
+`tool_script(text)` scripts runs per message instead: it receives the text of
+the thread's latest user message and returns a list of rounds, each a list of
+(name, arguments) pairs, so one run can require several rounds of tool calls.
+`jitter` spreads every delay uniformly by that fraction; LATENCY_PROFILES has
+named presets for the three delays.
+
+Runs read the messages their truncation_strategy keeps, report their size as
+usage.prompt_tokens (about four characters a token) and, with
+`prompt_token_delay`, take that much longer per prompt token, so long threads
+get slower the way real ones do. Chat completions (used for thread summaries)
+answer with `summary`.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from aiohttp import web
+
+_ids = itertools.count(1)
+
+LATENCY_PROFILES = {
+    "fast": {"latency": 0.01, "run_delay": 0.05, "token_delay": 0.005},
+    "typical": {"latency": 0.05, "run_delay": 0.2, "token_delay": 0.02},
+    "slow": {"latency": 0.2, "run_delay": 1.0, "token_delay": 0.05},
+}
+
+
+def _new_id(prefix):
+    return f"{prefix}_{next(_ids):08d}"
+
+
+class FakeAssistants:
+    def __init__(self, latency=0.05, run_delay=0.2, token_delay=0.02, reply="Sure, all done!", chunks=4, tool_calls=None,
+                 tool_script=None, jitter=0.0, prompt_token_delay=0.0, summary="The user keeps a to-do list."):
+        self.latency = latency
+        self.run_delay = run_delay
+        self.token_delay = token_delay
+        self.reply = reply
+        self.chunks = chunks
+        self.tool_calls = tool_calls or []
+        self.tool_script = tool_script
+        self.jitter = jitter
+        self.prompt_token_delay = prompt_token_delay
+        self.summary = summary
+        self.truncation_strategies = []
+        self.prompt_token_counts = []
+        self.run_prompt_tokens = {}
+        self.summaries = 0
+        self.tool_outputs = []
+        self.threads = {}
+        self.runs = {}
+        self.tool_steps = {}
+        self.pending_rounds = {}
+        self.request_count = 0
+        self.tool_call_count = 0
+
+        self.app = web.Application(middlewares=[self._latency_middleware])
+        self.app.add_routes([
+            web.post("/v1/threads", self.create_thread),
+            web.post("/v1/threads/{thread_id}/messages", self.create_message),
+            web.get("/v1/threads/{thread_id}/messages", self.list_messages),
+            web.post("/v1/threads/{thread_id}/runs", self.create_run),
+            web.get("/v1/threads/{thread_id}/runs/{run_id}", self.retrieve_run),
+            web.post("/v1/threads/{thread_id}/runs/{run_id}/submit_tool_outputs", self.submit_tool_outputs),
+            web.post("/v1/threads/{thread_id}/runs/{run_id}/cancel", self.cancel_run),
+            web.post("/v1/chat/completions", self.chat_completion),
+            web.post("/v1/files", self.create_file),
+            web.delete("/v1/files/{file_id}", self.delete_file),
+        ])
+
+    @web.middleware
+    async def _latency_middleware(self, request, handler):
+        self.request_count += 1
+        await self._sleep(self.latency)
+        return await handler(request)
+
+    async def _sleep(self, delay):
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        await asyncio.sleep(delay)
+
+    def _rounds_for(self, thread_id):
+        if self.tool_script is None:
+            return [self.tool_calls] if self.tool_calls else []
+        for message in reversed(self.threads.get(thread_id, [])):
+            if message["role"] == "user":
+                text = " ".join(part["text"]["value"] for part in message["content"] if part["type"] == "text")
+                return [calls for calls in self.tool_script(text) if calls]
+        return []
+
+    # Object builders
+
+    def _message(self, thread_id, role, content, run_id=None, status="completed"):
+        if isinstance(content, str):
+            content = [{"type": "text", "text": {"value": content, "annotations": []}}]
+        # Request text parts carry a plain string, message objects a text object
+        content = [
+            dict(part, text={"value": part["text"], "annotations": []}) if isinstance(part.get("text"), str) else part
+            for part in content
+        ]
+        return {
+            "id": _new_id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "content": content,
+            "assistant_id": None if role == "user" else "asst_fake",
+            "run_id": run_id,
+            "attachments": [],
+            "metadata": {},
+            "status": status,
+        }
+
+    def _run(self, thread_id, status):
+        return {
+            "id": _new_id("run"),
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "assistant_id": "asst_fake",
+            "status": status,
+            "required_action": None,
+            "last_error": None,
+            "model": "gpt-4o",
+            "instructions": "",
+            "tools": [],
+            "metadata": {},
+            "parallel_tool_calls": True,
+        }
+
+    # Handlers
+
+    async def create_thread(self, request):
+        thread_id = _new_id("thread")
+        body = await request.json() if request.can_read_body else {}
+        self.threads[thread_id] = [
+            self._message(thread_id, message.get("role", "user"), message["content"]) for message in body.get("messages") or []
+        ]
+        return web.json_response({"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}})
+
+    async def create_message(self, request):
+        thread_id = request.match_info["thread_id"]
+        body = await request.json()
+        message = self._message(thread_id, body.get("role", "user"), body["content"])
+        self.threads.setdefault(thread_id, []).append(message)
+        return web.json_response(message)
+
+    async def list_messages(self, request):
+        thread_id = request.match_info["thread_id"]
+        data = list(reversed(self.threads.get(thread_id, [])))
+        return web.json_response({
+            "object": "list",
+            "data": data,
+            "first_id": data[0]["id"] if data else None,
+            "last_id": data[-1]["id"] if data else None,
+            "has_more": False,
+        })
+
+    async def retrieve_run(self, request):
+        return web.json_response(self.runs[request.match_info["run_id"]])
+
+    async def cancel_run(self, request):
+        run = self.runs[request.match_info["run_id"]]
+        run["status"] = "cancelled"
+        self.pending_rounds.pop(run["id"], None)
+        self.run_prompt_tokens.pop(run["id"], None)
+        return web.json_response(run)
+
+    async def create_file(self, request):
+        await request.read()
+        return web.json_response({
+            "id": _new_id("file"),
+            "object": "file",
+            "bytes": request.content_length or 0,
+            "created_at": int(time.time()),
+            "filename": "upload",
+            "purpose": "assistants",
+            "status": "processed",
+        })
+
+    async def delete_file(self, request):
+        return web.json_response({"id": request.match_info["file_id"], "object": "file", "deleted": True})
+
+    def _prompt_tokens(self, thread_id, truncation_strategy, additional_instructions=None):
+        messages = self.threads.get(thread_id, [])
+        if truncation_strategy and truncation_strategy.get("type") == "last_messages":
+            messages = messages[-truncation_strategy["last_messages"]:]
+        chars = sum(len(part["text"]["value"]) for message in messages for part in message["content"] if part["type"] == "text")
+        chars += len(additional_instructions or "")
+        return 500 + chars // 4
+
+    async def create_run(self, request):
+        thread_id = request.match_info["thread_id"]
+        body = await request.json()
+        self.truncation_strategies.append(body.get("truncation_strategy"))
+        run = self._run(thread_id, "queued")
+        run["usage"] = None
+        self.run_prompt_tokens[run["id"]] = self._prompt_tokens(
+            thread_id, body.get("truncation_strategy"), body.get("additional_instructions"))
+        self.prompt_token_counts.append(self.run_prompt_tokens[run["id"]])
+        self.runs[run["id"]] = run
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await self._send(response, "thread.run.created", run)
+        await self._send(response, "thread.run.queued", run)
+        run["status"] = "in_progress"
+        await self._send(response, "thread.run.in_progress", run)
+        await self._sleep(self.run_delay + self.prompt_token_delay * self.run_prompt_tokens[run["id"]])
+        rounds = self._rounds_for(thread_id)
+        if rounds:
+            self.pending_rounds[run["id"]] = rounds[1:]
+            await self._stream_tool_calls(response, run, rounds[0])
+        else:
+            await self._stream_reply(response, run)
+        await response.write(b"event: done\ndata: [DONE]\n\n")
+        return response
+
+    async def submit_tool_outputs(self, request):
+        run = self.runs[request.match_info["run_id"]]
+        body = await request.json()
+        self.tool_outputs.extend(body["tool_outputs"])
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        step = self.tool_steps.pop(run["id"])
+        step["status"] = "completed"
+        await self._send(response, "thread.run.step.completed", step)
+        run["status"] = "queued"
+        run["required_action"] = None
+        await self._send(response, "thread.run.queued", run)
+        run["status"] = "in_progress"
+        await self._send(response, "thread.run.in_progress", run)
+        await self._sleep(self.run_delay)
+        rounds = self.pending_rounds.pop(run["id"], [])
+        if rounds:
+            self.pending_rounds[run["id"]] = rounds[1:]
+            await self._stream_tool_calls(response, run, rounds[0])
+        else:
+            await self._stream_reply(response, run)
+        await response.write(b"event: done\ndata: [DONE]\n\n")
+        return response
+
+    async def _stream_tool_calls(self, response, run, tool_calls):
+        calls = [
+            {"id": _new_id("call"), "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+            for name, arguments in tool_calls
+        ]
+        self.tool_call_count += len(calls)
+        step = {
+            "id": _new_id("step"),
+            "object": "thread.run.step",
+            "run_id": run["id"],
+            "thread_id": run["thread_id"],
+            "assistant_id": "asst_fake",
+            "type": "tool_calls",
+            "status": "in_progress",
+            "step_details": {"type": "tool_calls", "tool_calls": []},
+        }
+        await self._send(response, "thread.run.step.created", step)
+        for index, call in enumerate(calls):
+            delta = {"id": step["id"], "object": "thread.run.step.delta", "delta": {"step_details": {
+                "type": "tool_calls",
+                "tool_calls": [dict(call, index=index, function=dict(call["function"], output=None))],
+            }}}
+            await self._send(response, "thread.run.step.delta", delta)
+            await self._sleep(self.token_delay)
+        step["step_details"]["tool_calls"] = calls
+        run["status"] = "requires_action"
+        run["required_action"] = {"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": calls}}
+        await self._send(response, "thread.run.requires_action", run)
+        self.tool_steps[run["id"]] = step
+
+    async def _stream_reply(self, response, run):
+        thread_id = run["thread_id"]
+        message = self._message(thread_id, "assistant", [], run_id=run["id"], status="in_progress")
+        step = {
+            "id": _new_id("step"),
+            "object": "thread.run.step",
+            "run_id": run["id"],
+            "thread_id": thread_id,
+            "assistant_id": "asst_fake",
+            "type": "message_creation",
+            "status": "in_progress",
+            "step_details": {"type": "message_creation", "message_creation": {"message_id": message["id"]}},
+        }
+        await self._send(response, "thread.run.step.created", step)
+        await self._send(response, "thread.message.created", message)
+
+        words = self.reply.split(" ")
+        size = max(1, -(-len(words) // self.chunks))
+        for i in range(0, len(words), size):
+            piece = " ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+            delta = {"id": message["id"], "object": "thread.message.delta", "delta": {"content": [
+                {"index": 0, "type": "text", "text": {"value": piece, "annotations": []}},
+            ]}}
+            await self._send(response, "thread.message.delta", delta)
+            await self._sleep(self.token_delay)
+
+        message["status"] = "completed"
+        message["content"] = [{"type": "text", "text": {"value": self.reply, "annotations": []}}]
+        self.threads.setdefault(thread_id, []).append(message)
+        await self._send(response, "thread.message.completed", message)
+        step["status"] = "completed"
+        await self._send(response, "thread.run.step.completed", step)
+        run["status"] = "completed"
+        prompt_tokens = self.run_prompt_tokens.pop(run["id"])
+        run["usage"] = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)}
+        await self._send(response, "thread.run.completed", run)
+
+    async def chat_completion(self, request):
+        await request.json()
+        self.summaries += 1
+        return web.json_response({
+            "id": _new_id("chatcmpl"),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o-mini",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": self.summary}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    async def _send(self, response, event, data):
+        await response.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+
+
+async def start_fake_openai(host="127.0.0.1", port=0, **kwargs):
+    """Start the fake API in the running loop and return (fake, runner, base_url)."""
+    fake = FakeAssistants(**kwargs)
+    runner = web.AppRunner(fake.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return fake, runner, f"http://{host}:{port}/v1"
+
+
+if __name__ == "__main__":
+    web.run_app(FakeAssistants().app, host="127.0.0.1", port=8446)
@@ -0,0 +1,149 @@
+"""Stand-in for the Telegram Bot API and a generator of synthetic updates.
+
+FakeTelegram serves the Bot API methods the bot uses (getMe, getFile,
+sendMessage, editMessageText) and the file downloads behind getFile, so real
+python-telegram-bot objects can be used unchanged. UpdateFactory builds update
+payloads for text, voice and image messages that `telegram.Update.de_json`
+turns into the same objects the bot receives from polling.
+"""
+import asyncio
+import io
+import itertools
+import json
+import os
+import time
+
+from aiohttp import web
+
+TOKEN = "123456:bench"
+
+
+def sample_image(width=1600, height=1200):
+    """A JPEG to serve for photo downloads; random noise if Pillow isn't installed."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return os.urandom(300 * 1024)
+    image = Image.effect_noise((width, height), 40).convert("RGB")
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.03, voice_bytes=24 * 1024, image=None):
+        self.latency = latency
+        self.voice = os.urandom(voice_bytes)
+        self.image = image if image is not None else sample_image()
+        self._message_ids = itertools.count(1_000_000)
+        self.calls = {}
+        self.last_text = {}
+        self.request_count = 0
+        # Called with (chat_id, text) for every message sent or edited
+        self.on_text = None
+
+        self.app = web.Application(middlewares=[self._latency_middleware])
+        self.app.add_routes([
+            web.post(f"/bot{TOKEN}/{{method}}", self.method),
+            # PTB percent-encodes the token in file URLs, so match it loosely
+            web.get("/file/{token}/{kind}/{name}", self.download),
+        ])
+
+    @web.middleware
+    async def _latency_middleware(self, request, handler):
+        self.request_count += 1
+        await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    @staticmethod
+    async def _params(request):
+        # python-telegram-bot form-encodes every parameter as a JSON value
+        params = {}
+        for key, value in (await request.post()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    def _message(self, chat_id, text, message_id=None):
+        return {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": int(TOKEN.split(":")[0]), "is_bot": True, "first_name": "Bench bot"},
+            "text": text,
+        }
+
+    def _record(self, chat_id, text):
+        self.last_text[chat_id] = text
+        if self.on_text is not None:
+            self.on_text(chat_id, text)
+
+    async def method(self, request):
+        name = request.match_info["method"]
+        self.calls[name] = self.calls.get(name, 0) + 1
+        params = await self._params(request)
+        if name == "getMe":
+            result = {"id": int(TOKEN.split(":")[0]), "is_bot": True, "first_name": "Bench bot", "username": "bench_bot"}
+        elif name == "getFile":
+            file_id = params["file_id"]
+            kind = "voice" if file_id.startswith("voice") else "photos"
+            result = {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_path": f"{kind}/{file_id}"}
+        elif name == "sendMessage":
+            self._record(params["chat_id"], params["text"])
+            result = self._message(params["chat_id"], params["text"])
+        elif name == "editMessageText":
+            self._record(params["chat_id"], params["text"])
+            result = self._message(params["chat_id"], params["text"], params["message_id"])
+        else:
+            return web.json_response({"ok": False, "error_code": 404, "description": f"Not Found: {name}"}, status=404)
+        return web.json_response({"ok": True, "result": result})
+
+    async def download(self, request):
+        body = self.voice if request.match_info["kind"] == "voice" else self.image
+        return web.Response(body=body, content_type="application/octet-stream")
+
+
+class UpdateFactory:
+    """Builds Bot API update payloads. Every voice note and image gets a fresh file ID."""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _update(self, chat_id, **message):
+        update_id = next(self._ids)
+        return {
+            "update_id": update_id,
+            "message": dict({
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            }, **message),
+        }
+
+    def text(self, chat_id, text):
+        return self._update(chat_id, text=text)
+
+    def voice(self, chat_id, duration=4):
+        n = next(self._ids)
+        return self._update(chat_id, voice={
+            "file_id": f"voice-{n}", "file_unique_id": f"uvoice-{n}", "duration": duration, "mime_type": "audio/ogg",
+        })
+
+    def image(self, chat_id, caption=None):
+        n = next(self._ids)
+        photo = [{"file_id": f"photo-{n}", "file_unique_id": f"uphoto-{n}", "width": 1600, "height": 1200}]
+        return self._update(chat_id, photo=photo, **({"caption": caption} if caption else {}))
+
+
+async def start_fake_telegram(host="127.0.0.1", port=0, **kwargs):
+    """Start the fake Bot API in the running loop and return (fake, runner, base_url)."""
+    fake = FakeTelegram(**kwargs)
+    runner = web.AppRunner(fake.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return fake, runner, f"http://{host}:{port}"
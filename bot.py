@@ -1,119 +1,311 @@
 from telegram import Update
 from telegram.ext import ApplicationBuilder, MessageHandler, filters, ContextTypes
 from dotenv import load_dotenv
+import argparse
+import asyncio
+import logging
 import os
-import tempfile
-import traceback
-from bot_helper import get_or_create_thread
+from sqlite3 import Error
+from bot_helper import THREAD_STORE, get_or_create_thread, is_allowed_chat, parse_allowed_chats, thread_store
 from helper_functions import *
+from reply_streamer import ReplyStreamer, reply_in_parts
+from task_cache import task_list_cache
+from chat_scheduler import ChatScheduler
+from burst_coalescer import BurstCoalescer
+from transcript_cache import transcript_cache
+from image_store import image_store
+from thread_rotation import thread_rotator
+from fast_path import fast_path
+from resilience import DEPENDENCIES, DependencyError
+from shard_router import WORKER_BASE_PORT, WORKER_HOST, WORKER_SECRET, require_secret, require_shared_thread_store, run_router, start_worker_server, wait_for_shutdown
+from telemetry import MESSAGES, finish_turn, span, start_telemetry, start_turn, stats_collector, stop_telemetry
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Get the token from environment variables
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-ALLOWED_CHATS = os.getenv("ALLOWED_CHATS").split(",")
+# "polling" runs one process that polls Telegram; "webhook" runs the update router
+# (see shard_router.py), which shards chats over `worker` processes
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Base URL of a self-hosted Bot API server, e.g. http://localhost:8081; unset uses api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+ALLOWED_CHATS = parse_allowed_chats(os.getenv("ALLOWED_CHATS"))
+# Post a placeholder reply and edit it as the assistant's answer streams in
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "true").lower() == "true"
+# Deadline for the assistant's whole answer, across every run stream and tool call of the turn
+TURN_TIMEOUT = float(os.getenv("TURN_TIMEOUT", "180"))
 run_id = None
 tool_calls = []
 
+# Updates are handled concurrently; the scheduler keeps each chat's messages in order
+scheduler = ChatScheduler()
+
 async def respond(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # A command is answered without waiting out the burst window
+    immediate = update.message is not None and fast_path.is_command(update.message.text)
+    coalescer.add(update.effective_chat.id, update, immediate=immediate)
+
+def dispatch_burst(chat_id, updates):
+    # Called by the coalescer with every message a chat sent within the burst window
+    if not scheduler.submit(chat_id, lambda: process_messages(updates)):
+        asyncio.create_task(updates[-1].message.reply_text(
+            "I'm still working through your earlier messages, please wait a moment and try again."
+        ))
+
+coalescer = BurstCoalescer(dispatch_burst)
+
+stats_collector.register("scheduler", scheduler.stats)
+stats_collector.register("coalescer", coalescer.stats)
+stats_collector.register("task_cache", task_list_cache.stats)
+stats_collector.register("transcript_cache", transcript_cache.stats)
+stats_collector.register("image_store", image_store.stats)
+stats_collector.register("thread_store", lambda: {"hits": thread_store.hits, "misses": thread_store.misses})
+stats_collector.register("thread_rotator", thread_rotator.stats)
+stats_collector.register("fast_path", fast_path.stats)
+for dependency in DEPENDENCIES:
+    stats_collector.register(f"dependency_{dependency.name}", dependency.stats)
+
+async def transcribe_voice(voice):
+    async def download_and_transcribe():
+        with span("download_voice"):
+            voice_file = await voice.get_file()
+            audio = await voice_file.download_as_bytearray()
+        with span("transcribe"):
+            return await generate_transcript(bytes(audio), voice.mime_type or "audio/ogg")
+
+    # A cached transcript skips the Telegram download as well as the transcription
+    return await transcript_cache.get_or_transcribe(voice.file_unique_id, download_and_transcribe)
+
+async def download_image(chat_image):
+    with span("download_image"):
+        image_file = await chat_image.get_file()
+        file_name = image_file.file_path.split('/')[-1]
+        return file_name, bytes(await image_file.download_as_bytearray())
+
+async def extract_message_content(update: Update):
+    """Turn one Telegram message into assistant content parts (text and uploaded images)."""
+    chat_image = None
+    voice = None
+    content = ""
+
+    # Check if the message contains an image. The file is only fetched from Telegram
+    # if the image store hasn't seen its file_unique_id before
+    if update.message.document:
+        chat_image = update.message.document
+    elif update.message.photo:
+        chat_image = update.message.photo[-1]
+
+    # Check if the message is a voice message
+    elif update.message.voice:
+        voice = update.message.voice
+
+    # Process text content
+    if update.message.text:
+        content = update.message.text
+    elif update.message.caption:
+        content = update.message.caption
+
+    MESSAGES.labels("image" if chat_image else "voice" if voice else "text").inc()
+
+    # Process voice message
+    if voice:
+        # Convert speech to text
+        content = await transcribe_voice(voice)
+
+    parts = []
+    if content:
+        parts.append({"type": "text", "text": content})
+
+    if chat_image:
+        file_id = await image_store.get_or_upload(chat_image.file_unique_id, lambda: download_image(chat_image), client)
+        parts.append({
+            "type": "image_file",
+            "image_file": {
+                "file_id": file_id
+            }
+        })
+    return parts
+
+def merge_message_content(parts_per_message):
+    """Combine the parts of several messages into the content of one thread message."""
+    texts = [part["text"] for parts in parts_per_message for part in parts if part["type"] == "text"]
+    images = [part for parts in parts_per_message for part in parts if part["type"] == "image_file"]
+    text = "\n".join(texts)
+    if not images:
+        return text
+    return ([{"type": "text", "text": text}] if text else []) + images
+
+async def extract_all(updates):
+    with span("extract"):
+        return await asyncio.gather(*(extract_message_content(u) for u in updates))
+
+async def rotate_if_due(helper):
+    # Runs after the reply is sent but inside the chat's scheduled turn, so the
+    # chat's next message already goes to the new thread
+    try:
+        reason = await thread_rotator.record_turn(helper.chat_id, helper.thread_id, helper.prompt_tokens)
+    except Error as e:
+        logging.error(f"Could not record thread usage: {e}")
+        return
+    if reason is not None:
+        with span("rotate_thread"):
+            await thread_rotator.rotate(helper.chat_id, helper.thread_id, reason, helper, client)
+
+async def process_messages(updates):
+    # Every message of the burst goes into one thread message and one run; the
+    # reply is sent once, to the latest message
+    update = updates[-1]
+    streamer = None
+    trace = start_turn(update.effective_chat.id, len(updates))
+    outcome = "ok"
     try:
         chat_id = update.effective_chat.id
-        thread_id = get_or_create_thread(chat_id, ALLOWED_CHATS, client)
+        # Download and transcribe attachments while the thread is looked up. Only
+        # for allowed chats, so strangers can't trigger uploads or transcriptions
+        extraction = None
+        if is_allowed_chat(chat_id, ALLOWED_CHATS):
+            extraction = asyncio.ensure_future(extract_all(updates))
+        try:
+            with span("thread_lookup"):
+                thread_id = await get_or_create_thread(chat_id, ALLOWED_CHATS, client)
+        except BaseException:
+            if extraction is not None:
+                extraction.cancel()
+            raise
         helper = TodoAPIHelper(chat_id, thread_id)
         
         if thread_id is None:
+            extraction.cancel()
             await update.message.reply_text("Sorry, there was an error processing your request.")
+            finish_turn(trace, "error")
             return
 
-        chat_image = None
-        chat_voice = None
-        content = ""
-
-        # Check if the message contains an image
-        if update.message.document:
-            chat_image = await update.message.document.get_file()
-        elif update.message.photo:
-            chat_image = await update.message.photo[-1].get_file()
-
-        # Check if the message is a voice message
-        elif update.message.voice:
-            chat_voice = await update.message.voice.get_file()
-
-        # Process text content
-        if update.message.text:
-            content = update.message.text
-        elif update.message.caption:
-            content = update.message.caption
-        
-        # Process voice message
-        if chat_voice:
-            voice_file = await chat_voice.download_as_bytearray()
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg") as temp_file:
-                temp_file.write(voice_file)
-                temp_file_path = temp_file.name
-            
-            # Convert speech to text
-            content = await generate_transcript(temp_file_path)
-            os.unlink(temp_file_path)
-
-        if chat_image:
-            # Get the file name and extension of the uploaded file
-            file_name = chat_image.file_path.split('/')[-1]
-            file_extension = os.path.splitext(file_name)[1]
-            
-            # Create a temporary file with the same extension
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
-                await chat_image.download_to_memory(temp_file)
-                temp_file_path = temp_file.name
-
-            image_file = client.files.create(file=open(temp_file_path, "rb"), purpose="assistants")
-            message_content = [
-                {
-                    "type": "text",
-                    "text": content
-                },
-                {
-                    "type": "image_file",
-                    "image_file": {
-                        "file_id": image_file.id
-                    }
-                }
-            ]
-        else:
-            message_content = content
+        with span("extract_wait"):
+            parts_per_message = await extraction
+        message_content = merge_message_content(parts_per_message)
 
-        print(message_content)
-        message = client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=message_content
-        )
-        response = await helper.stream_assistant_response()
-        output = response.value
-
-        # Clean up the temporary file if it was created
-        if chat_image:
-            os.unlink(temp_file_path)
+        logging.debug(f"Message content for chat_id {chat_id}: {message_content}")
+        # A single plain command is answered without an assistant run
+        command = fast_path.match(message_content) if len(updates) == 1 else None
+        if command is not None:
+            with span("fast_path", intent=command.intent):
+                output = await fast_path.run(command, helper)
+            outcome = "fast_path"
+        else:
+            helper.additional_instructions = await thread_rotator.instructions(thread_id)
+            await helper.add_user_message(message_content)
+            if STREAM_REPLIES:
+                streamer = ReplyStreamer(update.message)
+                await streamer.start()
+                helper.text_listener = streamer.update
+            try:
+                response = await asyncio.wait_for(helper.stream_assistant_response(), TURN_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise DependencyError("turn", "Sorry, that took too long to answer, please try again.")
+            output = response.value
 
+    except DependencyError as e:
+        # Timeouts and open circuit breakers are expected failures with a message for the user
+        logging.warning(f"Chat {update.effective_chat.id} not answered, {e.dependency}: {e}")
+        output = str(e)
+        outcome = "unavailable"
     except Exception as e:
-        traceback.print_exc()
+        logging.exception(f"Error while processing messages from chat_id {update.effective_chat.id}")
         output = str(e)
+        outcome = "error"
 
-    await update.message.reply_text(output)
+    with span("reply"):
+        try:
+            if streamer is not None:
+                await streamer.finish(output)
+            else:
+                await reply_in_parts(update.message, output)
+        except Exception:
+            logging.exception(f"Could not send the reply to chat_id {update.effective_chat.id}")
+            outcome = "error"
+    finish_turn(trace, outcome)
+    if outcome == "fast_path":
+        await fast_path.record(helper, message_content, output, client)
+    if outcome in ("ok", "fast_path"):
+        await rotate_if_due(helper)
 
-def main():
+async def post_init(application):
+    # Connect the Todo backend (HTTP pool or embedded database) once the event loop is running
+    await todo_backend.start()
+    image_store.start_reaper(client)
+    start_telemetry()
+
+async def post_shutdown(application):
+    logging.info(f"Task list cache: {task_list_cache.stats()}")
+    coalescer.close()
+    await scheduler.close()
+    await todo_backend.close()
+    logging.info(f"Transcript cache: {transcript_cache.stats()}")
+    transcript_cache.close()
+    logging.info(f"Image uploads: {image_store.stats()}")
+    await image_store.close()
+    logging.info(f"Thread rotations: {thread_rotator.stats()}")
+    logging.info(f"Fast path: {fast_path.stats()}")
+    thread_rotator.close()
+    await client.close()
+    thread_store.close()
+    stop_telemetry()
+
+def build_application(updater=True):
     # Initialize the application with the token
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(True)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    if not updater:
+        # Workers are fed by the router instead of fetching updates themselves
+        builder = builder.updater(None)
+    application = builder.build()
 
      # Register a handler for all text messages and messages with images
     application.add_handler(MessageHandler(
         (filters.TEXT | filters.PHOTO | filters.Document.IMAGE | filters.VOICE) & (~filters.COMMAND),
         respond
     ))
+    return application
+
+async def run_worker(host, port):
+    require_secret("WORKER_SECRET", WORKER_SECRET)
+    require_shared_thread_store(THREAD_STORE)
+    application = build_application(updater=False)
+    # post_init/post_shutdown are only called for us by run_polling/run_webhook
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    server = await start_worker_server(application, host, port)
+    try:
+        await wait_for_shutdown()
+    finally:
+        await server.cleanup()
+        await application.stop()
+        await post_shutdown(application)
+        await application.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Telegram todo bot")
+    parser.add_argument("mode", nargs="?", choices=["polling", "webhook", "worker"], default=BOT_MODE)
+    parser.add_argument("--host", default=WORKER_HOST, help="worker mode: address to accept routed updates on")
+    parser.add_argument("--port", type=int, default=WORKER_BASE_PORT, help="worker mode: port to accept routed updates on")
+    args = parser.parse_args()
 
-    # Start the Bot
-    application.run_polling()
+    if args.mode == "webhook":
+        asyncio.run(run_router())
+    elif args.mode == "worker":
+        asyncio.run(run_worker(args.host, args.port))
+    else:
+        # Start the Bot
+        build_application().run_polling()
 
 if __name__ == '__main__':
     main()
@@ -1,28 +1,38 @@
+import asyncio
+import functools
 import logging
 import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from sqlite3 import Error
 import os
+from todo_backends import TodoAPIError, todo_backend
+from resilience import openai_api
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def create_connection():
-    db_file = 'chats.db'
+CHATS_DB = os.getenv("CHATS_DB", "chats.db")
+THREAD_CACHE_SIZE = int(os.getenv("THREAD_CACHE_SIZE", "1024"))
+# Where the chat -> thread mapping is stored: "sqlite" (CHATS_DB, shared by the bot
+# processes on one host) or "todo-api" (the Todo backend's database, shared by
+# every process that uses the same Todo API, on any machine)
+THREAD_STORE = os.getenv("THREAD_STORE", "sqlite")
+
+def create_connection(db_file=CHATS_DB):
     conn = None
     try:
-        # This will create the database if it doesn't exist
-        conn = sqlite3.connect(db_file)
+        # This will create the database if it doesn't exist. The connection is kept
+        # open for the life of the process, so it is shared by every handler
+        conn = sqlite3.connect(db_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
         logging.info(f"Connected to the database: {db_file}")
-        
-        # Check if the database is newly created
-        if not os.path.exists(db_file) or os.path.getsize(db_file) == 0:
-            logging.info("Newly created database. Creating table...")
-            create_table(conn)
-        
+        create_table(conn)
         return conn
     except Error as e:
         logging.error(f"Error connecting to database: {e}")
-    
+
     return conn
 
 def create_table(conn):
@@ -31,42 +41,206 @@ def create_table(conn):
         c.execute('''CREATE TABLE IF NOT EXISTS chats
                      (chat_id INTEGER PRIMARY KEY, thread_id TEXT)''')
         conn.commit()
-        logging.info("Table 'chats' created successfully")
     except Error as e:
         logging.error(f"Error creating table: {e}")
 
-def get_or_create_thread(chat_id, allowed_chats, client):
-    if str(chat_id) not in allowed_chats:
+# One connection per database file, shared by every component that keeps state
+# in it (thread map, transcript cache, image store, thread rotation): db_file ->
+# [connection, users]
+_shared_connections = {}
+# Every query on those connections runs on this one thread, so a slow commit or a
+# lock held by another bot process stalls it rather than the event loop
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chats-db")
+
+async def run_in_db_thread(function, *args, **kwargs):
+    """Run a blocking call that uses a shared connection on the database thread."""
+    return await asyncio.get_running_loop().run_in_executor(_db_executor, functools.partial(function, *args, **kwargs))
+
+def open_shared_connection(db_file=CHATS_DB, schema=()):
+    """The process's connection to `db_file`, with the `schema` statements applied.
+    Pair every call with release_shared_connection."""
+    entry = _shared_connections.get(db_file)
+    if entry is None:
+        conn = create_connection(db_file)
+        if conn is None:
+            raise Error("Cannot create the database connection")
+        entry = _shared_connections[db_file] = [conn, 0]
+    conn = entry[0]
+    for statement in schema:
+        conn.execute(statement)
+    conn.commit()
+    entry[1] += 1
+    return conn
+
+def release_shared_connection(db_file=CHATS_DB):
+    """Closes the connection once its last user has released it."""
+    entry = _shared_connections.get(db_file)
+    if entry is None:
+        return
+    entry[1] -= 1
+    if entry[1] <= 0:
+        del _shared_connections[db_file]
+        entry[0].close()
+
+class SQLiteThreadMap:
+    """Chat -> thread rows in CHATS_DB, over a single long-lived connection."""
+
+    def __init__(self, db_file=CHATS_DB):
+        self.db_file = db_file
+        self._conn = None
+
+    def connect(self):
+        if self._conn is None:
+            self._conn = open_shared_connection(self.db_file)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            release_shared_connection(self.db_file)
+            self._conn = None
+
+    def _get(self, chat_id):
+        row = self.connect().execute("SELECT thread_id FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row[0] if row else None
+
+    def _claim(self, chat_id, thread_id):
+        conn = self.connect()
+        conn.execute("INSERT OR IGNORE INTO chats (chat_id, thread_id) VALUES (?, ?)", (chat_id, thread_id))
+        conn.commit()
+        return conn.execute("SELECT thread_id FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+
+    def _replace(self, chat_id, old_thread_id, thread_id):
+        conn = self.connect()
+        conn.execute("UPDATE chats SET thread_id = ? WHERE chat_id = ? AND thread_id = ?", (thread_id, chat_id, old_thread_id))
+        conn.commit()
+        return conn.execute("SELECT thread_id FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+
+    async def get(self, chat_id):
+        return await run_in_db_thread(self._get, chat_id)
+
+    async def claim(self, chat_id, thread_id):
+        return await run_in_db_thread(self._claim, chat_id, thread_id)
+
+    async def replace(self, chat_id, old_thread_id, thread_id):
+        return await run_in_db_thread(self._replace, chat_id, old_thread_id, thread_id)
+
+class TodoAPIThreadMap:
+    """Chat -> thread rows kept by the Todo backend, shared across machines."""
+
+    def __init__(self, backend=todo_backend):
+        self.backend = backend
+
+    def close(self):
+        # The backend's connections belong to the bot and are closed with it
+        pass
+
+    async def get(self, chat_id):
+        return await self.backend.get_thread(chat_id)
+
+    async def claim(self, chat_id, thread_id):
+        return await self.backend.claim_thread(chat_id, thread_id)
+
+    async def replace(self, chat_id, old_thread_id, thread_id):
+        return await self.backend.claim_thread(chat_id, thread_id, replaces=old_thread_id)
+
+THREAD_MAPS = {"sqlite": SQLiteThreadMap, "todo-api": TodoAPIThreadMap}
+
+def create_thread_map(name=THREAD_STORE):
+    if name not in THREAD_MAPS:
+        raise ValueError(f"Unknown THREAD_STORE {name!r}, expected one of {sorted(THREAD_MAPS)}")
+    return THREAD_MAPS[name]()
+
+class ThreadStore:
+    """Maps chat IDs to OpenAI thread IDs.
+
+    Lookups are served from a bounded LRU cache in front of the shared mapping
+    (see THREAD_STORE). Concurrent first messages from the same chat share one
+    pending thread creation, and the mapping keeps the first thread stored for a
+    chat, so only one OpenAI thread is ever used per chat across processes.
+    """
+
+    def __init__(self, mapping=None, cache_size=THREAD_CACHE_SIZE):
+        self.mapping = mapping if mapping is not None else create_thread_map()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.mapping.close()
+        self._cache.clear()
+
+    def _remember(self, chat_id, thread_id):
+        self._cache[chat_id] = thread_id
+        self._cache.move_to_end(chat_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _cached(self, chat_id):
+        thread_id = self._cache.get(chat_id)
+        if thread_id is not None:
+            self._cache.move_to_end(chat_id)
+            self.hits += 1
+        return thread_id
+
+    async def lookup(self, chat_id):
+        thread_id = self._cached(chat_id)
+        if thread_id is not None:
+            return thread_id
+
+        self.misses += 1
+        thread_id = await self.mapping.get(chat_id)
+        if thread_id is not None:
+            self._remember(chat_id, thread_id)
+        return thread_id
+
+    async def _create(self, chat_id, client):
+        new_thread = await openai_api.call(client.beta.threads.create)
+        # Another process may have won the claim, the stored thread is authoritative
+        thread_id = await self.mapping.claim(chat_id, new_thread.id)
+        self._remember(chat_id, thread_id)
+        logging.info(f"New thread created for chat_id {chat_id}")
+        return thread_id
+
+    async def _lookup_or_create(self, chat_id, client):
+        thread_id = await self.lookup(chat_id)
+        if thread_id is not None:
+            return thread_id
+        return await self._create(chat_id, client)
+
+    async def replace(self, chat_id, old_thread_id, thread_id):
+        """Switch the chat to `thread_id` if it is still on `old_thread_id`; returns the thread now stored."""
+        thread_id = await self.mapping.replace(chat_id, old_thread_id, thread_id)
+        self._remember(chat_id, thread_id)
+        return thread_id
+
+    async def get_or_create(self, chat_id, client):
+        thread_id = self._cached(chat_id)
+        if thread_id is not None:
+            return thread_id
+
+        pending = self._pending.get(chat_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._lookup_or_create(chat_id, client))
+            self._pending[chat_id] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(chat_id, None))
+        return await asyncio.shield(pending)
+
+thread_store = ThreadStore()
+
+def parse_allowed_chats(value):
+    return {chat.strip() for chat in (value or "").split(",") if chat.strip()}
+
+def is_allowed_chat(chat_id, allowed_chats):
+    return str(chat_id) in allowed_chats
+
+async def get_or_create_thread(chat_id, allowed_chats, client):
+    if not is_allowed_chat(chat_id, allowed_chats):
         logging.error(f"User from chat with id {chat_id} attempted to initiate an unauthorized message")
         raise Exception("You are not allowed to use this bot")
-    conn = create_connection()
-    if conn is not None:
-        try:
-            c = conn.cursor()
-            
-            # Look for the thread ID given the chat ID
-            c.execute("SELECT thread_id FROM chats WHERE chat_id = ?", (chat_id,))
-            result = c.fetchone()
-            
-            if result:
-                # If the thread ID is found in the database, return it
-                thread_id = result[0]
-                logging.info(f"Existing thread found for chat_id {chat_id}")
-            else:
-                # If not, create a new thread and thread ID, save it to the DB and return the thread
-                new_thread = client.beta.threads.create()
-                thread_id = new_thread.id
-                c.execute("INSERT INTO chats (chat_id, thread_id) VALUES (?, ?)", (chat_id, thread_id))
-                conn.commit()
-                logging.info(f"New thread created for chat_id {chat_id}")
-            
-            conn.close()
-            return thread_id
-        except Error as e:
-            logging.error(f"Database error: {e}")
-            if conn:
-                conn.close()
-            return None
-    else:
-        logging.error("Error! Cannot create the database connection.")
-        return None
\ No newline at end of file
+    try:
+        return await thread_store.get_or_create(chat_id, client)
+    except (Error, TodoAPIError) as e:
+        logging.error(f"Thread store error: {e}")
+        return None
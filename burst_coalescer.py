@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+
+# Quiet period (seconds) after a chat's latest message before its burst is processed.
+# Set to 0 to process every message on its own
+BURST_WINDOW = float(os.getenv("BURST_WINDOW", "1.0"))
+# A burst is flushed after this long even if the chat keeps typing
+BURST_MAX_WAIT = float(os.getenv("BURST_MAX_WAIT", "4.0"))
+BURST_MAX_MESSAGES = int(os.getenv("BURST_MAX_MESSAGES", "10"))
+
+class BurstCoalescer:
+    """Debounces rapid-fire messages from one chat into a single batch.
+
+    `flush(chat_id, items)` is called once the chat has been quiet for `window`
+    seconds, once the burst is `max_wait` seconds old, or once it holds
+    `max_messages` items, whichever comes first. `add(..., immediate=True)`
+    flushes right away, with anything already pending for the chat.
+    """
+
+    def __init__(self, flush, window=BURST_WINDOW, max_wait=BURST_MAX_WAIT, max_messages=BURST_MAX_MESSAGES):
+        self.flush = flush
+        self.window = window
+        self.max_wait = max_wait
+        self.max_messages = max_messages
+        self._pending = {}
+        self._started = {}
+        self._timers = {}
+        self.messages = 0
+        self.batches = 0
+
+    def add(self, chat_id, item, immediate=False):
+        self.messages += 1
+        if self.window <= 0 or (immediate and chat_id not in self._pending):
+            self.batches += 1
+            self.flush(chat_id, [item])
+            return
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        batch = self._pending.setdefault(chat_id, [])
+        batch.append(item)
+        started = self._started.setdefault(chat_id, now)
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+
+        if immediate or len(batch) >= self.max_messages or now - started >= self.max_wait:
+            self._fire(chat_id)
+            return
+        delay = min(self.window, started + self.max_wait - now)
+        self._timers[chat_id] = loop.call_later(delay, self._fire, chat_id)
+
+    def _fire(self, chat_id):
+        self._timers.pop(chat_id, None)
+        self._started.pop(chat_id, None)
+        batch = self._pending.pop(chat_id, None)
+        if batch:
+            self.batches += 1
+            if len(batch) > 1:
+                logging.info(f"Coalesced {len(batch)} messages from chat_id {chat_id} into one run")
+            self.flush(chat_id, batch)
+
+    def stats(self):
+        return {
+            "messages": self.messages,
+            "batches": self.batches,
+            "pending_chats": len(self._pending),
+            "messages_per_batch": self.messages / self.batches if self.batches else 0.0,
+        }
+
+    def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._started.clear()
+        self._pending.clear()
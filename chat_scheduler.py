@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+import time
+
+# Upper bound on turns (and therefore OpenAI runs) in flight across all chats
+MAX_CONCURRENT_RUNS = int(os.getenv("MAX_CONCURRENT_RUNS", "16"))
+# Messages a single chat may have waiting before new ones are turned away
+CHAT_QUEUE_SIZE = int(os.getenv("CHAT_QUEUE_SIZE", "5"))
+
+class ChatScheduler:
+    """Runs different chats in parallel while keeping each chat's messages in order.
+
+    Every chat gets a bounded FIFO queue drained by its own worker task, so two
+    messages from one chat never race on the same OpenAI thread. A global
+    semaphore caps how many turns run at once across all chats.
+    """
+
+    def __init__(self, max_concurrent_runs=MAX_CONCURRENT_RUNS, queue_size=CHAT_QUEUE_SIZE):
+        self.max_concurrent_runs = max_concurrent_runs
+        self.queue_size = queue_size
+        self._semaphore = asyncio.Semaphore(max_concurrent_runs)
+        self._queues = {}
+        self._workers = {}
+        self.in_flight = 0
+        self.processed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, chat_id, job):
+        """Queue `job` (a coroutine function) for `chat_id`. Returns False if the chat's queue is full."""
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = asyncio.Queue(maxsize=self.queue_size)
+        try:
+            queue.put_nowait((time.monotonic(), job))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logging.warning(f"Queue for chat_id {chat_id} is full, rejecting message")
+            return False
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id, queue))
+        return True
+
+    async def _drain(self, chat_id, queue):
+        try:
+            while not queue.empty():
+                enqueued_at, job = queue.get_nowait()
+                async with self._semaphore:
+                    wait = time.monotonic() - enqueued_at
+                    self.total_wait += wait
+                    self.max_wait = max(self.max_wait, wait)
+                    self.in_flight += 1
+                    try:
+                        await job()
+                    except Exception:
+                        logging.exception(f"Unhandled error while processing a message for chat_id {chat_id}")
+                    finally:
+                        self.in_flight -= 1
+                        self.processed += 1
+        finally:
+            # No awaits between the empty check above and here, so a concurrent
+            # submit either saw this worker or will start a fresh one
+            self._workers.pop(chat_id, None)
+            if queue.empty():
+                self._queues.pop(chat_id, None)
+
+    def queue_depth(self, chat_id=None):
+        if chat_id is not None:
+            queue = self._queues.get(chat_id)
+            return queue.qsize() if queue else 0
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def stats(self):
+        return {
+            "active_chats": len(self._workers),
+            "queued": self.queue_depth(),
+            "in_flight": self.in_flight,
+            "max_concurrent_runs": self.max_concurrent_runs,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "avg_wait": self.total_wait / self.processed if self.processed else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+    async def close(self):
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._queues.clear()
+        logging.info(f"Chat scheduler stopped: {self.stats()}")
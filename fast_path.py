@@ -0,0 +1,132 @@
+import logging
+import os
+import re
+from collections import Counter, namedtuple
+from resilience import DependencyError, openai_api
+from telemetry import span
+from todo_backends import TodoAPIError
+
+# Answer simple commands ("list", "done 4", "delete 7") directly instead of
+# running the assistant; anything else still goes to the assistant
+FAST_PATH = os.getenv("FAST_PATH", "true").lower() == "true"
+# Commands naming more tasks than this are left to the assistant
+FAST_PATH_MAX_IDS = int(os.getenv("FAST_PATH_MAX_IDS", "20"))
+
+Command = namedtuple("Command", ["intent", "task_ids"])
+
+# Task IDs past nine digits can't exist; such messages go to the assistant instead
+_ID = r"#?\d{1,9}\b"
+_IDS = rf"(?:task\s+)?(?P<ids>{_ID}(?:\s*(?:,|and|&)?\s*{_ID})*)"
+PATTERNS = [
+    ("list", re.compile(r"(?:list|ls|tasks|todos?|(?:show|list)(?: me)?(?: my)?(?: open)? tasks|what'?s on my list)")),
+    ("done", re.compile(rf"(?:done|complete|finish|finished|check|tick)\s+{_IDS}")),
+    ("reopen", re.compile(rf"(?:undone|undo|reopen|uncheck|untick)\s+{_IDS}")),
+    ("delete", re.compile(rf"(?:delete|del|remove|rm)\s+{_IDS}")),
+]
+
+def match_command(text):
+    """The command `text` unambiguously is, or None. Only whole messages match."""
+    normalized = " ".join(text.lower().split()).rstrip(".!?")
+    for intent, pattern in PATTERNS:
+        found = pattern.fullmatch(normalized)
+        if found is None:
+            continue
+        task_ids = []
+        if "ids" in pattern.groupindex:
+            task_ids = list(dict.fromkeys(int(task_id) for task_id in re.findall(r"\d+", found.group("ids"))))
+            if len(task_ids) > FAST_PATH_MAX_IDS:
+                return None
+        return Command(intent, task_ids)
+    return None
+
+def _describe(task):
+    return f"#{task['id']} {task['title']}"
+
+class FastPathRouter:
+    """Handles simple task commands through TodoAPIHelper without an assistant run.
+
+    The command and its reply are then added to the chat's thread, so the
+    assistant sees them in later turns just as if it had answered itself.
+    """
+
+    def __init__(self, enabled=FAST_PATH):
+        self.enabled = enabled
+        self.hits = Counter()
+        self.misses = 0
+        self.record_failures = 0
+
+    def is_command(self, text):
+        """Whether a plain text message is a fast-path command, without counting it."""
+        return self.enabled and isinstance(text, str) and match_command(text) is not None
+
+    def match(self, content):
+        if not self.enabled or not isinstance(content, str):
+            return None
+        command = match_command(content)
+        if command is None:
+            self.misses += 1
+        return command
+
+    async def run(self, command, helper):
+        self.hits[command.intent] += 1
+        if command.intent == "list":
+            tasks = await helper.get_tasks()
+            if not tasks:
+                return "You have no open tasks."
+            return "Your open tasks:\n" + "\n".join(_describe(task) for task in tasks)
+        if command.intent == "delete":
+            results = await self._apply(command.task_ids, helper.delete_task, helper.bulk_delete_tasks, command.task_ids)
+            return self._summarize(results, "Deleted")
+        completed = command.intent == "done"
+        updates = [{"task_id": task_id, "completed": completed} for task_id in command.task_ids]
+        results = await self._apply(command.task_ids, lambda task_id: helper.update_task(task_id, completed=completed),
+                                    helper.bulk_update_tasks, updates)
+        return self._summarize(results, "Marked as done:" if completed else "Reopened:")
+
+    @staticmethod
+    async def _apply(task_ids, single, bulk, bulk_argument):
+        """Returns [(task_id, task or None)], using one call whether one or many tasks are named."""
+        if len(task_ids) == 1:
+            try:
+                return [(task_ids[0], await single(task_ids[0]))]
+            except TodoAPIError as e:
+                if e.status != 404:
+                    raise
+                return [(task_ids[0], None)]
+        results = await bulk(bulk_argument)
+        return [(task_id, result["task"] if result["ok"] else None) for task_id, result in zip(task_ids, results)]
+
+    @staticmethod
+    def _summarize(results, verb):
+        done = [_describe(task) for _, task in results if task is not None]
+        missing = [f"#{task_id}" for task_id, task in results if task is None]
+        lines = []
+        if done:
+            lines.append(f"{verb} {', '.join(done)}" if len(done) == 1 else "\n".join([verb] + done))
+        if missing:
+            lines.append(f"I couldn't find task {', '.join(missing)}.")
+        return "\n".join(lines)
+
+    async def record(self, helper, content, reply, client):
+        """Add the command and its reply to the thread. Call in the chat's turn so ordering holds."""
+        try:
+            with span("fast_path_record"):
+                for role, text in (("user", content), ("assistant", reply)):
+                    await openai_api.call(lambda: client.beta.threads.messages.create(
+                        thread_id=helper.thread_id, role=role, content=text))
+        except DependencyError as e:
+            self.record_failures += 1
+            logging.warning(f"Could not add a fast-path exchange to thread {helper.thread_id}: {e}")
+        except Exception:
+            self.record_failures += 1
+            logging.exception(f"Could not add a fast-path exchange to thread {helper.thread_id}")
+
+    def stats(self):
+        hits = sum(self.hits.values())
+        matched = hits + self.misses
+        stats = {"hits": hits, "misses": self.misses, "hit_ratio": hits / matched if matched else 0.0,
+                 "record_failures": self.record_failures}
+        stats.update({f"hits_{intent}": self.hits[intent] for intent, _ in PATTERNS})
+        return stats
+
+fast_path = FastPathRouter()
@@ -1,22 +1,35 @@
-import aiohttp
 import asyncio
 import os
 from dotenv import load_dotenv
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import json
 import os
 import logging
 import fal_client
-from openai import OpenAI
-from openai import AssistantEventHandler
+from openai import AsyncOpenAI
+from openai import AsyncAssistantEventHandler
+from openai.types.beta.threads import Run
 from typing_extensions import override
+from task_cache import task_list_cache
+from telemetry import TOOL_CALL_SECONDS, TOOL_OUTPUT_TOKENS, span
+from tool_output import TOOL_OUTPUT_FORMAT, encode_tool_output, estimate_tokens
+from thread_rotation import TRUNCATION_STRATEGY
+from todo_backends import todo_backend
+from resilience import fal_api, openai_api
 import asyncio
 import time
 
 load_dotenv()
 
 FAL_API_KEY = os.getenv("FAL_API_KEY")
-client = OpenAI()
+# Retries are done by resilience.openai_api, only for calls that are safe to repeat,
+# so the client's own retries (which also repeat message creation) are off
+client = AsyncOpenAI(timeout=openai_api.timeout, max_retries=0)
+# Deadline for each run stream, from start or tool output submission until the run
+# pauses or finishes; OPENAI_TIMEOUT covers each read within it
+OPENAI_STREAM_TIMEOUT = float(os.getenv("OPENAI_STREAM_TIMEOUT", "120"))
+# Run states after which there is nothing left to cancel
+FINISHED_RUN_STATUSES = {"completed", "failed", "cancelling", "cancelled", "expired", "incomplete"}
 assistant_id = os.getenv("OPENAI_ASSISTANT_ID")
 
 # Set up logging
@@ -25,109 +38,162 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Load environment variables from .env file
 load_dotenv()
 
-BASE_URL = os.getenv("BASE_URL")
-
-async def fetch(session: aiohttp.ClientSession, url: str, params: Dict[str, str] = None, headers: Dict[str, str] = None) -> Dict[str, Any]:
-    async with session.get(url, params=params, headers=headers) as response:
-        if response.status == 200:
-            return await response.json()
-        else:
-            raise Exception(f"HTTP error {response.status}: {await response.text()}")
-
-async def post(session: aiohttp.ClientSession, url: str, data: Dict[str, Any], headers: Dict[str, str] = None) -> Dict[str, Any]:
-    async with session.post(url, json=data, headers=headers) as response:
-        return await response.json()
-
-async def put(session: aiohttp.ClientSession, url: str, data: Dict[str, Any], headers: Dict[str, str] = None) -> Dict[str, Any]:
-    async with session.put(url, json=data, headers=headers) as response:
-        return await response.json()
-
-async def delete(session: aiohttp.ClientSession, url: str, headers: Dict[str, str] = None) -> Dict[str, Any]:
-    async with session.delete(url, headers=headers) as response:
-        return await response.json()
-
-# Create an event handler class to manage streaming events
-class MyEventHandler(AssistantEventHandler):
+# Create an event handler class to manage streaming events. The run's state
+# machine is driven entirely from these events: requires_action hands over the
+# tool calls and the final assistant text is captured from the stream, so no
+# run polling or thread listing is needed
+class MyEventHandler(AsyncAssistantEventHandler):
     def __init__(self, *args, helper=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.helper = helper
 
     @override
-    def on_text_created(self, text) -> None:
-        self.helper.run_id = self.current_run.id
-    
+    async def on_event(self, event) -> None:
+        if not isinstance(event.data, Run):
+            return
+        run = event.data
+        self.helper.run_id = run.id
+        self.helper.run_status = run.status
+        if run.status == "requires_action":
+            self.helper.tool_calls = run.required_action.submit_tool_outputs.tool_calls
+        elif run.last_error is not None:
+            self.helper.run_error = run.last_error.message
+        if run.usage is not None:
+            self.helper.prompt_tokens = run.usage.prompt_tokens
+
     @override
-    def on_text_delta(self, text, snapshot):
-        self.helper.run_id = self.current_run.id
-
-    def on_tool_call_done(self, tool_call):
-        print("Added tool call to list...")
-        self.helper.tool_calls.append(tool_call)
-        self.helper.run_id = self.current_run.id
-        
-
-    def on_tool_call_delta(self, delta, snapshot):
-        self.helper.run_id = self.current_run.id
-        if delta.type == 'function':
-            if delta.function.arguments:
-                print(delta.function.arguments, end="", flush=True)
-    
-    def on_message_done(self, message):
-        self.helper.run_id = self.current_run.id
+    async def on_text_delta(self, delta, snapshot):
+        if self.helper.text_listener is not None:
+            await self.helper.text_listener(snapshot.value)
+
+    @override
+    async def on_message_done(self, message):
+        if message.role != "assistant":
+            return
+        for block in message.content:
+            if block.type == "text":
+                self.helper.latest_message = block.text
 
 class TodoAPIHelper:
-    def __init__(self, chat_id, thread_id):
+    def __init__(self, chat_id, thread_id, backend=None):
         self.chat_id = chat_id
-        self.headers = {"chat-id": str(chat_id)}
-        self.params = {"completed": "false"}
+        self.backend = backend or todo_backend
+        self.params = {"completed": False}
         self.thread_id = thread_id
         self.run_id = None
+        self.run_status = None
+        self.run_error = None
         self.tool_calls = []
+        self.latest_message = None
+        # Optional coroutine called with the accumulated reply text on every delta
+        self.text_listener = None
+        # OpenAI API calls made for the current turn
+        self.api_calls = 0
+        # Context carried over from the chat's previous thread, sent with every run
+        self.additional_instructions = None
+        # Prompt tokens the last run read, once it has finished
+        self.prompt_tokens = None
+        # Estimated tokens of this turn's tool outputs, and saved by encoding them compactly
+        self.tool_output_tokens = 0
+        self.tool_output_tokens_saved = 0
 
     async def get_tasks(self) -> Dict[str, Any]:
-        async with aiohttp.ClientSession() as session:
-            url = f"{BASE_URL}/tasks"
-            return await fetch(session, url, params=self.params, headers=self.headers)
+        cached = task_list_cache.lookup(self.chat_id, self.params)
+        if cached is not None and task_list_cache.is_fresh(cached):
+            task_list_cache.hits += 1
+            return cached.tasks
+
+        generation = task_list_cache.generation(self.chat_id)
+        tasks, etag = await self.backend.list_tasks(self.chat_id, self.params, etag=cached.etag if cached else None)
+        if tasks is None:
+            task_list_cache.revalidations += 1
+            tasks = cached.tasks
+        else:
+            task_list_cache.misses += 1
+        task_list_cache.store(self.chat_id, self.params, tasks, etag, generation)
+        return tasks
+
+    async def search_tasks(self, query: str, completed: Optional[bool] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        # Searches aren't cached: they are narrow, and the index is only read once per call
+        params = {"q": query, "completed": completed, "limit": limit}
+        return await self.backend.search_tasks(self.chat_id, {key: value for key, value in params.items() if value is not None})
 
     async def get_task(self, task_id: int) -> Dict[str, Any]:
-        async with aiohttp.ClientSession() as session:
-            url = f"{BASE_URL}/tasks/{task_id}"
-            return await fetch(session, url, headers=self.headers)
+        return await self.backend.get_task(self.chat_id, task_id)
 
     async def create_task(self, title: str, description: Optional[str] = None, completed: Optional[bool] = False) -> Dict[str, Any]:
-        async with aiohttp.ClientSession() as session:
-            url = f"{BASE_URL}/tasks"
-            data = {
-                "title": title,
-                "description": description,
-                "completed": completed
-            }
-            return await post(session, url, data, headers=self.headers)
+        data = {
+            "title": title,
+            "description": description,
+            "completed": completed
+        }
+        try:
+            return await self.backend.create_task(self.chat_id, data)
+        finally:
+            task_list_cache.invalidate(self.chat_id)
 
     async def update_task(self, task_id: int, title: Optional[str] = None, description: Optional[str] = None, completed: Optional[bool] = False) -> Dict[str, Any]:
-        async with aiohttp.ClientSession() as session:
-            url = f"{BASE_URL}/tasks/{task_id}"
-            data = {
-                "title": title,
-                "description": description,
-                "completed": completed
-            }
-            return await put(session, url, data, headers=self.headers)
+        data = {
+            "title": title,
+            "description": description,
+            "completed": completed
+        }
+        try:
+            return await self.backend.update_task(self.chat_id, task_id, data)
+        finally:
+            task_list_cache.invalidate(self.chat_id)
 
     async def delete_task(self, task_id: int) -> Dict[str, Any]:
-        async with aiohttp.ClientSession() as session:
-            url = f"{BASE_URL}/tasks/{task_id}"
-            return await delete(session, url, headers=self.headers)
+        try:
+            return await self.backend.delete_task(self.chat_id, task_id)
+        finally:
+            task_list_cache.invalidate(self.chat_id)
+
+    async def bulk_create_tasks(self, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        try:
+            return await self.backend.bulk_create_tasks(self.chat_id, tasks)
+        finally:
+            task_list_cache.invalidate(self.chat_id)
+
+    async def bulk_update_tasks(self, updates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        try:
+            return await self.backend.bulk_update_tasks(self.chat_id, updates)
+        finally:
+            task_list_cache.invalidate(self.chat_id)
+
+    async def bulk_delete_tasks(self, task_ids: List[int]) -> List[Dict[str, Any]]:
+        try:
+            return await self.backend.bulk_delete_tasks(self.chat_id, task_ids)
+        finally:
+            task_list_cache.invalidate(self.chat_id)
 
     async def run_tool(self, tool_call):
-        arguments = json.loads(tool_call.function.arguments)
         function_name = tool_call.function.name
+        start = time.perf_counter()
+        with span("tool_call", tool=function_name):
+            res, ok = await self._run_tool(function_name, tool_call.function.arguments)
+        TOOL_CALL_SECONDS.labels(function_name, "ok" if ok else "error").observe(time.perf_counter() - start)
+        return res, tool_call.id
+
+    async def _run_tool(self, function_name, raw_arguments):
+        logging.debug(f"Tool call {function_name}({raw_arguments})")
         try:
+            arguments = json.loads(raw_arguments)
+            # Fields the call already pins down, e.g. completed=False, aren't repeated per task
+            omit = ()
+            description_chars = None
             if function_name == "get_tasks":
                 res = await self.get_tasks()
+                omit = tuple(self.params)
+            elif function_name == "search_tasks":
+                res = await self.search_tasks(arguments["query"], arguments.get("completed"), arguments.get("limit"))
+                if arguments.get("completed") is not None:
+                    omit = ("completed",)
             elif function_name == "get_task":
                 task_id = arguments["task_id"]
                 res = await self.get_task(task_id)
+                # The one call that returns the full description
+                description_chars = 0
             elif function_name == "create_task":
                 title = arguments["title"]
                 description = arguments.get("description")
@@ -142,12 +208,28 @@ class TodoAPIHelper:
             elif function_name == "delete_task":
                 task_id = arguments["task_id"]
                 res = await self.delete_task(task_id)
+            elif function_name == "bulk_create_tasks":
+                res = await self.bulk_create_tasks(arguments["tasks"])
+            elif function_name == "bulk_update_tasks":
+                res = await self.bulk_update_tasks(arguments["updates"])
+            elif function_name == "bulk_delete_tasks":
+                res = await self.bulk_delete_tasks(arguments["task_ids"])
             else:
                 raise Exception(f"Unknown function name: {function_name}")
         except Exception as e:
-            print(e)
-            return str(e), tool_call.id
-        return str(res), tool_call.id
+            logging.warning(f"Tool call {function_name} failed: {e}")
+            return str(e), False
+        return self._encode(res, omit, description_chars), True
+
+    def _encode(self, res, omit, description_chars=None):
+        output = encode_tool_output(res, omit, description_chars=description_chars)
+        tokens = estimate_tokens(output)
+        saved = max(0, estimate_tokens(str(res)) - tokens) if TOOL_OUTPUT_FORMAT != "repr" else 0
+        self.tool_output_tokens += tokens
+        self.tool_output_tokens_saved += saved
+        TOOL_OUTPUT_TOKENS.labels("sent").inc(tokens)
+        TOOL_OUTPUT_TOKENS.labels("saved").inc(saved)
+        return output
 
     async def executeToolCalls(self, tool_calls):
         tasks = [self.run_tool(tc) for tc in tool_calls]
@@ -160,75 +242,98 @@ class TodoAPIHelper:
             })
         return results_arr
     
-    def get_run_status(self, run_id):
-        run = client.beta.threads.runs.retrieve(
+    async def add_user_message(self, content):
+        self.api_calls += 1
+        with span("add_message"):
+            return await openai_api.call(lambda: client.beta.threads.messages.create(
                 thread_id=self.thread_id,
-                run_id=run_id
-                )
-        run_status = run.status
-        return run_status
+                role="user",
+                content=content
+            ))
+
+    async def _stream(self, open_stream):
+        """Consume one run stream under its deadline; the run's state arrives through MyEventHandler."""
+        async def attempt():
+            async with open_stream() as stream:
+                await stream.until_done()
+        self.api_calls += 1
+        with span("run_stream"):
+            await openai_api.call(attempt, timeout=OPENAI_STREAM_TIMEOUT)
+
+    async def _cancel_run(self, run_id):
+        self.api_calls += 1
+        try:
+            await openai_api.call(lambda: client.beta.threads.runs.cancel(thread_id=self.thread_id, run_id=run_id),
+                                  idempotent=True)
+        except Exception as e:
+            logging.warning(f"Could not cancel run {run_id}: {e}")
 
     async def stream_assistant_response(self):
         self.tool_calls = []
-        with client.beta.threads.runs.stream(
-            thread_id=self.thread_id,
-            assistant_id=assistant_id,
-            event_handler=MyEventHandler(helper=self),
-        ) as stream:
-            stream.until_done()
-        run_status = self.get_run_status(self.run_id)
-        while run_status in ('queued', 'in_progress', 'requires_action'):
-            if run_status == 'requires_action':
-                try:
+        self.latest_message = None
+        self.run_status = None
+        self.run_error = None
+        self.prompt_tokens = None
+        extra = {"additional_instructions": self.additional_instructions} if self.additional_instructions else {}
+        try:
+            await self._stream(lambda: client.beta.threads.runs.stream(
+                thread_id=self.thread_id,
+                assistant_id=assistant_id,
+                truncation_strategy=TRUNCATION_STRATEGY,
+                event_handler=MyEventHandler(helper=self),
+                **extra,
+            ))
+            while self.run_status == 'requires_action':
+                with span("tool_calls", count=len(self.tool_calls)):
                     tool_outputs = await self.executeToolCalls(self.tool_calls)
-                    self.tool_calls = []
-                    with client.beta.threads.runs.submit_tool_outputs_stream(
-                            thread_id=self.thread_id,
-                            run_id=self.run_id,
-                            tool_outputs=tool_outputs,
-                            event_handler=MyEventHandler(helper=self)
-                        ) as stream:
-                            stream.until_done()
-                except Exception as e:
-                    print(e)
-                    self.tool_calls = []
-                    client.beta.threads.runs.cancel(
-                        thread_id=self.thread_id,
-                        run_id=self.run_id
-                    )
-                    break
-            else:
-                await asyncio.sleep(1)
-            run_status = self.get_run_status(self.run_id)
-        self.run_id = None
-        messages = client.beta.threads.messages.list(self.thread_id)
-        latest_message = messages.data[0].content[0].text
-        return latest_message
+                self.tool_calls = []
+                await self._stream(lambda: client.beta.threads.runs.submit_tool_outputs_stream(
+                    thread_id=self.thread_id,
+                    run_id=self.run_id,
+                    tool_outputs=tool_outputs,
+                    event_handler=MyEventHandler(helper=self)
+                ))
+        except BaseException as e:
+            # A run left active would make the thread reject the chat's next message
+            if self.run_id is not None and self.run_status not in FINISHED_RUN_STATUSES:
+                logging.warning(f"Run {self.run_id} did not finish ({e!r}), cancelling it")
+                cancel = asyncio.ensure_future(self._cancel_run(self.run_id))
+                if not isinstance(e, asyncio.CancelledError):
+                    await cancel
+                self.run_status = 'cancelled'
+            raise
+        finally:
+            logging.info(f"Run {self.run_id} finished as {self.run_status} after {self.api_calls} OpenAI API calls, "
+                         f"tool outputs ~{self.tool_output_tokens} tokens (~{self.tool_output_tokens_saved} saved by compact encoding)")
+            self.run_id = None
+        if self.latest_message is None:
+            raise Exception(f"The assistant run ended as {self.run_status}: {self.run_error or 'no reply was produced'}")
+        return self.latest_message
 
-async def generate_transcript(audio_path):
-    logging.info(f"Generating transcript for: {audio_path}")
+async def generate_transcript(audio_bytes: bytes, content_type: str = "audio/ogg"):
+    logging.info(f"Generating transcript for {len(audio_bytes)} bytes of {content_type}")
     fal_client.api_key = FAL_API_KEY # or is the key loaded from env variable, i don't know, i set both
 
-    with open(audio_path, "rb") as audio_file:
-        audio_bytes = audio_file.read()
+    async def transcribe():
+        logging.info("Uploading audio to fal.ai")
 
-    logging.info("Uploading audio file to fal.ai")
+        audio_url = await fal_client.upload_async(audio_bytes, content_type)
 
-    audio_url = await fal_client.upload_async(audio_bytes, "audio/ogg")
+        logging.info(f"Going to pass the audio url {audio_url} to fal and transcribe")
 
-    logging.info(f"Going to pass the audio url {audio_url} to fal and transcribe")
+        handler = await fal_client.submit_async(
+            "fal-ai/wizper",
+            arguments={
+                "audio_url": audio_url,
+                "task": "transcribe",
+                "language": "en",
+                "chunk_level": "segment",
+                "version": "3",
+            },
+        )
 
-    handler = await fal_client.submit_async(
-        "fal-ai/wizper",
-        arguments={
-            "audio_url": audio_url,
-            "task": "transcribe",
-            "language": "en",
-            "chunk_level": "segment",
-            "version": "3",
-        },
-    )
+        result = await handler.get()
+        return result["text"]
 
-    result = await handler.get()
-    transcript = result["text"]
-    return transcript
\ No newline at end of file
+    # Upload and transcription together, retried as a whole: nothing is stored on fal's side
+    return await fal_api.call(transcribe, idempotent=True)
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import time
+from bot_helper import CHATS_DB, open_shared_connection, release_shared_connection, run_in_db_thread
+from resilience import openai_api
+from telemetry import span
+
+# Pillow is in requirements.txt; without it images are uploaded exactly as received
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+# Images larger than this (bytes or pixels on the longest side) are downscaled
+# and re-encoded before upload
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(1024 * 1024)))
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "2048"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# Uploaded files not reused for this many seconds are deleted from OpenAI; 0 keeps them forever
+IMAGE_FILE_TTL = float(os.getenv("IMAGE_FILE_TTL", str(30 * 24 * 3600)))
+IMAGE_REAP_INTERVAL = float(os.getenv("IMAGE_REAP_INTERVAL", "3600"))
+IMAGE_DB = os.getenv("IMAGE_DB", CHATS_DB)
+
+def shrink_image(data, file_name):
+    """Downscale/recompress `data` if it is over the limits. Returns (data, file_name)."""
+    if Image is None:
+        return data, file_name
+    try:
+        image = Image.open(io.BytesIO(data))
+        too_large = max(image.size) > IMAGE_MAX_DIMENSION
+        if not too_large and len(data) <= IMAGE_MAX_BYTES:
+            return data, file_name
+        # Re-encoding drops the EXIF orientation, so apply it to the pixels first
+        image = ImageOps.exif_transpose(image)
+        if too_large:
+            image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+        output = io.BytesIO()
+        stem = os.path.splitext(file_name)[0]
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        if has_alpha:
+            image.save(output, format="PNG", optimize=True)
+            file_name = f"{stem}.png"
+        else:
+            image.convert("RGB").save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+            file_name = f"{stem}.jpg"
+    except Exception as e:
+        logging.warning(f"Could not process image {file_name}, uploading it unchanged: {e}")
+        return data, file_name
+    if output.tell() >= len(data):
+        return data, file_name
+    logging.info(f"Shrunk image {file_name} from {len(data)} to {output.tell()} bytes")
+    return output.getvalue(), file_name
+
+class ImageStore:
+    """Uploads chat images to OpenAI once and remembers the resulting file IDs.
+
+    An image is recognised by Telegram's file_unique_id before it is downloaded,
+    and by a hash of its content after, so re-sent and forwarded images reuse the
+    existing upload. A background reaper deletes uploads that haven't been used
+    for IMAGE_FILE_TTL seconds.
+    """
+
+    def __init__(self, db_file=IMAGE_DB, ttl=IMAGE_FILE_TTL, reap_interval=IMAGE_REAP_INTERVAL):
+        self.db_file = db_file
+        self.ttl = ttl
+        self.reap_interval = reap_interval
+        self._conn = None
+        self._pending = {}
+        self._reaper = None
+        self.uploads = 0
+        self.reused = 0
+        self.bytes_received = 0
+        self.bytes_uploaded = 0
+        self.reaped = 0
+
+    def connect(self):
+        if self._conn is None:
+            # One row per Telegram file; several rows share an OpenAI file when their content matched
+            self._conn = open_shared_connection(self.db_file, [
+                '''CREATE TABLE IF NOT EXISTS image_files
+                   (file_unique_id TEXT PRIMARY KEY, content_hash TEXT, file_id TEXT, used_at REAL)''',
+                "CREATE INDEX IF NOT EXISTS ix_image_files_hash ON image_files (content_hash)",
+                "CREATE INDEX IF NOT EXISTS ix_image_files_file_id ON image_files (file_id)",
+            ])
+        return self._conn
+
+    def _find(self, column, value):
+        conn = self.connect()
+        row = conn.execute(f"SELECT file_id FROM image_files WHERE {column} = ? LIMIT 1", (value,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE image_files SET used_at = ? WHERE file_id = ?", (time.time(), row[0]))
+        conn.commit()
+        return row[0]
+
+    def _remember(self, file_unique_id, content_hash, file_id):
+        conn = self.connect()
+        conn.execute("INSERT OR REPLACE INTO image_files (file_unique_id, content_hash, file_id, used_at) VALUES (?, ?, ?, ?)",
+                     (file_unique_id, content_hash, file_id, time.time()))
+        conn.commit()
+
+    async def _upload(self, file_unique_id, download, client):
+        file_name, data = await download()
+        self.bytes_received += len(data)
+        content_hash = hashlib.sha256(data).hexdigest()
+        file_id = await run_in_db_thread(self._find, "content_hash", content_hash)
+        if file_id is not None:
+            self.reused += 1
+            logging.info(f"Reusing OpenAI file {file_id} for identical image content")
+            await run_in_db_thread(self._remember, file_unique_id, content_hash, file_id)
+            return file_id
+
+        with span("shrink_image"):
+            data, file_name = await asyncio.to_thread(shrink_image, data, file_name)
+        with span("upload_image", bytes=len(data)):
+            uploaded = await openai_api.call(lambda: client.files.create(file=(file_name, data), purpose="assistants"))
+        self.uploads += 1
+        self.bytes_uploaded += len(data)
+        await run_in_db_thread(self._remember, file_unique_id, content_hash, uploaded.id)
+        return uploaded.id
+
+    async def get_or_upload(self, file_unique_id, download, client):
+        """Return an OpenAI file ID for the image, calling `download()` -> (file_name, bytes) only if needed."""
+        file_id = await run_in_db_thread(self._find, "file_unique_id", file_unique_id)
+        if file_id is not None:
+            self.reused += 1
+            logging.info(f"Reusing OpenAI file {file_id} for image {file_unique_id}")
+            return file_id
+
+        pending = self._pending.get(file_unique_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._upload(file_unique_id, download, client))
+            self._pending[file_unique_id] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(file_unique_id, None))
+        else:
+            self.reused += 1
+        return await asyncio.shield(pending)
+
+    def _stale(self, cutoff):
+        return [row[0] for row in self.connect().execute(
+            "SELECT file_id FROM image_files GROUP BY file_id HAVING MAX(used_at) < ?", (cutoff,))]
+
+    def _forget(self, file_id):
+        conn = self.connect()
+        conn.execute("DELETE FROM image_files WHERE file_id = ?", (file_id,))
+        conn.commit()
+
+    async def reap(self, client):
+        """Delete uploads that haven't been used within the TTL, from OpenAI and from the store."""
+        stale = await run_in_db_thread(self._stale, time.time() - self.ttl)
+        for file_id in stale:
+            try:
+                await openai_api.call(lambda: client.files.delete(file_id), idempotent=True)
+            except Exception as e:
+                # Already gone remotely is fine, anything else is retried next round
+                if getattr(e, "status_code", None) != 404:
+                    logging.warning(f"Could not delete OpenAI file {file_id}: {e}")
+                    continue
+            await run_in_db_thread(self._forget, file_id)
+            self.reaped += 1
+        if stale:
+            logging.info(f"Reaped {len(stale)} stale image uploads")
+
+    async def _reap_forever(self, client):
+        while True:
+            try:
+                await self.reap(client)
+            except Exception:
+                logging.exception("Image reaper failed")
+            await asyncio.sleep(self.reap_interval)
+
+    def start_reaper(self, client):
+        if Image is None:
+            logging.warning("Pillow is not installed, images will be uploaded without downscaling")
+        if self.ttl > 0 and self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_forever(client))
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+        if self._conn is not None:
+            release_shared_connection(self.db_file)
+            self._conn = None
+
+    def stats(self):
+        return {
+            "uploads": self.uploads,
+            "reused": self.reused,
+            "bytes_received": self.bytes_received,
+            "bytes_uploaded": self.bytes_uploaded,
+            "reaped": self.reaped,
+        }
+
+image_store = ImageStore()
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import time
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+# Minimum seconds between two edits of the same reply. Telegram throttles edits
+# to roughly one per second per chat, so deltas in between are coalesced
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+STREAM_PLACEHOLDER = os.getenv("STREAM_PLACEHOLDER", "…")
+
+def split_message(text, limit=MessageLimit.MAX_TEXT_LENGTH):
+    """Split `text` into Telegram-sized messages, at line breaks where possible."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+async def reply_in_parts(message, text):
+    for part in split_message(text):
+        await message.reply_text(part)
+
+class ReplyStreamer:
+    """Posts a placeholder reply and edits it as the assistant's text streams in."""
+
+    def __init__(self, message, edit_interval=STREAM_EDIT_INTERVAL, placeholder=STREAM_PLACEHOLDER):
+        self.message = message
+        self.edit_interval = edit_interval
+        self.placeholder = placeholder
+        self.reply = None
+        self.text = ""
+        self.sent_text = ""
+        self.edits = 0
+        self.started_at = time.monotonic()
+        self.first_text_at = None
+        self._last_edit = 0.0
+        self._blocked_until = 0.0
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        self.reply = await self.message.reply_text(self.placeholder)
+        self.sent_text = self.placeholder
+
+    async def update(self, text):
+        self.text = text
+        if self._flush_task is None or self._flush_task.done():
+            now = time.monotonic()
+            delay = max(0.0, self._last_edit + self.edit_interval - now, self._blocked_until - now)
+            self._flush_task = asyncio.create_task(self._flush(delay))
+
+    async def _flush(self, delay):
+        await asyncio.sleep(delay)
+        try:
+            await self._edit(self.text)
+        except TelegramError as e:
+            # Intermediate edits are best effort; finish() still delivers the reply
+            logging.warning(f"Could not update the streamed reply: {e}")
+
+    async def _edit(self, text):
+        async with self._lock:
+            text = text[:MessageLimit.MAX_TEXT_LENGTH]
+            if self.reply is None or not text.strip() or text == self.sent_text:
+                return True
+            try:
+                await self.reply.edit_text(text)
+            except RetryAfter as e:
+                self._blocked_until = time.monotonic() + e.retry_after
+                return False
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+            if self.first_text_at is None:
+                self.first_text_at = time.monotonic()
+            self.sent_text = text
+            self.edits += 1
+            self._last_edit = time.monotonic()
+            return True
+
+    async def finish(self, text):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        if self.reply is None:
+            await reply_in_parts(self.message, text)
+            return
+
+        first, *rest = split_message(text)
+        edited = False
+        for _ in range(3):
+            await asyncio.sleep(max(0.0, self._blocked_until - time.monotonic()))
+            try:
+                edited = await self._edit(first)
+            except TelegramError as e:
+                # E.g. the user deleted the placeholder
+                logging.warning(f"Could not edit the streamed reply, sending it as a new message: {e}")
+                break
+            if edited:
+                break
+        if not edited:
+            await self.message.reply_text(first)
+        # Anything beyond a single Telegram message goes out as follow-up replies
+        for part in rest:
+            await self.message.reply_text(part)
+
+        if self.first_text_at is not None:
+            logging.info(f"Streamed reply: first text after {self.first_text_at - self.started_at:.2f}s, {self.edits} edits")
@@ -0,0 +1,210 @@
+import aiohttp
+import asyncio
+import httpx
+import logging
+import openai
+import os
+import random
+import time
+
+# Deadlines, retries and circuit breakers for the bot's outbound calls. Every
+# dependency gets a Dependency below; calls go through Dependency.call
+
+class DependencyError(Exception):
+    """An outbound call that failed in a way the user should hear about. The message is shown to them."""
+
+    def __init__(self, dependency, message):
+        super().__init__(message)
+        self.dependency = dependency
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures, so calls fail fast instead of
+    piling up behind a dependency that is down. After `reset_timeout` seconds one trial
+    call is let through (half-open); its outcome closes or re-opens the breaker."""
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+
+    def allow(self):
+        if self.state == self.CLOSED or not self.failure_threshold:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            logging.info(f"Circuit breaker for {self.name} is half-open, trying one call")
+        if self.state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def abandon_trial(self):
+        """The trial call was cancelled before it said anything about the dependency; let the next call try."""
+        self._trial_running = False
+
+    def record_success(self):
+        self._trial_running = False
+        self.consecutive_failures = 0
+        if self.state != self.CLOSED:
+            logging.info(f"Circuit breaker for {self.name} closed")
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        self._trial_running = False
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or (self.failure_threshold and self.consecutive_failures >= self.failure_threshold):
+            if self.state != self.OPEN:
+                logging.warning(f"Circuit breaker for {self.name} opened after {self.consecutive_failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+class Dependency:
+    """One outbound dependency: a deadline per call, retries with full jitter for
+    calls that are safe to repeat, a circuit breaker and an optional cap on calls
+    in flight, so a slow dependency can't tie up every chat's turn.
+
+    `transient(e)` says whether an exception is the dependency's fault (a
+    timeout, a dropped connection, a 5xx) rather than the request's; only those
+    count against the breaker or are retried. `unsent(e)` says whether the
+    request never reached the dependency, which makes any call safe to retry.
+    """
+
+    def __init__(self, name, label, timeout, retries=2, backoff=0.2, failure_threshold=5, reset_timeout=30.0,
+                 max_concurrent=0, transient=lambda e: False, unsent=lambda e: False):
+        self.name = name
+        self.label = label
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.transient = transient
+        self.unsent = unsent
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._slots = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+        self.calls = 0
+        self.failures = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.in_flight = 0
+
+    async def _attempt(self, operation):
+        if self._slots is None:
+            return await operation()
+        async with self._slots:
+            return await operation()
+
+    async def call(self, operation, idempotent=False, timeout=None):
+        """Run `operation()` (a coroutine function) under this dependency's policies."""
+        timeout = timeout or self.timeout
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.rejected += 1
+                raise DependencyError(self.name, f"{self.label} is unavailable right now, please try again in a minute.")
+            trial = self.breaker.state == CircuitBreaker.HALF_OPEN
+            self.calls += 1
+            self.in_flight += 1
+            try:
+                result = await asyncio.wait_for(self._attempt(operation), timeout)
+            except asyncio.CancelledError:
+                if trial:
+                    self.breaker.abandon_trial()
+                raise
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                error = DependencyError(self.name, f"{self.label} took too long to respond, please try again.")
+                retry = idempotent
+            except Exception as e:
+                if not self.transient(e):
+                    # The dependency answered, it just refused this request
+                    self.breaker.record_success()
+                    raise
+                error = e
+                retry = idempotent or self.unsent(e)
+            else:
+                self.breaker.record_success()
+                return result
+            finally:
+                self.in_flight -= 1
+
+            self.failures += 1
+            self.breaker.record_failure()
+            if not retry or attempt >= self.retries:
+                if isinstance(error, DependencyError):
+                    raise error
+                raise DependencyError(self.name, f"{self.label} is having problems right now, please try again.") from error
+            attempt += 1
+            self.retried += 1
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            logging.warning(f"{self.name} call failed ({error!r}), retry {attempt}/{self.retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "breaker_open": int(self.breaker.state == CircuitBreaker.OPEN),
+            "breaker_half_open": int(self.breaker.state == CircuitBreaker.HALF_OPEN),
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retried,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "in_flight": self.in_flight,
+        }
+
+def dependency_from_env(name, label, timeout, retries, max_concurrent=0, **kwargs):
+    """A Dependency whose limits can be overridden with <NAME>_TIMEOUT, <NAME>_RETRIES,
+    <NAME>_BREAKER_FAILURES, <NAME>_BREAKER_RESET and <NAME>_MAX_CONCURRENT."""
+    prefix = name.upper()
+    return Dependency(
+        name, label,
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", str(timeout))),
+        retries=int(os.getenv(f"{prefix}_RETRIES", str(retries))),
+        failure_threshold=int(os.getenv(f"{prefix}_BREAKER_FAILURES", "5")),
+        reset_timeout=float(os.getenv(f"{prefix}_BREAKER_RESET", "30")),
+        max_concurrent=int(os.getenv(f"{prefix}_MAX_CONCURRENT", str(max_concurrent))),
+        **kwargs,
+    )
+
+def _todo_api_transient(e):
+    # TodoAPIError and aiohttp's response errors carry the HTTP status. A plain 500
+    # is the API failing on this request and would fail again, so it isn't retried
+    # or counted against the breaker; only "try again later" statuses are
+    status = getattr(e, "status", None)
+    if status is not None:
+        return status in (429, 502, 503, 504)
+    return isinstance(e, aiohttp.ClientError)
+
+def _todo_api_unsent(e):
+    return isinstance(e, aiohttp.ClientConnectorError)
+
+def _openai_transient(e):
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code >= 500 or e.status_code in (408, 429)
+    return isinstance(e, openai.APIConnectionError)
+
+def _openai_unsent(e):
+    return isinstance(e, openai.APIConnectionError) and isinstance(e.__cause__, (httpx.ConnectError, httpx.ConnectTimeout))
+
+def _fal_transient(e):
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500 or e.response.status_code == 429
+    return isinstance(e, httpx.TransportError)
+
+# Per-dependency limits. Deadlines apply to each attempt; retries only to calls
+# that are safe to repeat (reads, PUTs, cancels, transcriptions) or that never
+# reached the server. The labels are what users are told when a call fails
+todo_api = dependency_from_env("todo_api", "The to-do service", timeout=float(os.getenv("HTTP_TIMEOUT", "10")), retries=2,
+                               transient=_todo_api_transient, unsent=_todo_api_unsent)
+openai_api = dependency_from_env("openai", "The assistant", timeout=30, retries=2,
+                                 transient=_openai_transient, unsent=_openai_unsent)
+fal_api = dependency_from_env("fal", "Voice transcription", timeout=60, retries=1, max_concurrent=16,
+                              transient=_fal_transient)
+
+DEPENDENCIES = [todo_api, openai_api, fal_api]
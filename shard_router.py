@@ -0,0 +1,289 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import signal
+import subprocess
+import sys
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+from telegram import Bot, Update
+from telemetry import start_telemetry, stats_collector, stop_telemetry
+
+load_dotenv()
+
+# Webhook mode: Telegram posts updates to a router, which forwards each one to
+# the bot worker that owns its chat. A chat always maps to the same worker, so
+# its messages stay in order and its thread, task cache and bursts stay in one
+# process, while different chats are spread over every core (and machine)
+
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+# Public HTTPS URL Telegram delivers to; the webhook is registered on startup when set
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+# Telegram echoes this in the X-Telegram-Bot-Api-Secret-Token header of every delivery;
+# required, since ALLOWED_CHATS trusts the chat ID inside the update
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Parallel webhook connections Telegram may open (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Comma-separated base URLs of already running workers (`python bot.py worker`),
+# e.g. on other machines. When empty the router starts BOT_WORKERS local ones
+WORKER_URLS = [url.strip().rstrip("/") for url in os.getenv("WORKER_URLS", "").split(",") if url.strip()]
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", str(os.cpu_count() or 1)))
+WORKER_HOST = os.getenv("WORKER_HOST", "127.0.0.1")
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8600"))
+# Sent by the router and checked by workers, so only the router can inject updates.
+# Required; defaults to WEBHOOK_SECRET
+WORKER_SECRET = os.getenv("WORKER_SECRET") or WEBHOOK_SECRET
+WORKER_TIMEOUT = float(os.getenv("WORKER_TIMEOUT", "5"))
+
+def require_secret(name, value):
+    """Webhook and worker endpoints accept updates from the network; refuse to serve them unauthenticated."""
+    if not value:
+        raise SystemExit(f"{name} must be set in webhook and worker mode, otherwise anyone can post forged updates")
+
+def require_shared_thread_store(thread_store):
+    """Workers may run on several machines, so a chat's thread must live in the Todo API, not a per-host chats.db."""
+    if thread_store != "todo-api":
+        raise SystemExit(f"THREAD_STORE must be todo-api in webhook and worker mode, not {thread_store!r}")
+
+def _secret_matches(request, header, secret):
+    return hmac.compare_digest(request.headers.get(header, "").encode(), secret.encode())
+
+def update_chat_id(data):
+    """The chat an update payload belongs to, read from the raw JSON without building an Update."""
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        # Callback queries carry the chat on their message
+        for source in (value, value.get("message") or {}):
+            chat = source.get("chat")
+            if isinstance(chat, dict) and "id" in chat:
+                return chat["id"]
+        user = value.get("from")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+    return 0
+
+def _weight(worker, chat_id):
+    return int.from_bytes(hashlib.blake2b(f"{worker}|{chat_id}".encode(), digest_size=8).digest(), "big")
+
+def pick_worker(chat_id, workers):
+    """Rendezvous hashing: stable across processes and restarts, and adding or
+    removing a worker only moves the chats that worker gains or loses."""
+    return max(workers, key=lambda worker: _weight(worker, chat_id))
+
+async def wait_for_shutdown():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+class UpdateRouter:
+    """Receives Telegram's webhook deliveries and forwards each to its chat's worker.
+
+    Delivery is acknowledged once the worker has queued the update, not when it
+    has been answered. A worker that can't be reached gets a 503 back to
+    Telegram, which redelivers the update later. Updates for one chat are
+    forwarded one at a time so concurrent deliveries can't overtake each other.
+    """
+
+    def __init__(self, workers, secret=WEBHOOK_SECRET, worker_secret=WORKER_SECRET):
+        require_secret("WEBHOOK_SECRET", secret)
+        require_secret("WORKER_SECRET", worker_secret)
+        self.workers = workers
+        self.secret = secret
+        self.worker_secret = worker_secret
+        self._session = None
+        self._chat_locks = {}
+        self.routed = {worker: 0 for worker in workers}
+        self.failed = 0
+        self.rejected = 0
+
+        self.app = web.Application()
+        self.app.add_routes([web.post(WEBHOOK_PATH, self.handle_update), web.get("/health", self.health)])
+
+    async def start(self, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=WORKER_TIMEOUT))
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info(f"Routing webhook updates on {host}:{port}{WEBHOOK_PATH} to {len(self.workers)} workers")
+
+    async def close(self):
+        await self._runner.cleanup()
+        await self._session.close()
+
+    async def health(self, request):
+        return web.json_response(self.stats())
+
+    async def _forward(self, worker, data):
+        try:
+            async with self._session.post(f"{worker}/update", json=data, headers={"X-Worker-Secret": self.worker_secret}) as response:
+                if response.status == 200:
+                    return True
+                logging.error(f"Worker {worker} refused update {data.get('update_id')}: HTTP {response.status}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Worker {worker} unreachable for update {data.get('update_id')}: {e!r}")
+        return False
+
+    async def handle_update(self, request):
+        if not _secret_matches(request, "X-Telegram-Bot-Api-Secret-Token", self.secret):
+            self.rejected += 1
+            return web.Response(status=403)
+        data = await request.json()
+        chat_id = update_chat_id(data)
+        worker = pick_worker(chat_id, self.workers)
+
+        # [lock, users]: the entry is dropped once no delivery for the chat is in flight
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                ok = await self._forward(worker, data)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat_id]
+
+        if not ok:
+            self.failed += 1
+            return web.Response(status=503)
+        self.routed[worker] += 1
+        return web.Response()
+
+    def stats(self):
+        return {
+            "workers": len(self.workers),
+            "routed": sum(self.routed.values()),
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "chats_in_flight": len(self._chat_locks),
+        }
+
+async def start_worker_server(application, host=WORKER_HOST, port=WORKER_BASE_PORT, secret=WORKER_SECRET):
+    """Accept updates from the router and queue them on `application` (started without an updater)."""
+    require_secret("WORKER_SECRET", secret)
+
+    async def handle_update(request):
+        if not _secret_matches(request, "X-Worker-Secret", secret):
+            return web.Response(status=403)
+        await application.update_queue.put(Update.de_json(await request.json(), application.bot))
+        return web.Response()
+
+    async def health(request):
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.add_routes([web.post("/update", handle_update), web.get("/health", health)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Bot worker accepting updates on {host}:{port}")
+    return runner
+
+class LocalWorkers:
+    """Runs `bot.py worker` processes on this machine and restarts any that exit."""
+
+    def __init__(self, count=BOT_WORKERS, host=WORKER_HOST, base_port=WORKER_BASE_PORT):
+        self.ports = [base_port + i for i in range(count)]
+        self.host = host
+        self.processes = {}
+        self.restarts = 0
+
+    @property
+    def urls(self):
+        return [f"http://{self.host}:{port}" for port in self.ports]
+
+    def _spawn(self, index, port):
+        env = dict(os.environ)
+        # Every worker needs its own metrics port; the router keeps METRICS_PORT
+        metrics_port = int(env.get("METRICS_PORT") or 0)
+        env["METRICS_PORT"] = str(metrics_port + 1 + index if metrics_port else 0)
+        env.setdefault("THREAD_STORE", "todo-api")
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+        self.processes[port] = subprocess.Popen(
+            [sys.executable, script, "worker", "--host", self.host, "--port", str(port)], env=env
+        )
+
+    def start(self):
+        for index, port in enumerate(self.ports):
+            self._spawn(index, port)
+
+    async def wait_until_up(self, timeout=60.0):
+        deadline = asyncio.get_running_loop().time() + timeout
+        async with aiohttp.ClientSession() as session:
+            for url in self.urls:
+                while True:
+                    try:
+                        async with session.get(f"{url}/health") as response:
+                            if response.status == 200:
+                                break
+                    except aiohttp.ClientError:
+                        pass
+                    if asyncio.get_running_loop().time() > deadline:
+                        raise RuntimeError(f"Worker {url} did not start")
+                    await asyncio.sleep(0.2)
+
+    async def supervise(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            for index, port in enumerate(self.ports):
+                code = self.processes[port].poll()
+                if code is not None:
+                    logging.error(f"Worker on port {port} exited with {code}, restarting it")
+                    self.restarts += 1
+                    self._spawn(index, port)
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+async def run_router():
+    require_secret("WEBHOOK_SECRET", WEBHOOK_SECRET)
+    require_secret("WORKER_SECRET", WORKER_SECRET)
+    # Local workers default to the Todo API's thread store
+    require_shared_thread_store(os.getenv("THREAD_STORE", "todo-api"))
+    local = None
+    if WORKER_URLS:
+        workers = WORKER_URLS
+    else:
+        local = LocalWorkers()
+        local.start()
+        workers = local.urls
+    router = UpdateRouter(workers)
+    stats_collector.register("router", router.stats)
+    supervisor = None
+    try:
+        if local is not None:
+            await local.wait_until_up()
+            supervisor = asyncio.ensure_future(local.supervise())
+        await router.start()
+        start_telemetry()
+        if WEBHOOK_URL:
+            async with Bot(TELEGRAM_TOKEN) as bot:
+                await bot.set_webhook(
+                    WEBHOOK_URL, secret_token=WEBHOOK_SECRET, max_connections=WEBHOOK_MAX_CONNECTIONS,
+                    allowed_updates=[Update.MESSAGE],
+                )
+            logging.info(f"Webhook registered at {WEBHOOK_URL}")
+        await wait_for_shutdown()
+    finally:
+        if supervisor is not None:
+            supervisor.cancel()
+        if router._session is not None:
+            await router.close()
+        if local is not None:
+            local.stop()
+        logging.info(f"Router: {router.stats()}")
+        stop_telemetry()
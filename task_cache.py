@@ -0,0 +1,77 @@
+import os
+import time
+from collections import OrderedDict
+
+# Seconds a cached task list is served without asking the Todo API. After that
+# the list is revalidated with If-None-Match, which costs a 304 if nothing changed
+TASK_CACHE_TTL = float(os.getenv("TASK_CACHE_TTL", "30"))
+TASK_CACHE_SIZE = int(os.getenv("TASK_CACHE_SIZE", "1024"))
+
+class CachedTaskList:
+    def __init__(self, tasks, etag):
+        self.tasks = tasks
+        self.etag = etag
+        self.fetched_at = time.monotonic()
+
+class TaskListCache:
+    """Per-chat read-through cache of get_tasks results.
+
+    Entries are dropped whenever the chat writes through TodoAPIHelper. A
+    per-chat generation counter stops a listing that was already in flight
+    during a write from storing its now stale result.
+    """
+
+    def __init__(self, ttl=TASK_CACHE_TTL, max_chats=TASK_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+        self._generations = {}
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(params):
+        return tuple(sorted((params or {}).items()))
+
+    def generation(self, chat_id):
+        return self._generations.get(chat_id, 0)
+
+    def lookup(self, chat_id, params):
+        entries = self._chats.get(chat_id)
+        if entries is None:
+            return None
+        self._chats.move_to_end(chat_id)
+        return entries.get(self._key(params))
+
+    def is_fresh(self, entry):
+        return time.monotonic() - entry.fetched_at < self.ttl
+
+    def store(self, chat_id, params, tasks, etag, generation):
+        if generation != self.generation(chat_id):
+            return
+        self._chats.setdefault(chat_id, {})[self._key(params)] = CachedTaskList(tasks, etag)
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self.max_chats:
+            evicted, _ = self._chats.popitem(last=False)
+            self._generations.pop(evicted, None)
+
+    def invalidate(self, chat_id):
+        self.invalidations += 1
+        self._generations[chat_id] = self.generation(chat_id) + 1
+        self._chats.pop(chat_id, None)
+
+    def stats(self):
+        lookups = self.hits + self.revalidations + self.misses
+        return {
+            "hits": self.hits,
+            "revalidations": self.revalidations,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            # Hits plus 304s: listings that didn't need the task rows sent again
+            "served_without_transfer_ratio": (self.hits + self.revalidations) / lookups if lookups else 0.0,
+        }
+
+task_list_cache = TaskListCache()
@@ -0,0 +1,167 @@
+import collections
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, REGISTRY, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+
+# Port for the bot's Prometheus endpoint; unset or 0 leaves it off
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_ADDR = os.getenv("METRICS_ADDR", "0.0.0.0")
+# Turns slower than this (seconds) get their event-loop stack samples written to
+# PROFILE_DIR as folded stacks; 0 disables the sampling profiler
+PROFILE_SLOW_TURNS = float(os.getenv("PROFILE_SLOW_TURNS", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram("bot_stage_seconds", "Time spent in each stage of handling a turn", ["stage"], buckets=FAST_BUCKETS + (30.0, 60.0))
+TURN_SECONDS = Histogram("bot_turn_seconds", "Time from a turn starting to its reply being sent", ["outcome"], buckets=SLOW_BUCKETS)
+TOOL_CALL_SECONDS = Histogram("bot_tool_call_seconds", "Duration of assistant tool calls", ["tool", "outcome"], buckets=FAST_BUCKETS)
+MESSAGES = Counter("bot_messages", "Telegram messages handled, by kind", ["kind"])
+# Estimated tokens of tool outputs sent to the assistant, and saved by compact encoding
+TOOL_OUTPUT_TOKENS = Counter("bot_tool_output_tokens", "Estimated tool output tokens", ["kind"])
+
+_current_turn = contextvars.ContextVar("current_turn", default=None)
+
+class TurnTrace:
+    """Timing spans for one turn, from the burst arriving to the reply being sent."""
+
+    def __init__(self, chat_id, messages):
+        self.chat_id = chat_id
+        self.messages = messages
+        self.started = time.perf_counter()
+        self.spans = []
+        self.duration = None
+
+    def to_dict(self):
+        return {
+            "chat_id": self.chat_id,
+            "messages": self.messages,
+            "total": round(self.duration, 4),
+            "spans": [
+                dict({"stage": stage, "start": round(start - self.started, 4), "duration": round(duration, 4)}, **attrs)
+                for stage, start, duration, attrs in sorted(self.spans, key=lambda span: span[1])
+            ],
+        }
+
+# Called with every TurnTrace slower than PROFILE_SLOW_TURNS
+slow_turn_hooks = []
+
+def start_turn(chat_id, messages=1):
+    """Start tracing a turn. Spans opened in this task, or tasks it creates, are attached to it."""
+    trace = TurnTrace(chat_id, messages)
+    _current_turn.set(trace)
+    return trace
+
+def finish_turn(trace, outcome="ok"):
+    trace.duration = time.perf_counter() - trace.started
+    TURN_SECONDS.labels(outcome).observe(trace.duration)
+    logging.info(f"Turn timings: {json.dumps(trace.to_dict())}")
+    if PROFILE_SLOW_TURNS and trace.duration >= PROFILE_SLOW_TURNS:
+        for hook in slow_turn_hooks:
+            try:
+                hook(trace)
+            except Exception:
+                logging.exception("Slow turn hook failed")
+
+@contextmanager
+def span(stage, **attrs):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(duration)
+        trace = _current_turn.get()
+        if trace is not None:
+            trace.spans.append((stage, start, duration, attrs))
+
+class StatsCollector:
+    """Exports the numeric values of components' stats() dicts as gauges."""
+
+    def __init__(self):
+        self.sources = {}
+
+    def register(self, name, stats):
+        self.sources[name] = stats
+
+    def collect(self):
+        for name, stats in self.sources.items():
+            for key, value in stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    yield GaugeMetricFamily(f"bot_{name}_{key}", f"{name} {key.replace('_', ' ')}", value=value)
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack and saves the samples covering slow turns.
+
+    Samples are kept in a ring buffer long enough to cover a slow turn; when one
+    finishes, the samples within it are written as folded stacks (one
+    "frame;frame;frame count" line per stack) that flamegraph tools read directly.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL, out_dir=PROFILE_DIR, window=120.0):
+        self.interval = interval
+        self.out_dir = out_dir
+        self.samples = collections.deque(maxlen=int(window / interval))
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._sampler = threading.Thread(target=self._run, name="turn-profiler", daemon=True)
+        self._sampler.start()
+        slow_turn_hooks.append(self.dump)
+        logging.info(f"Sampling profiler on: turns over {PROFILE_SLOW_TURNS}s are saved to {self.out_dir}")
+
+    def stop(self):
+        self._stop.set()
+        if self.dump in slow_turn_hooks:
+            slow_turn_hooks.remove(self.dump)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples.append((time.perf_counter(), ";".join(reversed(stack))))
+
+    def dump(self, trace):
+        end = trace.started + trace.duration
+        stacks = collections.Counter(stack for at, stack in list(self.samples) if trace.started <= at <= end)
+        if not stacks:
+            return
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"turn-{int(time.time())}-{trace.chat_id}.folded")
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info(f"Slow turn ({trace.duration:.2f}s) for chat_id {trace.chat_id}: {sum(stacks.values())} stack samples saved to {path}")
+
+profiler = SamplingProfiler() if PROFILE_SLOW_TURNS else None
+
+def start_telemetry():
+    """Start the metrics endpoint and the profiler, as configured. Call from the event loop thread."""
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT, addr=METRICS_ADDR)
+        logging.info(f"Serving Prometheus metrics on {METRICS_ADDR}:{METRICS_PORT}")
+    if profiler is not None:
+        profiler.start()
+
+def stop_telemetry():
+    if profiler is not None:
+        profiler.stop()
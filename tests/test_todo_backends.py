@@ -0,0 +1,171 @@
+"""Both Todo backends must answer every call with the same statuses and payloads.
+
+The HTTP backend talks to api.py started with uvicorn; the embedded one runs
+task_store in process. Each test uses its own chat, so they share a database.
+
+    python -m pytest tests
+"""
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from todo_backends import TODO_API_DIR, EmbeddedBackend, HTTPBackend, TodoAPIError
+
+pytestmark = pytest.mark.anyio
+
+_chat_ids = itertools.count(1)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="module")
+def api_url(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("todo_api")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--app-dir", TODO_API_DIR,
+         "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=dict(os.environ, DATABASE_URL=f"sqlite:///{workdir / 'tasks.db'}"),
+    )
+    url = f"http://127.0.0.1:{port}/api"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                urllib.request.urlopen(f"{url}/tasks", timeout=1)
+                break
+            except urllib.error.HTTPError:
+                # Up, just missing the chat-id header
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("The Todo API did not start")
+                time.sleep(0.1)
+        yield url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+@pytest.fixture(params=["http", "embedded"])
+async def backend(request, tmp_path):
+    if request.param == "http":
+        backend = HTTPBackend(request.getfixturevalue("api_url"))
+    else:
+        backend = EmbeddedBackend(database_url=f"sqlite:///{tmp_path / 'tasks.db'}")
+    await backend.start()
+    try:
+        yield backend
+    finally:
+        await backend.close()
+
+
+@pytest.fixture
+def chat_id():
+    return next(_chat_ids)
+
+
+async def assert_error(status, call):
+    with pytest.raises(TodoAPIError) as error:
+        await call
+    assert error.value.status == status
+
+
+async def test_task_round_trip(backend, chat_id):
+    created = await backend.create_task(chat_id, {"title": "Buy milk", "description": "2 litres"})
+    assert created == {"id": created["id"], "title": "Buy milk", "description": "2 litres", "completed": False}
+    assert await backend.get_task(chat_id, created["id"]) == created
+
+    updated = await backend.update_task(chat_id, created["id"], {"completed": True})
+    assert updated == dict(created, completed=True)
+
+    assert await backend.delete_task(chat_id, created["id"]) == updated
+    await assert_error(404, backend.get_task(chat_id, created["id"]))
+
+
+async def test_tasks_are_per_chat(backend, chat_id):
+    created = await backend.create_task(chat_id, {"title": "Private"})
+    other = next(_chat_ids)
+    await assert_error(404, backend.get_task(other, created["id"]))
+    await assert_error(404, backend.update_task(other, created["id"], {"title": "Mine now"}))
+    await assert_error(404, backend.delete_task(other, created["id"]))
+    assert (await backend.list_tasks(other))[0] == []
+
+
+async def test_list_tasks_etag(backend, chat_id):
+    first = await backend.create_task(chat_id, {"title": "First"})
+    second = await backend.create_task(chat_id, {"title": "Second", "completed": True})
+
+    tasks, etag = await backend.list_tasks(chat_id)
+    assert tasks == [first, second]
+    assert (await backend.list_tasks(chat_id, {"completed": False}))[0] == [first]
+    assert (await backend.list_tasks(chat_id, {"limit": 1}))[0] == [first]
+
+    assert await backend.list_tasks(chat_id, etag=etag) == (None, etag)
+    await backend.update_task(chat_id, first["id"], {"title": "Renamed"})
+    tasks, new_etag = await backend.list_tasks(chat_id, etag=etag)
+    assert new_etag != etag
+    assert tasks[0]["title"] == "Renamed"
+
+
+async def test_search_tasks(backend, chat_id):
+    dentist = await backend.create_task(chat_id, {"title": "Book the dentist", "description": "check-up"})
+    await backend.create_task(chat_id, {"title": "Water the plants"})
+    assert await backend.search_tasks(chat_id, {"q": "dentist"}) == [dentist]
+    assert await backend.search_tasks(chat_id, {"q": "dentist", "completed": True}) == []
+    await assert_error(422, backend.search_tasks(chat_id, {"q": ""}))
+
+
+async def test_bulk_operations(backend, chat_id):
+    created = await backend.bulk_create_tasks(chat_id, [{"title": "One"}, {"title": "Two"}])
+    assert [result["ok"] for result in created] == [True, True]
+    one, two = (result["task"] for result in created)
+
+    updated = await backend.bulk_update_tasks(chat_id, [
+        {"task_id": one["id"], "completed": True},
+        {"task_id": two["id"] + 1000, "title": "Missing"},
+    ])
+    assert updated[0] == {"index": 0, "ok": True, "task": dict(one, completed=True), "error": None}
+    assert updated[1] == {"index": 1, "ok": False, "task": None, "error": f"Task {two['id'] + 1000} not found"}
+
+    deleted = await backend.bulk_delete_tasks(chat_id, [two["id"], two["id"]])
+    assert deleted == [
+        {"index": 0, "ok": True, "task": two, "error": None},
+        {"index": 1, "ok": False, "task": None, "error": f"Task {two['id']} not found"},
+    ]
+    assert (await backend.list_tasks(chat_id))[0] == [dict(one, completed=True)]
+
+
+@pytest.mark.parametrize("task_id", [0, -1, 2**63, 10**30])
+async def test_out_of_range_task_ids(backend, chat_id, task_id):
+    await assert_error(422, backend.get_task(chat_id, task_id))
+    await assert_error(422, backend.update_task(chat_id, task_id, {"completed": True}))
+    await assert_error(422, backend.delete_task(chat_id, task_id))
+    await assert_error(422, backend.bulk_update_tasks(chat_id, [{"task_id": task_id, "completed": True}]))
+    await assert_error(422, backend.bulk_delete_tasks(chat_id, [task_id]))
+
+
+async def test_invalid_requests(backend, chat_id):
+    await assert_error(422, backend.create_task(chat_id, {"description": "No title"}))
+    await assert_error(422, backend.bulk_create_tasks(chat_id, []))
+    await assert_error(422, backend.bulk_delete_tasks(chat_id, []))
+
+
+async def test_thread_claims(backend, chat_id):
+    assert await backend.get_thread(chat_id) is None
+    assert await backend.claim_thread(chat_id, "thread_a") == "thread_a"
+    assert await backend.claim_thread(chat_id, "thread_b") == "thread_a"
+    assert await backend.claim_thread(chat_id, "thread_c", replaces="thread_b") == "thread_a"
+    assert await backend.claim_thread(chat_id, "thread_c", replaces="thread_a") == "thread_c"
+    assert await backend.get_thread(chat_id) == "thread_c"
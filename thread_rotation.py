@@ -0,0 +1,195 @@
+import logging
+import os
+import time
+from bot_helper import CHATS_DB, open_shared_connection, release_shared_connection, run_in_db_thread, thread_store
+from resilience import openai_api
+
+# Runs only read the thread's most recent messages, so a long thread costs no
+# more per run than this many messages; 0 leaves truncation to OpenAI ("auto")
+RUN_TRUNCATE_LAST_MESSAGES = int(os.getenv("RUN_TRUNCATE_LAST_MESSAGES", "30"))
+# A chat's thread is replaced by a fresh one, seeded with a summary and the open
+# tasks, once it reaches any of these; 0 turns a limit off
+THREAD_MAX_TURNS = int(os.getenv("THREAD_MAX_TURNS", "60"))
+THREAD_MAX_AGE = float(os.getenv("THREAD_MAX_AGE", str(7 * 24 * 3600)))
+THREAD_MAX_PROMPT_TOKENS = int(os.getenv("THREAD_MAX_PROMPT_TOKENS", "12000"))
+# Model that writes the summary, and how much of the old thread it reads
+THREAD_SUMMARY_MODEL = os.getenv("THREAD_SUMMARY_MODEL", "gpt-4o-mini")
+THREAD_SUMMARY_MESSAGES = int(os.getenv("THREAD_SUMMARY_MESSAGES", "40"))
+THREAD_SUMMARY_MAX_CHARS = int(os.getenv("THREAD_SUMMARY_MAX_CHARS", "1500"))
+# Open tasks listed in the context carried over to the new thread
+THREAD_SNAPSHOT_TASKS = int(os.getenv("THREAD_SNAPSHOT_TASKS", "50"))
+
+if RUN_TRUNCATE_LAST_MESSAGES:
+    TRUNCATION_STRATEGY = {"type": "last_messages", "last_messages": RUN_TRUNCATE_LAST_MESSAGES}
+else:
+    TRUNCATION_STRATEGY = {"type": "auto"}
+
+SUMMARY_PROMPT = (
+    "Summarise this conversation between a user and their to-do list assistant in under 150 words. "
+    "Keep the user's preferences, ongoing plans and anything they asked to be remembered. "
+    "Leave out the task list itself, it is carried over separately."
+)
+
+def message_text(message):
+    return " ".join(block.text.value for block in message.content if block.type == "text").strip()
+
+class ThreadRotator:
+    """Keeps each chat's assistant context bounded by rotating its thread.
+
+    Every turn's size is recorded in CHATS_DB. A thread that has had too many
+    turns, is too old, or whose last run read too many prompt tokens is replaced
+    with a new thread. A summary of the conversation and the open tasks are kept
+    in the thread_context table and passed as additional instructions on every
+    run of the new thread, so truncation never drops them. Rotations are logged
+    in the thread_rotations table, and the previous summary feeds the next one
+    so long-term context survives.
+    """
+
+    def __init__(self, db_file=CHATS_DB, max_turns=THREAD_MAX_TURNS, max_age=THREAD_MAX_AGE,
+                 max_prompt_tokens=THREAD_MAX_PROMPT_TOKENS, threads=thread_store):
+        self.db_file = db_file
+        self.max_turns = max_turns
+        self.max_age = max_age
+        self.max_prompt_tokens = max_prompt_tokens
+        self.threads = threads
+        self._conn = None
+        self.rotations = 0
+        self.failures = 0
+        self.fallback_summaries = 0
+
+    def connect(self):
+        if self._conn is None:
+            self._conn = open_shared_connection(self.db_file, [
+                '''CREATE TABLE IF NOT EXISTS thread_usage
+                   (thread_id TEXT PRIMARY KEY, chat_id INTEGER, started_at REAL,
+                    turns INTEGER, prompt_tokens INTEGER)''',
+                '''CREATE TABLE IF NOT EXISTS thread_rotations
+                   (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, old_thread_id TEXT,
+                    new_thread_id TEXT, reason TEXT, turns INTEGER, prompt_tokens INTEGER,
+                    summary TEXT, rotated_at REAL)''',
+                "CREATE INDEX IF NOT EXISTS ix_thread_rotations_chat ON thread_rotations (chat_id, id)",
+                "CREATE TABLE IF NOT EXISTS thread_context (thread_id TEXT PRIMARY KEY, instructions TEXT)",
+            ])
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            release_shared_connection(self.db_file)
+            self._conn = None
+
+    async def record_turn(self, chat_id, thread_id, prompt_tokens=None):
+        """Count a finished turn. Returns why the thread should be rotated, or None."""
+        return await run_in_db_thread(self._record_turn, chat_id, thread_id, prompt_tokens)
+
+    def _record_turn(self, chat_id, thread_id, prompt_tokens):
+        conn = self.connect()
+        conn.execute('''INSERT INTO thread_usage (thread_id, chat_id, started_at, turns, prompt_tokens)
+                        VALUES (?, ?, ?, 1, ?)
+                        ON CONFLICT(thread_id) DO UPDATE SET turns = turns + 1,
+                        prompt_tokens = COALESCE(excluded.prompt_tokens, prompt_tokens)''',
+                     (thread_id, chat_id, time.time(), prompt_tokens))
+        conn.commit()
+        started_at, turns, tokens = conn.execute(
+            "SELECT started_at, turns, prompt_tokens FROM thread_usage WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        if self.max_turns and turns >= self.max_turns:
+            return f"{turns} turns"
+        if self.max_prompt_tokens and tokens and tokens >= self.max_prompt_tokens:
+            return f"{tokens} prompt tokens"
+        if self.max_age and time.time() - started_at >= self.max_age:
+            return f"{int(time.time() - started_at)}s old"
+        return None
+
+    async def instructions(self, thread_id):
+        """Context carried over to a rotated thread, for its runs' additional instructions."""
+        return await run_in_db_thread(self._instructions, thread_id)
+
+    def _instructions(self, thread_id):
+        row = self.connect().execute("SELECT instructions FROM thread_context WHERE thread_id = ?", (thread_id,)).fetchone()
+        return row[0] if row else None
+
+    def history(self, chat_id, limit=10):
+        """The chat's latest rotations, newest first."""
+        rows = self.connect().execute(
+            '''SELECT old_thread_id, new_thread_id, reason, turns, prompt_tokens, summary, rotated_at
+               FROM thread_rotations WHERE chat_id = ? ORDER BY id DESC LIMIT ?''', (chat_id, limit)
+        ).fetchall()
+        keys = ("old_thread_id", "new_thread_id", "reason", "turns", "prompt_tokens", "summary", "rotated_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    async def summarize(self, chat_id, thread_id, client):
+        page = await openai_api.call(lambda: client.beta.threads.messages.list(
+            thread_id=thread_id, limit=THREAD_SUMMARY_MESSAGES, order="desc"), idempotent=True)
+        lines = [f"{message.role.capitalize()}: {message_text(message)}" for message in reversed(page.data) if message_text(message)]
+        previous = await run_in_db_thread(self.history, chat_id, limit=1)
+        if previous and previous[0]["summary"]:
+            lines.insert(0, f"Summary of what came before: {previous[0]['summary']}")
+        if not lines:
+            return ""
+        try:
+            completion = await openai_api.call(lambda: client.chat.completions.create(
+                model=THREAD_SUMMARY_MODEL,
+                messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": "\n".join(lines)}],
+                max_tokens=300,
+            ), idempotent=True)
+            summary = (completion.choices[0].message.content or "").strip()
+        except Exception as e:
+            logging.warning(f"Summarising thread {thread_id} failed, carrying over its last messages instead: {e}")
+            summary = ""
+        if not summary:
+            # Keep the most recent exchanges verbatim rather than losing all context
+            self.fallback_summaries += 1
+            summary = "\n".join(lines)[-THREAD_SUMMARY_MAX_CHARS:]
+        return summary[:THREAD_SUMMARY_MAX_CHARS]
+
+    @staticmethod
+    def carry_over(summary, tasks):
+        parts = ["This conversation continues an earlier one."]
+        if summary:
+            parts.append(f"Summary so far:\n{summary}")
+        if tasks:
+            listed = "\n".join(f"#{task['id']} {task['title']}" for task in tasks[:THREAD_SNAPSHOT_TASKS])
+            more = f"\n(and {len(tasks) - THREAD_SNAPSHOT_TASKS} more)" if len(tasks) > THREAD_SNAPSHOT_TASKS else ""
+            parts.append(f"Open tasks when this thread started:\n{listed}{more}")
+        else:
+            parts.append("There were no open tasks when this thread started.")
+        return "\n\n".join(parts)
+
+    async def rotate(self, chat_id, thread_id, reason, helper, client):
+        """Replace the chat's thread; returns the thread now in use. Failures keep the old thread."""
+        try:
+            summary = await self.summarize(chat_id, thread_id, client)
+            tasks = await helper.get_tasks()
+            new_thread = await openai_api.call(lambda: client.beta.threads.create())
+            current = await self.threads.replace(chat_id, thread_id, new_thread.id)
+            if current != new_thread.id:
+                # Rotated elsewhere in the meantime; that thread stays in use
+                await openai_api.call(lambda: client.beta.threads.delete(new_thread.id), idempotent=True)
+                return current
+            await run_in_db_thread(self._log_rotation, chat_id, thread_id, new_thread.id, reason, summary,
+                                   self.carry_over(summary, tasks))
+        except Exception:
+            self.failures += 1
+            logging.exception(f"Rotating thread {thread_id} of chat_id {chat_id} failed, keeping it")
+            return thread_id
+        self.rotations += 1
+        logging.info(f"Rotated chat_id {chat_id} from thread {thread_id} to {new_thread.id} ({reason})")
+        return new_thread.id
+
+    def _log_rotation(self, chat_id, thread_id, new_thread_id, reason, summary, instructions):
+        conn = self.connect()
+        usage = conn.execute("SELECT turns, prompt_tokens FROM thread_usage WHERE thread_id = ?", (thread_id,)).fetchone() or (None, None)
+        conn.execute('''INSERT INTO thread_rotations
+                        (chat_id, old_thread_id, new_thread_id, reason, turns, prompt_tokens, summary, rotated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (chat_id, thread_id, new_thread_id, reason, *usage, summary, time.time()))
+        conn.execute("INSERT OR REPLACE INTO thread_context (thread_id, instructions) VALUES (?, ?)",
+                     (new_thread_id, instructions))
+        conn.execute("DELETE FROM thread_usage WHERE thread_id = ?", (thread_id,))
+        conn.execute("DELETE FROM thread_context WHERE thread_id = ?", (thread_id,))
+        conn.commit()
+
+    def stats(self):
+        return {"rotations": self.rotations, "failures": self.failures, "fallback_summaries": self.fallback_summaries}
+
+thread_rotator = ThreadRotator()
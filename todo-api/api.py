@@ -1,49 +1,21 @@
-from fastapi import FastAPI, HTTPException, Depends, Query, Header
-from pydantic import BaseModel
-from typing import List, Optional
-from sqlalchemy import create_engine, Column, Integer, String, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, declarative_base
+from fastapi import FastAPI, HTTPException, Depends, Path, Query, Header, Response
+from typing import Annotated, List, Optional
+from sqlalchemy.orm import Session
+from models import *
+import task_store
+from api_metrics import instrument_app
+import os
 import time
 
 app = FastAPI()
+instrument_app(app)
 
-DATABASE_URL = "sqlite:///./tasks.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./tasks.db")
 
-engine = create_engine(DATABASE_URL, pool_size=100, max_overflow=0)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+SessionLocal = task_store.create_session_factory(DATABASE_URL)
 
-class Task(Base):
-    __tablename__ = "tasks"
-
-    id = Column(Integer, primary_key=True, index=True)
-    chat_id = Column(String, index=True) 
-    title = Column(String, index=True)
-    description = Column(String, index=True, nullable=True)
-    completed = Column(Boolean, default=False)
-
-
-Base.metadata.create_all(bind=engine)
-
-class TaskBase(BaseModel):
-    title: str
-    description: Optional[str] = None
-    completed: Optional[bool] = False
-
-class TaskCreate(TaskBase):
-    pass
-
-class TaskUpdate(TaskBase):
-    title: Optional[str] = None
-    description: Optional[str] = None
-    completed: Optional[bool] = None
-
-class TaskInDB(TaskBase):
-    id: int
-
-    class Config:
-        orm_mode = True
+# IDs outside SQLite's integer range are rejected with a 422 rather than overflowing
+TaskIdPath = Annotated[int, Path(ge=1, le=MAX_TASK_ID)]
 
 def get_db(chat_id: str = Header(...)):
     db = SessionLocal()
@@ -51,58 +23,85 @@ def get_db(chat_id: str = Header(...)):
         yield db
     finally:
         db.close()
+
 @app.get("/api/tasks", response_model=List[TaskInDB])
 def get_tasks(
+    response: Response,
     completed: Optional[bool] = Query(None, description="Filter tasks by completion status"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of tasks to return"),
+    after_id: Optional[int] = Query(None, description="Return tasks with an ID greater than this (keyset pagination)"),
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     chat_id: str = Header(...)
 ):
-    query = db.query(Task).filter(Task.chat_id == chat_id)  # Filter by chat_id
-    if completed is not None:
-        query = query.filter(Task.completed == completed)
-    return query.all()
+    # The chat's version changes with every write, so an unchanged ETag means the
+    # client's copy is current and the task rows don't need to be read at all
+    etag = task_store.chat_etag(db, chat_id)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return task_store.list_tasks(db, chat_id, completed=completed, limit=limit, after_id=after_id)
+
+# Declared before /api/tasks/{task_id}, which would otherwise take "search" as an ID
+@app.get("/api/tasks/search", response_model=List[TaskInDB])
+def search_tasks(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to look for in task titles and descriptions"),
+    completed: Optional[bool] = Query(None, description="Filter tasks by completion status"),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS, description="Maximum number of tasks to return"),
+    db: Session = Depends(get_db),
+    chat_id: str = Header(...)
+):
+    return task_store.search_tasks(db, chat_id, TaskSearch(q=q, completed=completed, limit=limit))
 
 @app.get("/api/tasks/{task_id}", response_model=TaskInDB)
-def get_task(task_id: int, db: Session = Depends(get_db), chat_id: str = Header(...)):
-    task = db.query(Task).filter(Task.id == task_id, Task.chat_id == chat_id).first()
-    if task is None:
-        raise HTTPException(status_code=404, detail="Task not found")
-    return task
+def get_task(task_id: TaskIdPath, db: Session = Depends(get_db), chat_id: str = Header(...)):
+    try:
+        return task_store.get_task(db, chat_id, task_id)
+    except task_store.TaskNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 @app.post("/api/tasks", response_model=TaskInDB)
 def create_task(task: TaskCreate, db: Session = Depends(get_db), chat_id: str = Header(...)):
-    db_task = Task(chat_id=chat_id, title=task.title, description=task.description, completed=task.completed)
-    db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
-    return db_task
+    return task_store.create_task(db, chat_id, task)
 
 @app.put("/api/tasks/{task_id}", response_model=TaskInDB)
-def update_task(task_id: int, updated_task: TaskUpdate, db: Session = Depends(get_db), chat_id: str = Header(...)):
-    task = db.query(Task).filter(Task.id == task_id, Task.chat_id == chat_id).first()
-    if task is None:
-        raise HTTPException(status_code=404, detail="Task not found")
-    
-    if updated_task.title is not None:
-        task.title = updated_task.title
-    if updated_task.description is not None:
-        task.description = updated_task.description
-    if updated_task.completed is not None:
-        task.completed = updated_task.completed
-    
-    db.commit()
-    db.refresh(task)
-    return task
+def update_task(task_id: TaskIdPath, updated_task: TaskUpdate, db: Session = Depends(get_db), chat_id: str = Header(...)):
+    try:
+        return task_store.update_task(db, chat_id, task_id, updated_task)
+    except task_store.TaskNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 @app.delete("/api/tasks/{task_id}", response_model=TaskInDB)
-def delete_task(task_id: int, db: Session = Depends(get_db), chat_id: str = Header(...)):
-    task = db.query(Task).filter(Task.id == task_id, Task.chat_id == chat_id).first()
-    if task is None:
-        raise HTTPException(status_code=404, detail="Task not found")
-    
-    db.delete(task)
-    db.commit()
-    return task
+def delete_task(task_id: TaskIdPath, db: Session = Depends(get_db), chat_id: str = Header(...)):
+    try:
+        return task_store.delete_task(db, chat_id, task_id)
+    except task_store.TaskNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/api/tasks/bulk-create", response_model=List[BulkItemResult])
+def bulk_create_tasks(request: BulkCreateRequest, db: Session = Depends(get_db), chat_id: str = Header(...)):
+    return task_store.bulk_create_tasks(db, chat_id, request)
+
+@app.post("/api/tasks/bulk-update", response_model=List[BulkItemResult])
+def bulk_update_tasks(request: BulkUpdateRequest, db: Session = Depends(get_db), chat_id: str = Header(...)):
+    return task_store.bulk_update_tasks(db, chat_id, request)
+
+@app.post("/api/tasks/bulk-delete", response_model=List[BulkItemResult])
+def bulk_delete_tasks(request: BulkDeleteRequest, db: Session = Depends(get_db), chat_id: str = Header(...)):
+    return task_store.bulk_delete_tasks(db, chat_id, request)
+
+# The chat -> OpenAI thread mapping lives here so every bot worker sees the same one
+
+@app.get("/api/thread", response_model=ChatThreadInDB)
+def get_thread(db: Session = Depends(get_db), chat_id: str = Header(...)):
+    try:
+        return task_store.get_chat_thread(db, chat_id)
+    except task_store.TaskNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/api/thread", response_model=ChatThreadInDB)
+def claim_thread(claim: ChatThreadClaim, db: Session = Depends(get_db), chat_id: str = Header(...)):
+    return task_store.claim_chat_thread_id(db, chat_id, claim)
 
 if __name__ == "__main__":
     import uvicorn
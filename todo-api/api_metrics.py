@@ -0,0 +1,71 @@
+import functools
+import time
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+from sqlalchemy import event
+
+# Prometheus metrics shared by api.py and async_api.py: request latency per
+# route and SQL statement latency per operation, served on /metrics
+
+REQUEST_SECONDS = Histogram(
+    "todo_api_request_seconds", "Todo API request latency", ["method", "route", "status"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+DB_QUERY_SECONDS = Histogram(
+    "todo_api_db_query_seconds", "Todo database statement latency", ["operation", "table"],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0),
+)
+
+@functools.lru_cache(maxsize=512)
+def _statement_labels(statement):
+    words = statement.split()
+    upper = [word.upper() for word in words]
+    operation = upper[0] if upper else "UNKNOWN"
+    for keyword in ("FROM", "INTO", "UPDATE"):
+        if keyword in upper[:-1]:
+            return operation, words[upper.index(keyword) + 1].strip('"(').lower()
+    return operation, "-"
+
+def instrument_engine(engine):
+    """Time every statement run on `engine` (a sync Engine, or an AsyncEngine's sync_engine)."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["query_start"].pop()
+        DB_QUERY_SECONDS.labels(*_statement_labels(statement)).observe(duration)
+
+class RequestTimingMiddleware:
+    """Plain ASGI middleware, avoiding BaseHTTPMiddleware's per-request task overhead."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope, giving a bounded label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(time.perf_counter() - start)
+
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+def instrument_app(app):
+    app.add_middleware(RequestTimingMiddleware)
+    app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
@@ -0,0 +1,202 @@
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Path, Query, Header, Response
+from typing import Annotated, List, Optional
+from sqlalchemy import event, select, insert, update, delete
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from models import *
+from api_metrics import instrument_app, instrument_engine
+import os
+
+# Async variant of api.py: same routes and schema, but handlers run on the event
+# loop with aiosqlite instead of on Starlette's threadpool, and writes use
+# RETURNING instead of a refresh round trip after the commit
+
+DATABASE_URL = make_url(os.getenv("DATABASE_URL", "sqlite:///./tasks.db")).set(drivername="sqlite+aiosqlite")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# aiosqlite defaults to NullPool (a new connection per checkout); keep a small pool instead
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=DB_POOL_TIMEOUT,
+)
+event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+instrument_engine(engine.sync_engine)
+
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+TASK_COLUMNS = (Task.id, Task.title, Task.description, Task.completed)
+
+# IDs outside SQLite's integer range are rejected with a 422 rather than overflowing
+TaskIdPath = Annotated[int, Path(ge=1, le=MAX_TASK_ID)]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with engine.begin() as connection:
+        await connection.run_sync(migrate)
+    yield
+    await engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+instrument_app(app)
+
+async def get_db(chat_id: str = Header(...)):
+    async with SessionLocal() as db:
+        yield db
+
+def to_task(row):
+    return TaskInDB(id=row.id, title=row.title, description=row.description, completed=row.completed)
+
+def task_changes(updated_task: TaskUpdate):
+    return {
+        field: value
+        for field, value in updated_task.model_dump(include={"title", "description", "completed"}).items()
+        if value is not None
+    }
+
+async def update_returning(db: AsyncSession, chat_id: str, task_id: int, changes):
+    where = (Task.id == task_id, Task.chat_id == chat_id)
+    if changes:
+        stmt = update(Task).where(*where).values(**changes).returning(*TASK_COLUMNS)
+    else:
+        stmt = select(*TASK_COLUMNS).where(*where)
+    return (await db.execute(stmt)).first()
+
+@app.get("/api/tasks", response_model=List[TaskInDB])
+async def get_tasks(
+    response: Response,
+    completed: Optional[bool] = Query(None, description="Filter tasks by completion status"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of tasks to return"),
+    after_id: Optional[int] = Query(None, description="Return tasks with an ID greater than this (keyset pagination)"),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+    chat_id: str = Header(...)
+):
+    etag = make_etag((await db.execute(chat_version_query(chat_id))).scalar())
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    stmt = select(*TASK_COLUMNS).where(Task.chat_id == chat_id)
+    if completed is not None:
+        stmt = stmt.where(Task.completed == completed)
+    if after_id is not None:
+        stmt = stmt.where(Task.id > after_id)
+    stmt = stmt.order_by(Task.id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return [to_task(row) for row in await db.execute(stmt)]
+
+# Declared before /api/tasks/{task_id}, which would otherwise take "search" as an ID
+@app.get("/api/tasks/search", response_model=List[TaskInDB])
+async def search_tasks(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to look for in task titles and descriptions"),
+    completed: Optional[bool] = Query(None, description="Filter tasks by completion status"),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS, description="Maximum number of tasks to return"),
+    db: AsyncSession = Depends(get_db),
+    chat_id: str = Header(...)
+):
+    for match in search_match_expressions(chat_id, q):
+        rows = (await db.execute(search_tasks_query(chat_id, match, completed, limit))).all()
+        if rows:
+            return [to_task(row) for row in rows]
+    return []
+
+@app.get("/api/tasks/{task_id}", response_model=TaskInDB)
+async def get_task(task_id: TaskIdPath, db: AsyncSession = Depends(get_db), chat_id: str = Header(...)):
+    row = (await db.execute(select(*TASK_COLUMNS).where(Task.id == task_id, Task.chat_id == chat_id))).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return to_task(row)
+
+@app.post("/api/tasks", response_model=TaskInDB)
+async def create_task(task: TaskCreate, db: AsyncSession = Depends(get_db), chat_id: str = Header(...)):
+    stmt = insert(Task).values(
+        chat_id=chat_id, title=task.title, description=task.description, completed=task.completed
+    ).returning(*TASK_COLUMNS)
+    row = (await db.execute(stmt)).first()
+    await db.execute(bump_chat_version(chat_id))
+    await db.commit()
+    return to_task(row)
+
+@app.put("/api/tasks/{task_id}", response_model=TaskInDB)
+async def update_task(task_id: TaskIdPath, updated_task: TaskUpdate, db: AsyncSession = Depends(get_db), chat_id: str = Header(...)):
+    row = await update_returning(db, chat_id, task_id, task_changes(updated_task))
+    if row is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    await db.execute(bump_chat_version(chat_id))
+    await db.commit()
+    return to_task(row)
+
+@app.delete("/api/tasks/{task_id}", response_model=TaskInDB)
+async def delete_task(task_id: TaskIdPath, db: AsyncSession = Depends(get_db), chat_id: str = Header(...)):
+    stmt = delete(Task).where(Task.id == task_id, Task.chat_id == chat_id).returning(*TASK_COLUMNS)
+    row = (await db.execute(stmt)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    await db.execute(bump_chat_version(chat_id))
+    await db.commit()
+    return to_task(row)
+
+@app.post("/api/tasks/bulk-create", response_model=List[BulkItemResult])
+async def bulk_create_tasks(request: BulkCreateRequest, db: AsyncSession = Depends(get_db), chat_id: str = Header(...)):
+    values = [
+        {"chat_id": chat_id, "title": task.title, "description": task.description, "completed": task.completed}
+        for task in request.tasks
+    ]
+    rows = (await db.execute(insert(Task).returning(*TASK_COLUMNS, sort_by_parameter_order=True), values)).all()
+    await db.execute(bump_chat_version(chat_id))
+    await db.commit()
+    return [BulkItemResult(index=i, ok=True, task=to_task(row)) for i, row in enumerate(rows)]
+
+@app.post("/api/tasks/bulk-update", response_model=List[BulkItemResult])
+async def bulk_update_tasks(request: BulkUpdateRequest, db: AsyncSession = Depends(get_db), chat_id: str = Header(...)):
+    results = []
+    for i, item in enumerate(request.updates):
+        row = await update_returning(db, chat_id, item.task_id, task_changes(item))
+        if row is None:
+            results.append(BulkItemResult(index=i, ok=False, error=f"Task {item.task_id} not found"))
+        else:
+            results.append(BulkItemResult(index=i, ok=True, task=to_task(row)))
+    if any(result.ok for result in results):
+        await db.execute(bump_chat_version(chat_id))
+    await db.commit()
+    return results
+
+@app.post("/api/tasks/bulk-delete", response_model=List[BulkItemResult])
+async def bulk_delete_tasks(request: BulkDeleteRequest, db: AsyncSession = Depends(get_db), chat_id: str = Header(...)):
+    stmt = delete(Task).where(Task.chat_id == chat_id, Task.id.in_(set(request.task_ids))).returning(*TASK_COLUMNS)
+    deleted = {row.id: row for row in await db.execute(stmt)}
+    if deleted:
+        await db.execute(bump_chat_version(chat_id))
+    await db.commit()
+    results = []
+    for i, task_id in enumerate(request.task_ids):
+        row = deleted.pop(task_id, None)
+        if row is None:
+            results.append(BulkItemResult(index=i, ok=False, error=f"Task {task_id} not found"))
+        else:
+            results.append(BulkItemResult(index=i, ok=True, task=to_task(row)))
+    return results
+
+@app.get("/api/thread", response_model=ChatThreadInDB)
+async def get_thread(db: AsyncSession = Depends(get_db), chat_id: str = Header(...)):
+    thread_id = (await db.execute(chat_thread_query(chat_id))).scalar()
+    if thread_id is None:
+        raise HTTPException(status_code=404, detail="No thread stored for this chat")
+    return ChatThreadInDB(chat_id=chat_id, thread_id=thread_id)
+
+@app.post("/api/thread", response_model=ChatThreadInDB)
+async def claim_thread(claim: ChatThreadClaim, db: AsyncSession = Depends(get_db), chat_id: str = Header(...)):
+    await db.execute(claim_chat_thread(chat_id, claim.thread_id, claim.replaces))
+    await db.commit()
+    return ChatThreadInDB(chat_id=chat_id, thread_id=(await db.execute(chat_thread_query(chat_id))).scalar())
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8445)
@@ -0,0 +1,207 @@
+from pydantic import BaseModel, TypeAdapter, Field
+from typing import Annotated, List, Optional
+from sqlalchemy import select, text, update, Column, Integer, String, Boolean, Index
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import declarative_base
+import os
+import re
+import uuid
+
+# Schema and request/response models shared by the sync (api.py) and async
+# (async_api.py) services
+
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+MAX_PAGE_SIZE = 1000
+MAX_BULK_ITEMS = int(os.getenv("MAX_BULK_ITEMS", "100"))
+MAX_SEARCH_RESULTS = 100
+# Largest ID SQLite can store; bigger ones are rejected with a 422 instead of overflowing
+MAX_TASK_ID = 2**63 - 1
+TaskId = Annotated[int, Field(ge=1, le=MAX_TASK_ID)]
+TaskIdAdapter = TypeAdapter(TaskId)
+
+Base = declarative_base()
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")
+    cursor.execute("PRAGMA mmap_size=134217728")
+    cursor.close()
+
+class Task(Base):
+    __tablename__ = "tasks"
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(String)
+    title = Column(String)
+    description = Column(String, nullable=True)
+    completed = Column(Boolean, default=False)
+
+    # Serves the hot "tasks for this chat, optionally by completion" query in id order
+    __table_args__ = (Index("ix_tasks_chat_completed_id", "chat_id", "completed", "id"),)
+
+
+class ChatVersion(Base):
+    """Per-chat counter bumped by every write, used as the task listing's ETag."""
+    __tablename__ = "chat_versions"
+
+    chat_id = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class ChatThread(Base):
+    """The OpenAI thread of each chat, shared by every bot process."""
+    __tablename__ = "chat_threads"
+
+    chat_id = Column(String, primary_key=True)
+    thread_id = Column(String, nullable=False)
+
+def claim_chat_thread(chat_id, thread_id, replaces=None):
+    # The first thread stored for a chat wins; callers read back the stored one.
+    # With `replaces` it is a compare-and-swap, so two rotations can't both win
+    if replaces is not None:
+        return update(ChatThread).where(ChatThread.chat_id == chat_id, ChatThread.thread_id == replaces).values(thread_id=thread_id)
+    return sqlite_insert(ChatThread).values(chat_id=chat_id, thread_id=thread_id).on_conflict_do_nothing(index_elements=[ChatThread.chat_id])
+
+def chat_thread_query(chat_id):
+    return select(ChatThread.thread_id).where(ChatThread.chat_id == chat_id)
+
+# Changes on every start so ETags from a previous database (or a recreated one,
+# where versions restart) can never match by accident
+ETAG_EPOCH = uuid.uuid4().hex[:8]
+
+def bump_chat_version(chat_id):
+    stmt = sqlite_insert(ChatVersion).values(chat_id=chat_id, version=1)
+    return stmt.on_conflict_do_update(index_elements=[ChatVersion.chat_id], set_={"version": ChatVersion.version + 1})
+
+def chat_version_query(chat_id):
+    return select(ChatVersion.version).where(ChatVersion.chat_id == chat_id)
+
+def make_etag(version):
+    return f'"{ETAG_EPOCH}-{version or 0}"'
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+# Full-text index over each task's title and description. It reads its text from
+# the tasks table and triggers keep it in step with every write, whichever
+# service or process makes it. chat_id is indexed too, so a search only walks
+# the postings of the chat's own tasks; completion changes don't touch it
+FTS_TABLE = """CREATE VIRTUAL TABLE tasks_fts USING fts5(
+    chat_id, title, description, content='tasks', content_rowid='id',
+    tokenize='porter unicode61 remove_diacritics 2'
+)"""
+FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts (rowid, chat_id, title, description) VALUES (new.id, new.chat_id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, chat_id, title, description) VALUES ('delete', old.id, old.chat_id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF chat_id, title, description ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, chat_id, title, description) VALUES ('delete', old.id, old.chat_id, old.title, old.description);
+        INSERT INTO tasks_fts (rowid, chat_id, title, description) VALUES (new.id, new.chat_id, new.title, new.description);
+    END""",
+]
+
+def _fts_phrase(value):
+    return '"' + value.replace('"', '""') + '"'
+
+def search_match_expressions(chat_id, query):
+    """FTS5 MATCH expressions to try in turn: every word of `query` (as a prefix), then any of them.
+
+    The words are quoted, so operators or punctuation in the query can't break the syntax."""
+    terms = re.findall(r"\w+", query.lower())
+    if not terms:
+        return []
+    scope = f"chat_id : {_fts_phrase(chat_id)}"
+    expressions = [f"{scope} AND ({' AND '.join(_fts_phrase(term) + '*' for term in terms)})"]
+    if len(terms) > 1:
+        expressions.append(f"{scope} AND ({' OR '.join(_fts_phrase(term) + '*' for term in terms)})")
+    return expressions
+
+def search_tasks_query(chat_id, match, completed=None, limit=20):
+    # bm25 weights per column: chat_id (only a filter), title, description
+    sql = """SELECT tasks.id, tasks.title, tasks.description, tasks.completed
+             FROM tasks_fts JOIN tasks ON tasks.id = tasks_fts.rowid
+             WHERE tasks_fts MATCH :match AND tasks.chat_id = :chat_id"""
+    params = {"match": match, "chat_id": chat_id, "limit": limit}
+    if completed is not None:
+        sql += " AND tasks.completed = :completed"
+        params["completed"] = completed
+    return text(sql + " ORDER BY bm25(tasks_fts, 0.0, 10.0, 1.0) LIMIT :limit").bindparams(**params)
+
+# Indexes created by earlier versions of the schema. Title/description were never
+# queried and chat_id alone is covered by the composite index
+LEGACY_INDEXES = ["ix_tasks_id", "ix_tasks_chat_id", "ix_tasks_title", "ix_tasks_description"]
+
+def migrate(conn):
+    """Bring an existing tasks.db up to the current schema. Safe to run on every start."""
+    Base.metadata.create_all(bind=conn)
+    for index_name in LEGACY_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tasks_chat_completed_id ON tasks (chat_id, completed, id)"))
+    if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'tasks_fts'")).first() is None:
+        conn.execute(text(FTS_TABLE))
+        # Index the tasks written before the index existed
+        conn.execute(text("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')"))
+    for trigger in FTS_TRIGGERS:
+        conn.execute(text(trigger))
+    conn.execute(text("PRAGMA optimize"))
+
+class TaskBase(BaseModel):
+    title: str
+    description: Optional[str] = None
+    completed: Optional[bool] = False
+
+class TaskCreate(TaskBase):
+    pass
+
+class TaskUpdate(TaskBase):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    completed: Optional[bool] = None
+
+class TaskInDB(TaskBase):
+    id: int
+
+    class Config:
+        orm_mode = True
+
+class TaskBulkUpdate(TaskUpdate):
+    task_id: TaskId
+
+class BulkCreateRequest(BaseModel):
+    tasks: List[TaskCreate] = Field(..., min_length=1, max_length=MAX_BULK_ITEMS)
+
+class BulkUpdateRequest(BaseModel):
+    updates: List[TaskBulkUpdate] = Field(..., min_length=1, max_length=MAX_BULK_ITEMS)
+
+class BulkDeleteRequest(BaseModel):
+    task_ids: List[TaskId] = Field(..., min_length=1, max_length=MAX_BULK_ITEMS)
+
+class TaskSearch(BaseModel):
+    q: str = Field(..., min_length=1, max_length=200)
+    completed: Optional[bool] = None
+    limit: int = Field(20, ge=1, le=MAX_SEARCH_RESULTS)
+
+class ChatThreadClaim(BaseModel):
+    thread_id: str
+    # Only replace the chat's thread if it is still this one
+    replaces: Optional[str] = None
+
+class ChatThreadInDB(BaseModel):
+    chat_id: str
+    thread_id: str
+
+class BulkItemResult(BaseModel):
+    index: int
+    ok: bool
+    task: Optional[TaskInDB] = None
+    error: Optional[str] = None
@@ -0,0 +1,164 @@
+from typing import List, Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, Session
+from models import *
+from api_metrics import instrument_engine
+import os
+
+# Storage logic behind the sync API (api.py). The bot's embedded backend calls
+# these same functions in process, so both paths share one implementation
+
+# SQLite allows a single writer at a time, so only a handful of connections are
+# kept open; WAL lets readers proceed during writes. Checkouts beyond the pool open
+# a short-lived extra connection instead of blocking: FastAPI serialises sync
+# responses and runs dependency teardown on the same worker threads that would be
+# waiting on the pool, so a blocking checkout can deadlock under load
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "-1"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+class TaskNotFound(LookupError):
+    pass
+
+def create_session_factory(database_url):
+    """Create the engine for `database_url`, bring the schema up to date and return a session factory."""
+    engine = create_engine(
+        database_url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        connect_args={"check_same_thread": False},
+    )
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    instrument_engine(engine)
+    with engine.begin() as connection:
+        migrate(connection)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def to_task(task: Task) -> TaskInDB:
+    return TaskInDB.model_validate(task, from_attributes=True)
+
+def _find_task(db: Session, chat_id: str, task_id: int) -> Task:
+    task = db.query(Task).filter(Task.id == task_id, Task.chat_id == chat_id).first()
+    if task is None:
+        raise TaskNotFound("Task not found")
+    return task
+
+def chat_etag(db: Session, chat_id: str) -> str:
+    return make_etag(db.execute(chat_version_query(chat_id)).scalar())
+
+def list_tasks(db: Session, chat_id: str, completed: Optional[bool] = None, limit: Optional[int] = None, after_id: Optional[int] = None) -> List[TaskInDB]:
+    query = db.query(Task).filter(Task.chat_id == chat_id)
+    if completed is not None:
+        query = query.filter(Task.completed == completed)
+    if after_id is not None:
+        query = query.filter(Task.id > after_id)
+    query = query.order_by(Task.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [to_task(task) for task in query]
+
+def search_tasks(db: Session, chat_id: str, search: TaskSearch) -> List[TaskInDB]:
+    """Best matches first; tasks matching every word, or failing that any word."""
+    for match in search_match_expressions(chat_id, search.q):
+        rows = db.execute(search_tasks_query(chat_id, match, search.completed, search.limit)).all()
+        if rows:
+            return [TaskInDB(id=row.id, title=row.title, description=row.description, completed=row.completed) for row in rows]
+    return []
+
+def get_task(db: Session, chat_id: str, task_id: int) -> TaskInDB:
+    return to_task(_find_task(db, chat_id, task_id))
+
+def create_task(db: Session, chat_id: str, task: TaskCreate) -> TaskInDB:
+    db_task = Task(chat_id=chat_id, title=task.title, description=task.description, completed=task.completed)
+    db.add(db_task)
+    db.execute(bump_chat_version(chat_id))
+    db.flush()
+    result = to_task(db_task)
+    db.commit()
+    return result
+
+def _apply_update(task: Task, changes: TaskUpdate):
+    if changes.title is not None:
+        task.title = changes.title
+    if changes.description is not None:
+        task.description = changes.description
+    if changes.completed is not None:
+        task.completed = changes.completed
+
+def update_task(db: Session, chat_id: str, task_id: int, updated_task: TaskUpdate) -> TaskInDB:
+    task = _find_task(db, chat_id, task_id)
+    _apply_update(task, updated_task)
+    db.execute(bump_chat_version(chat_id))
+    db.flush()
+    result = to_task(task)
+    db.commit()
+    return result
+
+def delete_task(db: Session, chat_id: str, task_id: int) -> TaskInDB:
+    task = _find_task(db, chat_id, task_id)
+    result = to_task(task)
+    db.delete(task)
+    db.execute(bump_chat_version(chat_id))
+    db.commit()
+    return result
+
+def get_chat_thread(db: Session, chat_id: str) -> ChatThreadInDB:
+    thread_id = db.execute(chat_thread_query(chat_id)).scalar()
+    if thread_id is None:
+        raise TaskNotFound("No thread stored for this chat")
+    return ChatThreadInDB(chat_id=chat_id, thread_id=thread_id)
+
+def claim_chat_thread_id(db: Session, chat_id: str, claim: ChatThreadClaim) -> ChatThreadInDB:
+    """Store `claim.thread_id` unless the chat already has a thread (or, with
+    `claim.replaces`, unless its thread has changed). Returns the stored mapping."""
+    db.execute(claim_chat_thread(chat_id, claim.thread_id, claim.replaces))
+    db.commit()
+    return ChatThreadInDB(chat_id=chat_id, thread_id=db.execute(chat_thread_query(chat_id)).scalar())
+
+# Bulk operations apply every item in one transaction and one commit, and report a
+# result per item so a missing ID doesn't fail the rest of the batch
+
+def bulk_create_tasks(db: Session, chat_id: str, request: BulkCreateRequest) -> List[BulkItemResult]:
+    db_tasks = [
+        Task(chat_id=chat_id, title=task.title, description=task.description, completed=task.completed)
+        for task in request.tasks
+    ]
+    db.add_all(db_tasks)
+    db.execute(bump_chat_version(chat_id))
+    db.flush()
+    # Serialise before the commit expires the instances, avoiding a refresh per task
+    results = [BulkItemResult(index=i, ok=True, task=to_task(task)) for i, task in enumerate(db_tasks)]
+    db.commit()
+    return results
+
+def bulk_update_tasks(db: Session, chat_id: str, request: BulkUpdateRequest) -> List[BulkItemResult]:
+    task_ids = {update.task_id for update in request.updates}
+    tasks = {task.id: task for task in db.query(Task).filter(Task.chat_id == chat_id, Task.id.in_(task_ids))}
+    results = []
+    for i, update in enumerate(request.updates):
+        task = tasks.get(update.task_id)
+        if task is None:
+            results.append(BulkItemResult(index=i, ok=False, error=f"Task {update.task_id} not found"))
+            continue
+        _apply_update(task, update)
+        results.append(BulkItemResult(index=i, ok=True, task=to_task(task)))
+    if any(result.ok for result in results):
+        db.execute(bump_chat_version(chat_id))
+    db.commit()
+    return results
+
+def bulk_delete_tasks(db: Session, chat_id: str, request: BulkDeleteRequest) -> List[BulkItemResult]:
+    tasks = {task.id: task for task in db.query(Task).filter(Task.chat_id == chat_id, Task.id.in_(set(request.task_ids)))}
+    results = []
+    for i, task_id in enumerate(request.task_ids):
+        task = tasks.pop(task_id, None)
+        if task is None:
+            results.append(BulkItemResult(index=i, ok=False, error=f"Task {task_id} not found"))
+            continue
+        results.append(BulkItemResult(index=i, ok=True, task=to_task(task)))
+        db.delete(task)
+    if any(result.ok for result in results):
+        db.execute(bump_chat_version(chat_id))
+    db.commit()
+    return results
@@ -0,0 +1,398 @@
+import abc
+import aiohttp
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import sys
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from resilience import todo_api
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any
+
+load_dotenv()
+
+# Which backend TodoAPIHelper talks to: "http" calls the Todo API over the network,
+# "embedded" runs the API's storage code in this process against the same database
+TODO_BACKEND = os.getenv("TODO_BACKEND", "http")
+
+BASE_URL = os.getenv("BASE_URL")
+
+# Embedded backend: where todo-api/ lives and which database it should open. The
+# default is the file api.py creates when started from inside todo-api/
+TODO_API_DIR = os.getenv("TODO_API_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "todo-api"))
+TODO_DATABASE_URL = os.getenv("TODO_DATABASE_URL", f"sqlite:///{os.path.join(TODO_API_DIR, 'tasks.db')}")
+
+# Shared HTTP connection pool for the Todo API, opened/closed by the bot's
+# post_init/post_shutdown hooks so connections are kept alive across tool calls
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+
+_http_session: Optional[aiohttp.ClientSession] = None
+
+class TodoAPIError(Exception):
+    """A request the Todo API rejected, raised the same way by every backend."""
+
+    def __init__(self, status, detail):
+        super().__init__(f"Todo API error {status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+async def open_http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT, sock_connect=HTTP_CONNECT_TIMEOUT)
+        _http_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        logging.info(f"Opened HTTP connection pool (limit={HTTP_POOL_LIMIT}, per host={HTTP_POOL_LIMIT_PER_HOST})")
+    return _http_session
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+        logging.info("Closed HTTP connection pool")
+    _http_session = None
+
+async def raise_for_status(response: aiohttp.ClientResponse):
+    if response.status < 400:
+        return
+    try:
+        detail = (await response.json()).get("detail")
+    except (aiohttp.ContentTypeError, ValueError, AttributeError):
+        detail = await response.text()
+    raise TodoAPIError(response.status, detail)
+
+async def fetch(url: str, params: Dict[str, str] = None, headers: Dict[str, str] = None) -> Dict[str, Any]:
+    async def attempt():
+        session = await open_http_session()
+        async with session.get(url, params=params, headers=headers) as response:
+            await raise_for_status(response)
+            return await response.json()
+    return await todo_api.call(attempt, idempotent=True)
+
+async def fetch_conditional(url: str, params: Dict[str, str] = None, headers: Dict[str, str] = None, etag: Optional[str] = None):
+    """GET with If-None-Match. Returns (body, etag), with body None when the server answered 304."""
+    if etag is not None:
+        headers = dict(headers or {}, **{"If-None-Match": etag})
+
+    async def attempt():
+        session = await open_http_session()
+        async with session.get(url, params=params, headers=headers) as response:
+            if response.status == 304:
+                return None, etag
+            await raise_for_status(response)
+            return await response.json(), response.headers.get("ETag")
+    return await todo_api.call(attempt, idempotent=True)
+
+# POST and DELETE are only retried when the request never got out, unless the caller
+# knows better: a repeated create adds a duplicate task, a repeated delete reports a
+# 404 for a task it removed
+async def post(url: str, data: Dict[str, Any], headers: Dict[str, str] = None, idempotent: bool = False) -> Dict[str, Any]:
+    async def attempt():
+        session = await open_http_session()
+        async with session.post(url, json=data, headers=headers) as response:
+            await raise_for_status(response)
+            return await response.json()
+    return await todo_api.call(attempt, idempotent=idempotent)
+
+async def put(url: str, data: Dict[str, Any], headers: Dict[str, str] = None) -> Dict[str, Any]:
+    async def attempt():
+        session = await open_http_session()
+        async with session.put(url, json=data, headers=headers) as response:
+            await raise_for_status(response)
+            return await response.json()
+    return await todo_api.call(attempt, idempotent=True)
+
+async def delete(url: str, headers: Dict[str, str] = None) -> Dict[str, Any]:
+    async def attempt():
+        session = await open_http_session()
+        async with session.delete(url, headers=headers) as response:
+            await raise_for_status(response)
+            return await response.json()
+    return await todo_api.call(attempt)
+
+class TodoBackend(abc.ABC):
+    """Task storage as seen by TodoAPIHelper.
+
+    Every method takes the chat ID explicitly and returns plain JSON-style
+    dicts/lists, so callers can't tell which backend served them. Failures
+    are raised as TodoAPIError.
+    """
+
+    name = None
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    async def list_tasks(self, chat_id, params=None, etag=None):
+        """Returns (tasks, etag), with tasks None when `etag` is still current."""
+
+    @abc.abstractmethod
+    async def search_tasks(self, chat_id, params):
+        """Tasks matching params["q"], best first; also takes "completed" and "limit"."""
+
+    @abc.abstractmethod
+    async def get_task(self, chat_id, task_id):
+        ...
+
+    @abc.abstractmethod
+    async def create_task(self, chat_id, data):
+        ...
+
+    @abc.abstractmethod
+    async def update_task(self, chat_id, task_id, data):
+        ...
+
+    @abc.abstractmethod
+    async def delete_task(self, chat_id, task_id):
+        ...
+
+    @abc.abstractmethod
+    async def bulk_create_tasks(self, chat_id, tasks):
+        ...
+
+    @abc.abstractmethod
+    async def bulk_update_tasks(self, chat_id, updates):
+        ...
+
+    @abc.abstractmethod
+    async def bulk_delete_tasks(self, chat_id, task_ids):
+        ...
+
+    # The chat -> OpenAI thread mapping is kept beside the tasks so that every bot
+    # process, on any machine, resolves a chat to the same thread
+
+    @abc.abstractmethod
+    async def get_thread(self, chat_id):
+        """Returns the chat's stored thread ID, or None."""
+
+    @abc.abstractmethod
+    async def claim_thread(self, chat_id, thread_id, replaces=None):
+        """Store `thread_id` unless the chat already has one (or, with `replaces`, unless
+        its thread is no longer `replaces`); returns the stored thread ID."""
+
+class HTTPBackend(TodoBackend):
+    name = "http"
+
+    def __init__(self, base_url=BASE_URL):
+        self.base_url = base_url
+
+    @staticmethod
+    def _headers(chat_id):
+        return {"chat-id": str(chat_id)}
+
+    @staticmethod
+    def _query(params):
+        # aiohttp only takes strings and numbers as query values; None means "not given"
+        return {
+            key: str(value).lower() if isinstance(value, bool) else value
+            for key, value in (params or {}).items() if value is not None
+        }
+
+    async def start(self):
+        await open_http_session()
+
+    async def close(self):
+        await close_http_session()
+
+    async def list_tasks(self, chat_id, params=None, etag=None):
+        return await fetch_conditional(f"{self.base_url}/tasks", params=self._query(params), headers=self._headers(chat_id), etag=etag)
+
+    async def search_tasks(self, chat_id, params):
+        return await fetch(f"{self.base_url}/tasks/search", params=self._query(params), headers=self._headers(chat_id))
+
+    async def get_task(self, chat_id, task_id):
+        return await fetch(f"{self.base_url}/tasks/{task_id}", headers=self._headers(chat_id))
+
+    async def create_task(self, chat_id, data):
+        return await post(f"{self.base_url}/tasks", data, headers=self._headers(chat_id))
+
+    async def update_task(self, chat_id, task_id, data):
+        return await put(f"{self.base_url}/tasks/{task_id}", data, headers=self._headers(chat_id))
+
+    async def delete_task(self, chat_id, task_id):
+        return await delete(f"{self.base_url}/tasks/{task_id}", headers=self._headers(chat_id))
+
+    async def bulk_create_tasks(self, chat_id, tasks):
+        return await post(f"{self.base_url}/tasks/bulk-create", {"tasks": tasks}, headers=self._headers(chat_id))
+
+    async def bulk_update_tasks(self, chat_id, updates):
+        return await post(f"{self.base_url}/tasks/bulk-update", {"updates": updates}, headers=self._headers(chat_id),
+                          idempotent=True)
+
+    async def bulk_delete_tasks(self, chat_id, task_ids):
+        return await post(f"{self.base_url}/tasks/bulk-delete", {"task_ids": task_ids}, headers=self._headers(chat_id))
+
+    async def get_thread(self, chat_id):
+        try:
+            return (await fetch(f"{self.base_url}/thread", headers=self._headers(chat_id)))["thread_id"]
+        except TodoAPIError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    async def claim_thread(self, chat_id, thread_id, replaces=None):
+        claim = {"thread_id": thread_id, "replaces": replaces}
+        return (await post(f"{self.base_url}/thread", claim, headers=self._headers(chat_id), idempotent=True))["thread_id"]
+
+class EmbeddedBackend(TodoBackend):
+    """Runs todo-api's task_store functions in this process, skipping HTTP and JSON.
+
+    Calls run one at a time on a dedicated database thread, so a slow commit
+    or a lock wait never stalls the event loop; a call takes about a
+    millisecond. The database can still be shared with a running api.py:
+    SQLite's locking and the per-chat versions keep both sides' ETags
+    consistent, and a writer held up by the other process only delays task
+    calls, not every chat.
+    """
+
+    name = "embedded"
+
+    def __init__(self, database_url=TODO_DATABASE_URL, api_dir=TODO_API_DIR):
+        self.database_url = database_url
+        self.api_dir = api_dir
+        self._sessions = None
+        self._executor = None
+
+    async def _run(self, function, *args, **kwargs):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="todo-db")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def start(self):
+        await self._run(self._session_factory)
+
+    async def close(self):
+        if self._sessions is not None:
+            await self._run(self._sessions.kw["bind"].dispose)
+            self._sessions = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _session_factory(self):
+        if self._sessions is None:
+            if self.api_dir not in sys.path:
+                sys.path.insert(0, self.api_dir)
+            import models
+            import task_store
+            self.models = models
+            self.task_store = task_store
+            self._sessions = task_store.create_session_factory(self.database_url)
+            logging.info(f"Embedded Todo backend using {self.database_url}")
+        return self._sessions
+
+    async def _call(self, operation, chat_id, *args, request=None, body=None):
+        """Run a task_store operation, validating `body` into `request` the way FastAPI would."""
+        return await self._run(self._call_sync, operation, chat_id, *args, request=request, body=body)
+
+    def _call_sync(self, operation, chat_id, *args, request=None, body=None):
+        sessions = self._session_factory()
+        with self._errors():
+            if request is not None:
+                args += (request.model_validate(body),)
+            with sessions() as db:
+                return operation(db, str(chat_id), *args)
+
+    @contextlib.contextmanager
+    def _errors(self):
+        """Raise failures as the TodoAPIError api.py would have answered with."""
+        try:
+            yield
+        except ValidationError as e:
+            raise TodoAPIError(422, e.errors(include_url=False))
+        except OverflowError as e:
+            # An integer too big for SQLite; api.py rejects these before they reach the database
+            raise TodoAPIError(422, str(e))
+        except self.task_store.TaskNotFound as e:
+            raise TodoAPIError(404, str(e))
+        except OperationalError as e:
+            # Usually the database being locked by the other process for too long
+            logging.warning(f"Embedded Todo backend database error: {e}")
+            raise TodoAPIError(503, "Database unavailable")
+        except SQLAlchemyError as e:
+            logging.exception("Embedded Todo backend query failed")
+            raise TodoAPIError(500, "Internal Server Error")
+
+    def _task_id(self, task_id):
+        """Validate a task ID the way api.py validates its path parameter."""
+        self._session_factory()
+        with self._errors():
+            return self.models.TaskIdAdapter.validate_python(task_id)
+
+    @staticmethod
+    def _dump(result):
+        if isinstance(result, list):
+            return [item.model_dump() for item in result]
+        return result.model_dump()
+
+    async def list_tasks(self, chat_id, params=None, etag=None):
+        return await self._run(self._list_tasks, chat_id, params, etag)
+
+    def _list_tasks(self, chat_id, params, etag):
+        sessions = self._session_factory()
+        with self._errors(), sessions() as db:
+            current = self.task_store.chat_etag(db, str(chat_id))
+            if self.models.etag_matches(etag, current):
+                return None, etag
+            return self._dump(self.task_store.list_tasks(db, str(chat_id), **(params or {}))), current
+
+    async def search_tasks(self, chat_id, params):
+        return self._dump(await self._call(self.task_store.search_tasks, chat_id, request=self.models.TaskSearch, body=params))
+
+    async def get_task(self, chat_id, task_id):
+        return self._dump(await self._call(self.task_store.get_task, chat_id, self._task_id(task_id)))
+
+    async def create_task(self, chat_id, data):
+        return self._dump(await self._call(self.task_store.create_task, chat_id, request=self.models.TaskCreate, body=data))
+
+    async def update_task(self, chat_id, task_id, data):
+        return self._dump(await self._call(self.task_store.update_task, chat_id, self._task_id(task_id), request=self.models.TaskUpdate, body=data))
+
+    async def delete_task(self, chat_id, task_id):
+        return self._dump(await self._call(self.task_store.delete_task, chat_id, self._task_id(task_id)))
+
+    async def bulk_create_tasks(self, chat_id, tasks):
+        return self._dump(await self._call(self.task_store.bulk_create_tasks, chat_id, request=self.models.BulkCreateRequest, body={"tasks": tasks}))
+
+    async def bulk_update_tasks(self, chat_id, updates):
+        return self._dump(await self._call(self.task_store.bulk_update_tasks, chat_id, request=self.models.BulkUpdateRequest, body={"updates": updates}))
+
+    async def bulk_delete_tasks(self, chat_id, task_ids):
+        return self._dump(await self._call(self.task_store.bulk_delete_tasks, chat_id, request=self.models.BulkDeleteRequest, body={"task_ids": task_ids}))
+
+    async def get_thread(self, chat_id):
+        try:
+            return (await self._call(self.task_store.get_chat_thread, chat_id)).thread_id
+        except TodoAPIError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    async def claim_thread(self, chat_id, thread_id, replaces=None):
+        claim = {"thread_id": thread_id, "replaces": replaces}
+        return (await self._call(self.task_store.claim_chat_thread_id, chat_id, request=self.models.ChatThreadClaim, body=claim)).thread_id
+
+TODO_BACKENDS = {backend.name: backend for backend in (HTTPBackend, EmbeddedBackend)}
+
+def create_todo_backend(name=TODO_BACKEND):
+    if name not in TODO_BACKENDS:
+        raise ValueError(f"Unknown TODO_BACKEND {name!r}, expected one of {sorted(TODO_BACKENDS)}")
+    return TODO_BACKENDS[name]()
+
+todo_backend = create_todo_backend()
@@ -0,0 +1,119 @@
+import json
+import os
+
+# How tool results are sent back to the assistant:
+#   "table" lists as a header row plus one "|"-separated row per item (a "|", newline or
+#           backslash inside a value is escaped as \|, \n or \\), objects as minified JSON
+#   "json"  minified JSON throughout
+#   "repr"  Python's str() of the result, as before, with no projection or limits
+TOOL_OUTPUT_FORMAT = os.getenv("TOOL_OUTPUT_FORMAT", "table")
+# Task fields the assistant sees, in this order
+TOOL_OUTPUT_FIELDS = [field.strip() for field in os.getenv("TOOL_OUTPUT_FIELDS", "id,title,description,completed").split(",") if field.strip()]
+# Longer descriptions are cut here and end with "…"; get_task still returns them whole
+TOOL_OUTPUT_DESCRIPTION_CHARS = int(os.getenv("TOOL_OUTPUT_DESCRIPTION_CHARS", "120"))
+# Hard cap on one tool output; rows past it are replaced by a "more results" marker
+TOOL_OUTPUT_MAX_CHARS = int(os.getenv("TOOL_OUTPUT_MAX_CHARS", "6000"))
+
+# Keys of bulk operation results, kept alongside the task fields
+RESULT_FIELDS = ["index", "ok", "error"]
+
+def estimate_tokens(text):
+    # About four characters per token for English text and JSON
+    return (len(text) + 3) // 4
+
+def _shorten(value, limit):
+    if isinstance(value, str) and limit and len(value) > limit:
+        return value[:limit - 1].rstrip() + "…"
+    return value
+
+def _project(item, fields, description_chars):
+    """Flatten a task, or a bulk result wrapping one, into the configured fields."""
+    if not isinstance(item, dict):
+        return item
+    flat = dict(item.get("task") or {}, **{key: value for key, value in item.items() if key != "task"})
+    # Empty fields are left out rather than sent as nulls
+    return {
+        field: _shorten(flat[field], description_chars) if field == "description" else flat[field]
+        for field in RESULT_FIELDS + fields if flat.get(field) is not None
+    }
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    # Escaped rather than replaced, so the assistant can copy a value back unchanged
+    return str(value).replace("\\", "\\\\").replace("|", "\\|").replace("\n", "\\n")
+
+def _more(count):
+    return f"… {count} more not shown"
+
+def _table(rows, max_chars):
+    # Columns that are empty everywhere (e.g. "error" when every item succeeded) are left out
+    columns = [column for column in RESULT_FIELDS + TOOL_OUTPUT_FIELDS if any(column in row for row in rows)]
+    lines = ["|".join(columns)]
+    size = len(lines[0])
+    for shown, row in enumerate(rows):
+        line = "|".join(_cell(row.get(column)) for column in columns)
+        if max_chars and size + len(line) + 1 + len(_more(len(rows))) + 1 > max_chars:
+            lines.append(_more(len(rows) - shown))
+            break
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+def _fit(item, max_chars):
+    """Encode an object, shortening its longest text fields until it fits in `max_chars`.
+    Whole fields are cut rather than the encoding, so the result stays valid JSON."""
+    encoded = _dumps(item)
+    while max_chars and len(encoded) > max_chars and isinstance(item, dict):
+        texts = [key for key, value in item.items() if isinstance(value, str) and len(value) > 1]
+        if not texts:
+            break
+        key = max(texts, key=lambda key: len(item[key]))
+        value = item[key]
+        # Longest cut of this field that fits; escaping makes the encoded length uneven
+        low, high = 1, len(value) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if len(_dumps(dict(item, **{key: _shorten(value, middle)}))) <= max_chars:
+                low = middle
+            else:
+                high = middle - 1
+        item = dict(item, **{key: _shorten(value, low)})
+        encoded = _dumps(item)
+    return encoded
+
+def _json_list(rows, max_chars):
+    encoded = []
+    size = 2
+    for shown, row in enumerate(rows):
+        item = _dumps(row)
+        if max_chars and size + len(item) + 1 + len(_more(len(rows))) + 3 > max_chars:
+            encoded.append(_dumps(_more(len(rows) - shown)))
+            break
+        encoded.append(item)
+        size += len(item) + 1
+    return "[" + ",".join(encoded) + "]"
+
+def encode_tool_output(result, omit=(), output_format=None, max_chars=None, description_chars=None):
+    """Encode a tool result for submit_tool_outputs. `omit` drops fields the call already implies,
+    such as "completed" when only open tasks were asked for; `description_chars=0` keeps
+    descriptions whole."""
+    output_format = output_format or TOOL_OUTPUT_FORMAT
+    max_chars = TOOL_OUTPUT_MAX_CHARS if max_chars is None else max_chars
+    description_chars = TOOL_OUTPUT_DESCRIPTION_CHARS if description_chars is None else description_chars
+    if output_format == "repr":
+        return str(result)
+    fields = [field for field in TOOL_OUTPUT_FIELDS if field not in omit]
+    if isinstance(result, list):
+        rows = [_project(item, fields, description_chars) for item in result]
+        if output_format == "table" and all(isinstance(row, dict) for row in rows):
+            if not rows:
+                return "(none)"
+            return _table(rows, max_chars)
+        return _json_list(rows, max_chars)
+    return _fit(_project(result, fields, description_chars), max_chars)
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+import time
+from sqlite3 import Error
+from bot_helper import CHATS_DB, open_shared_connection, release_shared_connection, run_in_db_thread
+
+# Voice-note transcripts kept, keyed by Telegram's file_unique_id. The least
+# recently used ones are dropped beyond this
+TRANSCRIPT_CACHE_SIZE = int(os.getenv("TRANSCRIPT_CACHE_SIZE", "5000"))
+TRANSCRIPT_DB = os.getenv("TRANSCRIPT_DB", CHATS_DB)
+
+class TranscriptCache:
+    """Persistent LRU cache of transcripts so the same voice note is only transcribed once.
+
+    Forwarded and re-sent voice notes keep their file_unique_id, so a hit skips
+    the download and the transcription entirely. Concurrent requests for the same
+    note share one pending transcription.
+    """
+
+    def __init__(self, db_file=TRANSCRIPT_DB, max_entries=TRANSCRIPT_CACHE_SIZE):
+        self.db_file = db_file
+        self.max_entries = max_entries
+        self._conn = None
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self):
+        if self._conn is None:
+            self._conn = open_shared_connection(self.db_file, [
+                '''CREATE TABLE IF NOT EXISTS transcripts
+                   (file_unique_id TEXT PRIMARY KEY, transcript TEXT, used_at REAL)''',
+            ])
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            release_shared_connection(self.db_file)
+            self._conn = None
+
+    def lookup(self, file_unique_id):
+        conn = self.connect()
+        row = conn.execute("SELECT transcript FROM transcripts WHERE file_unique_id = ?", (file_unique_id,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE transcripts SET used_at = ? WHERE file_unique_id = ?", (time.time(), file_unique_id))
+        conn.commit()
+        return row[0]
+
+    def store(self, file_unique_id, transcript):
+        conn = self.connect()
+        conn.execute("INSERT OR REPLACE INTO transcripts (file_unique_id, transcript, used_at) VALUES (?, ?, ?)",
+                     (file_unique_id, transcript, time.time()))
+        conn.execute('''DELETE FROM transcripts WHERE file_unique_id NOT IN
+                        (SELECT file_unique_id FROM transcripts ORDER BY used_at DESC LIMIT ?)''', (self.max_entries,))
+        conn.commit()
+
+    async def _transcribe(self, file_unique_id, transcribe):
+        transcript = await transcribe()
+        try:
+            await run_in_db_thread(self.store, file_unique_id, transcript)
+        except Error as e:
+            logging.error(f"Could not cache transcript: {e}")
+        return transcript
+
+    async def get_or_transcribe(self, file_unique_id, transcribe):
+        """Return the cached transcript, or await `transcribe()` (a coroutine function) and cache its result."""
+        try:
+            transcript = await run_in_db_thread(self.lookup, file_unique_id)
+        except Error as e:
+            logging.error(f"Transcript cache lookup failed: {e}")
+            transcript = None
+        if transcript is not None:
+            self.hits += 1
+            logging.info(f"Reusing cached transcript for voice note {file_unique_id}")
+            return transcript
+
+        pending = self._pending.get(file_unique_id)
+        if pending is None:
+            self.misses += 1
+            pending = asyncio.ensure_future(self._transcribe(file_unique_id, transcribe))
+            self._pending[file_unique_id] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(file_unique_id, None))
+        else:
+            self.hits += 1
+        return await asyncio.shield(pending)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+transcript_cache = TranscriptCache()